@@ -0,0 +1,164 @@
+# DTE Aerial Photo Collection curation project
+# Benchmark comparing the extraction backends on a directory of PDFs or a synthetic corpus
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# time.perf_counter documentation: https://docs.python.org/3/library/time.html#time.perf_counter
+# resource documentation: https://docs.python.org/3/library/resource.html
+
+# Every available backend registered in extraction_backends.py is run over the same PDFs, in its own freshly started process
+# so its peak resident set size (RSS) is measured separately. For each backend, the script reports throughput (files and
+# megabytes of PDF per second), per-file latency for index and image PDFs, peak RSS, and any records that do not match the
+# shared record schema. The 'pypdf2' backend is the baseline for the speedup column.
+
+# standard modules
+import io
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import statistics
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# local modules
+import extraction_backends
+import synthetic_corpus
+import misc_functions
+
+# global variables
+# Number of times each file is processed by each backend
+REPETITIONS = 3
+# Size of the synthetic corpus generated when the input path is 'synthetic'
+SYNTHETIC_IMAGE_COUNT = 50
+SYNTHETIC_IMAGE_FILE_SIZE = 4 * 1024 * 1024
+BASELINE_BACKEND = 'pypdf2'
+
+## Functions
+
+# Find the peak resident set size of the current process (or, with resource.RUSAGE_CHILDREN, of its largest finished child process)
+# in megabytes (ru_maxrss is in kilobytes on Linux and bytes on macOS)
+def find_peak_rss(who=resource.RUSAGE_SELF):
+    peak_rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+# Time one backend on each PDF file, writing JPEGs to a temporary directory. This runs in a separate process for each backend.
+# Returns: dictionary with per-file latencies in seconds for index and image PDFs, the bytes of PDF processed, peak RSS, and schema problems
+def time_backend(backend_name, pdf_file_paths, repetitions=REPETITIONS):
+    backend = extraction_backends.get_backend(backend_name)
+    output_location = tempfile.mkdtemp() + '/'
+    latencies = {'Index': [], 'Image': []}
+    bytes_processed = 0
+    schema_problems = []
+    for repetition in range(repetitions):
+        for pdf_file_path in pdf_file_paths:
+            pdf_type = 'Index' if 'Index' in pdf_file_path else 'Image'
+            # Output from the extraction functions is suppressed so printing does not count toward the latency
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                if pdf_type == 'Index':
+                    record = backend['Index Function'](pdf_file_path)
+                else:
+                    record = backend['Image Function'](pdf_file_path, output_location)
+                elapsed = time.perf_counter() - start
+            latencies[pdf_type].append(elapsed)
+            bytes_processed += os.path.getsize(pdf_file_path)
+            if repetition == 0:
+                schema_problems.extend(extraction_backends.check_record_schema(record, pdf_type))
+    shutil.rmtree(output_location)
+    return {'Latencies': latencies, 'Bytes': bytes_processed, 'Peak RSS (MB)': find_peak_rss(), 'Schema Problems': schema_problems}
+
+# Summarize a list of latencies in milliseconds
+def summarize_latencies(latencies):
+    if len(latencies) == 0:
+        return None
+    sorted_latencies = sorted(latencies)
+    return {
+        'Files': len(latencies),
+        'Mean (ms)': statistics.mean(latencies) * 1000,
+        'Median (ms)': statistics.median(latencies) * 1000,
+        '95th Percentile (ms)': sorted_latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+    }
+
+# Summarize the timing results of a backend
+def summarize_backend_results(timing_results):
+    all_latencies = timing_results['Latencies']['Index'] + timing_results['Latencies']['Image']
+    seconds = sum(all_latencies)
+    return {
+        'Files': len(all_latencies),
+        'Files per Second': len(all_latencies) / seconds if seconds > 0 else 0.0,
+        'MB per Second': timing_results['Bytes'] / (1024 * 1024) / seconds if seconds > 0 else 0.0,
+        'Peak RSS (MB)': timing_results['Peak RSS (MB)'],
+        'Index': summarize_latencies(timing_results['Latencies']['Index']),
+        'Image': summarize_latencies(timing_results['Latencies']['Image']),
+        'Schema Problems': timing_results['Schema Problems']
+    }
+
+# Print tables of throughput and per-file latency for each backend
+def print_benchmark_results(results):
+    print('\n** Throughput **')
+    print('{:<10}{:>8}{:>10}{:>10}{:>16}{:>10}'.format('Backend', 'Files', 'Files/s', 'MB/s', 'Peak RSS (MB)', 'Speedup'))
+    baseline = results.get(BASELINE_BACKEND)
+    for backend_name, summary in results.items():
+        speedup = summary['Files per Second'] / baseline['Files per Second'] if baseline and baseline['Files per Second'] > 0 else 0.0
+        print('{:<10}{:>8}{:>10.1f}{:>10.1f}{:>16.1f}{:>9.1f}x'.format(backend_name, summary['Files'], summary['Files per Second'], summary['MB per Second'], summary['Peak RSS (MB)'], speedup))
+    for pdf_type in ['Index', 'Image']:
+        print('\n** {} PDF Latency **'.format(pdf_type))
+        print('{:<10}{:>8}{:>12}{:>14}{:>10}'.format('Backend', 'Files', 'Mean (ms)', 'Median (ms)', 'p95 (ms)'))
+        for backend_name, summary in results.items():
+            latency_summary = summary[pdf_type]
+            if latency_summary is not None:
+                print('{:<10}{:>8}{:>12.2f}{:>14.2f}{:>10.2f}'.format(backend_name, latency_summary['Files'], latency_summary['Mean (ms)'], latency_summary['Median (ms)'], latency_summary['95th Percentile (ms)']))
+    for backend_name, summary in results.items():
+        for schema_problem in summary['Schema Problems']:
+            print('-- {}: {} --'.format(backend_name, schema_problem))
+
+# Run every available backend over the PDF files, each in a newly started process, and print the results.
+# Returns: dictionary mapping backend names to result summaries
+def run_benchmark(pdf_file_paths, repetitions=REPETITIONS, backend_names=None):
+    if backend_names is None:
+        backend_names = extraction_backends.list_available_backends()
+    print('** Extraction Benchmark: {} PDFs, {} repetitions, backends: {} **'.format(str(len(pdf_file_paths)), str(repetitions), ', '.join(backend_names)))
+    results = {}
+    for backend_name in backend_names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            timing_results = executor.submit(time_backend, backend_name, pdf_file_paths, repetitions).result()
+        results[backend_name] = summarize_backend_results(timing_results)
+    print_benchmark_results(results)
+    return results
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Extraction Benchmark **")
+    try:
+        batch_directory_path = sys.argv[1]
+    except:
+        # proof of concept directory
+        batch_directory_path = 'input/pdf_files/part1/macomb/1961'
+    try:
+        repetitions = int(sys.argv[2])
+    except:
+        repetitions = REPETITIONS
+    try:
+        synthetic_image_count = int(sys.argv[3])
+    except:
+        synthetic_image_count = SYNTHETIC_IMAGE_COUNT
+
+    # Generating a synthetic corpus in a temporary directory inside the current working directory, so relative paths work
+    synthetic_directory_path = None
+    if batch_directory_path == 'synthetic':
+        synthetic_directory_path = tempfile.mkdtemp(prefix='synthetic_', dir='.')
+        batch_directory_path = synthetic_corpus.create_synthetic_batch(os.path.relpath(synthetic_directory_path), image_count=synthetic_image_count, file_size=SYNTHETIC_IMAGE_FILE_SIZE)
+
+    pdf_file_paths = misc_functions.collect_relative_paths_for_files(batch_directory_path)
+    run_benchmark(pdf_file_paths, repetitions)
+    if synthetic_directory_path is not None:
+        shutil.rmtree(synthetic_directory_path)
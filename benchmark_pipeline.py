@@ -0,0 +1,254 @@
+# DTE Aerial Photo Collection curation project
+# End-to-end benchmark running the process_batch.py workflow on synthetic batches of increasing size
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# multiprocessing documentation: https://docs.python.org/3/library/multiprocessing.html
+# platform documentation: https://docs.python.org/3/library/platform.html
+
+# For each batch size, a synthetic batch (image PDFs, an index PDF with a link for each image, and address pair and control point
+# rows) is generated by synthetic_corpus.py in a temporary directory, and the full 'process' workflow of process_batch.py is run on it
+# in a newly started process. Geocoding requests are answered offline by geocode_with_stand_in() and reverse_geocode_with_stand_in()
+# instead of the ArcGIS API, using a temporary geocoding cache, so results do not depend on the network or on previous runs.
+# The wall time and peak resident set size (RSS) of each stage (extraction, georeferencing, and matching and output) and the
+# throughput of the whole workflow are written to a JSON results file, along with the run report of timers, counters, and histograms
+# from pipeline_metrics.py. The results file can be compared with a previous results file to find regressions.
+
+# standard modules
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+
+# local modules
+import benchmark_extraction
+import extract_using_pypdf
+import georeference_links
+import geocoding_cache
+import geocoding_client
+import process_batch
+import synthetic_corpus
+import misc_functions
+import pipeline_metrics
+
+# global variables
+BATCH_SIZES = [100, 1000, 10000]
+# Size of each synthetic image PDF, in bytes (smaller than the collection's scans, so the largest batches fit on disk)
+SYNTHETIC_IMAGE_FILE_SIZE = 128 * 1024
+# Number of worker processes used to extract images (None uses one per CPU)
+EXTRACTION_WORKERS = None
+# Seconds each stand-in geocoding request waits before answering, to simulate the latency of a geocoding service
+STAND_IN_LATENCY = 0.0
+RESULTS_DIRECTORY_PATH = 'output/benchmarks/'
+# Fraction by which throughput may fall, or peak RSS may rise, compared to a baseline results file before it is reported as a regression
+REGRESSION_TOLERANCE = 0.25
+STAGES = ['Extraction', 'Georeferencing', 'Matching and Output']
+
+## Functions
+
+# Stand-in for the ArcGIS geocode function, finding the coordinates of synthetic addresses
+def geocode_with_stand_in(address):
+    time.sleep(STAND_IN_LATENCY)
+    geocoordinates = synthetic_corpus.geocode_synthetic_address(address)
+    if geocoordinates is None:
+        return []
+    return [{'address': address, 'location': {'x': geocoordinates[0], 'y': geocoordinates[1]}, 'score': 100}]
+
+# Stand-in for the ArcGIS reverse_geocode function, placing every point in one synthetic county
+def reverse_geocode_with_stand_in(coordinate_pair):
+    time.sleep(STAND_IN_LATENCY)
+    return {'address': {'Subregion': 'Synthetic County'}, 'location': {'x': coordinate_pair[0], 'y': coordinate_pair[1]}}
+
+# Stand-in for georeference_links.connect_to_arcgis. Returns: the stand-in geocode and reverse_geocode functions
+def connect_to_stand_in():
+    return geocode_with_stand_in, reverse_geocode_with_stand_in
+
+# Wrap a workflow function so each call records its wall time and the peak RSS afterwards under a stage name in stage_results
+def time_stage(stage_name, workflow_function, stage_results):
+    def timed_workflow_function(*args, **kwargs):
+        start = time.perf_counter()
+        result = workflow_function(*args, **kwargs)
+        stage_results[stage_name] = {
+            'Wall Time (s)': time.perf_counter() - start,
+            'Peak RSS (MB)': benchmark_extraction.find_peak_rss(),
+            'Peak Worker RSS (MB)': benchmark_extraction.find_peak_rss(resource.RUSAGE_CHILDREN)
+        }
+        return result
+    return timed_workflow_function
+
+# Find the total size in bytes of the files in a directory and its subdirectories
+def find_directory_size(directory_path):
+    directory_size = 0
+    for root, directory_names, file_names in os.walk(directory_path):
+        for file_name in file_names:
+            directory_size += os.path.getsize(os.path.join(root, file_name))
+    return directory_size
+
+# Generate a synthetic batch of image_count images and run the process_batch.py workflow on it, with the offline geocoding stand-in.
+# This runs in a separate process for each batch size. Returns: dictionary of results for the batch
+def time_pipeline(image_count, image_file_size=SYNTHETIC_IMAGE_FILE_SIZE, extraction_workers=EXTRACTION_WORKERS):
+    # Working in a temporary directory inside the current working directory, so relative paths work
+    working_directory_path = os.path.relpath(tempfile.mkdtemp(prefix='pipeline_benchmark_', dir='.'))
+    input_directory_path = working_directory_path + '/input/'
+    output_directory_path = working_directory_path + '/output/'
+    county, year = 'synthetic', '1961'
+
+    with open(os.devnull, 'w') as null_file, contextlib.redirect_stdout(null_file):
+        corpus_start = time.perf_counter()
+        batch_directory_path = synthetic_corpus.create_synthetic_batch(input_directory_path + 'pdf_files', county, year, image_count, image_file_size)
+        synthetic_corpus.write_georeferencing_csv_rows(input_directory_path + 'address_pairs.csv', input_directory_path + 'control_points.csv', synthetic_corpus.make_index_file_name(county, year), image_count)
+        corpus_seconds = time.perf_counter() - corpus_start
+        corpus_size = find_directory_size(batch_directory_path)
+        os.makedirs(output_directory_path)
+        misc_functions.set_up_output_subdirectory(output_directory_path, 'pypdf2')
+
+        # Pointing the georeferencing workflow at the synthetic CSV files, a temporary cache, and the geocoding stand-in
+        georeference_links.ADDRESS_PAIRS_FILE_PATH = input_directory_path + 'address_pairs.csv'
+        georeference_links.CONTROL_POINTS_FILE_PATH = input_directory_path + 'control_points.csv'
+        georeference_links.COUNTY_LOOKUP_ENGINE = 'arcgis'
+        georeference_links.connect_to_arcgis = connect_to_stand_in
+        # The stand-in answers instantly and has no rate limit, so requests are not spaced out
+        geocoding_client.MAX_REQUESTS_PER_SECOND = None
+        geocoding_cache.configure_cache(working_directory_path + '/geocoding_cache.sqlite')
+
+        stage_results = {}
+        extract_using_pypdf.run_pypdf2_workflow = time_stage('Extraction', extract_using_pypdf.run_pypdf2_workflow, stage_results)
+        georeference_links.run_georeferencing_workflow = time_stage('Georeferencing', georeference_links.run_georeferencing_workflow, stage_results)
+        pipeline_start = time.perf_counter()
+        batch_summary = process_batch.run_batch_workflow('process', batch_directory_path, output_directory_path, [], [], extraction_workers)
+        pipeline_seconds = time.perf_counter() - pipeline_start
+
+    stage_results['Matching and Output'] = {
+        'Wall Time (s)': pipeline_seconds - stage_results['Extraction']['Wall Time (s)'] - stage_results['Georeferencing']['Wall Time (s)'],
+        'Peak RSS (MB)': benchmark_extraction.find_peak_rss(),
+        'Peak Worker RSS (MB)': benchmark_extraction.find_peak_rss(resource.RUSAGE_CHILDREN)
+    }
+    output_size = find_directory_size(output_directory_path)
+    shutil.rmtree(working_directory_path)
+    return {
+        'Image Count': image_count,
+        'Corpus Size (MB)': corpus_size / (1024 * 1024),
+        'Corpus Generation Time (s)': corpus_seconds,
+        'Stages': stage_results,
+        'Wall Time (s)': pipeline_seconds,
+        'Images per Second': image_count / pipeline_seconds,
+        'MB per Second': corpus_size / (1024 * 1024) / pipeline_seconds,
+        'Peak RSS (MB)': benchmark_extraction.find_peak_rss(),
+        'Peak Worker RSS (MB)': benchmark_extraction.find_peak_rss(resource.RUSAGE_CHILDREN),
+        'Output Size (MB)': output_size / (1024 * 1024),
+        'Number of Complete Image Records': batch_summary['Number of Complete Image Records'],
+        'Match Issues': batch_summary['Match Issues'],
+        'Run Report': pipeline_metrics.create_run_report()
+    }
+
+# Run time_pipeline in a newly started process and send its results back through a queue.
+# A plain process is used instead of a process pool, since pool workers cannot start the extraction workers in some Python versions.
+def time_pipeline_in_process(result_queue, image_count, image_file_size, extraction_workers):
+    result_queue.put(time_pipeline(image_count, image_file_size, extraction_workers))
+
+# Print a table of wall times per stage, throughput, and peak RSS for each batch size
+def print_pipeline_results(results):
+    print('\n** Pipeline Benchmark Results **')
+    print('{:>8}{:>16}{:>18}{:>14}{:>11}{:>10}{:>8}{:>10}'.format('Images', 'Extraction (s)', 'Georeference (s)', 'Matching (s)', 'Total (s)', 'Images/s', 'MB/s', 'RSS (MB)'))
+    for run_results in results['Runs']:
+        stage_results = run_results['Stages']
+        print('{:>8}{:>16.2f}{:>18.2f}{:>14.2f}{:>11.2f}{:>10.1f}{:>8.1f}{:>10.1f}'.format(run_results['Image Count'],
+            stage_results['Extraction']['Wall Time (s)'], stage_results['Georeferencing']['Wall Time (s)'], stage_results['Matching and Output']['Wall Time (s)'],
+            run_results['Wall Time (s)'], run_results['Images per Second'], run_results['MB per Second'], run_results['Peak RSS (MB)']))
+        if run_results['Match Issues']:
+            print('-- Match issues occurred with {} images --'.format(str(run_results['Image Count'])))
+
+# Compare results with a baseline results file, run by run (matching batch sizes).
+# Returns: list of regressions found, as strings (empty if there are none)
+def compare_with_baseline(results, baseline_results, tolerance=REGRESSION_TOLERANCE):
+    regressions = []
+    baseline_runs = {}
+    for baseline_run in baseline_results['Runs']:
+        baseline_runs[baseline_run['Image Count']] = baseline_run
+    for run_results in results['Runs']:
+        baseline_run = baseline_runs.get(run_results['Image Count'])
+        if baseline_run is None:
+            continue
+        if run_results['Images per Second'] < baseline_run['Images per Second'] * (1 - tolerance):
+            regressions.append('{} images: throughput fell from {:.1f} to {:.1f} images per second'.format(str(run_results['Image Count']), baseline_run['Images per Second'], run_results['Images per Second']))
+        if run_results['Peak RSS (MB)'] > baseline_run['Peak RSS (MB)'] * (1 + tolerance):
+            regressions.append('{} images: peak RSS rose from {:.1f} to {:.1f} MB'.format(str(run_results['Image Count']), baseline_run['Peak RSS (MB)'], run_results['Peak RSS (MB)']))
+        for stage_name in STAGES:
+            baseline_seconds = baseline_run['Stages'][stage_name]['Wall Time (s)']
+            stage_seconds = run_results['Stages'][stage_name]['Wall Time (s)']
+            if stage_seconds > baseline_seconds * (1 + tolerance) and stage_seconds - baseline_seconds > 0.1:
+                regressions.append('{} images: {} took {:.2f} seconds instead of {:.2f}'.format(str(run_results['Image Count']), stage_name.lower(), stage_seconds, baseline_seconds))
+    return regressions
+
+# Run the pipeline benchmark for each batch size and write the results to a JSON file.
+# Returns: dictionary with the settings used and a list of results for each batch size
+def run_pipeline_benchmark(batch_sizes=BATCH_SIZES, results_file_path=None, image_file_size=SYNTHETIC_IMAGE_FILE_SIZE, extraction_workers=EXTRACTION_WORKERS):
+    print('** Pipeline Benchmark: batch sizes {} **'.format(', '.join(str(batch_size) for batch_size in batch_sizes)))
+    results = {
+        'Timestamp': misc_functions.make_timestamp(),
+        'Python Version': platform.python_version(),
+        'Platform': platform.platform(),
+        'CPU Count': os.cpu_count(),
+        'Image File Size (bytes)': image_file_size,
+        'Extraction Workers': extraction_workers,
+        'Stand-in Latency (s)': STAND_IN_LATENCY,
+        'Runs': []
+    }
+    spawn_context = multiprocessing.get_context('spawn')
+    for batch_size in batch_sizes:
+        print('~~ Running the workflow on {} synthetic images ~~'.format(str(batch_size)))
+        result_queue = spawn_context.Queue()
+        benchmark_process = spawn_context.Process(target=time_pipeline_in_process, args=(result_queue, batch_size, image_file_size, extraction_workers))
+        benchmark_process.start()
+        run_results = result_queue.get()
+        benchmark_process.join()
+        results['Runs'].append(run_results)
+    print_pipeline_results(results)
+
+    if results_file_path is None:
+        os.makedirs(RESULTS_DIRECTORY_PATH, exist_ok=True)
+        results_file_path = RESULTS_DIRECTORY_PATH + 'pipeline_benchmark_{}.json'.format(results['Timestamp'].replace(':', '-'))
+    results_file = open(results_file_path, 'w', encoding='utf-8')
+    results_file.write(json.dumps(results, indent=4))
+    results_file.close()
+    print('** Results written to {} **'.format(results_file_path))
+    return results
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Pipeline Benchmark **")
+    try:
+        batch_sizes = [int(batch_size) for batch_size in sys.argv[1].split(',')]
+    except:
+        batch_sizes = BATCH_SIZES
+    try:
+        results_file_path = sys.argv[2]
+    except:
+        results_file_path = None
+    try:
+        baseline_file_path = sys.argv[3]
+    except:
+        baseline_file_path = None
+
+    results = run_pipeline_benchmark(batch_sizes, results_file_path)
+
+    # Comparing with the baseline results file, if one was entered
+    if baseline_file_path is not None:
+        baseline_file = open(baseline_file_path, 'r', encoding='utf-8')
+        baseline_results = json.loads(baseline_file.read())
+        baseline_file.close()
+        regressions = compare_with_baseline(results, baseline_results)
+        for regression in regressions:
+            print('-- Regression: {} --'.format(regression))
+        if regressions:
+            sys.exit(1)
+        print('++ No regressions compared to {} ++'.format(baseline_file_path))
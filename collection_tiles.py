@@ -0,0 +1,413 @@
+# DTE Aerial Photo Collection curation project
+# Hilbert-sorted GeoJSON and Mapbox Vector Tile exports of the image locations of the whole collection, for web maps
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# Mapbox Vector Tile specification: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+# MBTiles specification: https://github.com/mapbox/mbtiles-spec/blob/master/1.3/spec.md
+# Protocol Buffers encoding: https://developers.google.com/protocol-buffers/docs/encoding
+# FlatGeobuf (packed Hilbert R-tree): https://flatgeobuf.org/
+
+# The point features of the collection GeoJSON file written by process_collection.py are read once, sorted along a Hilbert curve
+# drawn over the extent of the collection, and written two ways:
+#   - a GeoJSON Text Sequence, dte_aerial_collection_image_locations_hilbert.geojsons, with features near each other on the map
+#     near each other in the file, and a packed Hilbert R-tree index of it, ..._hilbert_index.json, modeled on the index of a
+#     FlatGeobuf file. Each leaf node covers INDEX_NODE_SIZE consecutive features, and each node above it covers INDEX_NODE_SIZE nodes of
+#     the level below. Every node holds the bounding box of its features and the range of bytes they take up in the file, so a map
+#     client can read the small index once and then fetch only the byte ranges (e.g. with HTTP range requests) of the area it shows.
+#   - a pre-tiled set of Mapbox Vector Tiles for zoom levels MIN_ZOOM to MAX_ZOOM, in an MBTiles SQLite file or a z/x/y directory of
+#     .pbf files, with one 'images' layer holding a point feature for each image. A map client fetches only the tiles it is showing.
+# The tiles are encoded directly in the Protocol Buffers format, so no third-party tile library is needed. Footprint polygons are
+# left out of both exports; they can be found with the polygon queries of spatial_index.py.
+
+# standard modules
+import os
+import sys
+import json
+import gzip
+import time
+import sqlite3
+
+# third-party modules
+import numpy as np
+
+# local modules
+import json_streaming
+
+# global variables
+SOURCE_GEOJSON_FILENAME = 'dte_aerial_collection_image_locations'
+SORTED_GEOJSON_FILE_NAME = 'dte_aerial_collection_image_locations_hilbert.geojsons'
+SORTED_INDEX_FILE_NAME = 'dte_aerial_collection_image_locations_hilbert_index.json'
+MBTILES_FILE_NAME = 'dte_aerial_collection_image_locations.mbtiles'
+TILE_DIRECTORY_NAME = 'tiles'
+TILE_FORMATS = ['mbtiles', 'directory']
+TILE_FORMAT = 'mbtiles'
+TILE_LAYER_NAME = 'images'
+MIN_ZOOM = 0
+MAX_ZOOM = 16
+# Width and height of each tile in tile coordinates (must be a power of two)
+TILE_EXTENT = 4096
+# Number of features (or child nodes) in each node of the packed Hilbert R-tree
+INDEX_NODE_SIZE = 16
+# Number of bits in each coordinate of the Hilbert curve grid
+HILBERT_BITS = 16
+MAX_MERCATOR_LATITUDE = 85.0511287798
+FEATURE_PROPERTY_NAMES = ['file_identifier', 'county', 'year']
+SINGLE_BYTE_VARINTS = [bytes([value]) for value in range(0x80)]
+
+## Functions
+
+# Collect the point features from a stream of GeoJSON features. Returns: list of point features and arrays of their longitudes and latitudes
+def collect_point_features(features):
+    point_features = []
+    longitudes = []
+    latitudes = []
+    for feature in features:
+        geometry = feature.get('geometry')
+        if geometry is None or geometry['type'] != 'Point' or geometry['coordinates'][0] is None or geometry['coordinates'][1] is None:
+            continue
+        point_features.append(feature)
+        longitudes.append(float(geometry['coordinates'][0]))
+        latitudes.append(float(geometry['coordinates'][1]))
+    return point_features, np.array(longitudes, dtype=np.float64), np.array(latitudes, dtype=np.float64)
+
+# Calculate the position along a Hilbert curve of each cell in a 2 ** 16 by 2 ** 16 grid, without looping over the curve's levels
+# (the bit manipulation used by FlatGeobuf, from https://github.com/rawrunprotected/hilbert_curves)
+# Arguments: arrays of integer x and y cell coordinates. Returns: array of Hilbert values
+def find_hilbert_values(x, y):
+    x = x.astype(np.uint32)
+    y = y.astype(np.uint32)
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C = C ^ ((a & (c >> 2)) ^ (b & (d >> 2)))
+    D = D ^ ((b & (c >> 2)) ^ ((a ^ b) & (d >> 2)))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C = C ^ ((a & (c >> 4)) ^ (b & (d >> 4)))
+    D = D ^ ((b & (c >> 4)) ^ ((a ^ b) & (d >> 4)))
+
+    a, b, c, d = A, B, C, D
+    C = C ^ ((a & (c >> 8)) ^ (b & (d >> 8)))
+    D = D ^ ((b & (c >> 8)) ^ ((a ^ b) & (d >> 8)))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+    interleaved = []
+    for value in [i0, i1]:
+        value = (value | (value << 8)) & 0x00FF00FF
+        value = (value | (value << 4)) & 0x0F0F0F0F
+        value = (value | (value << 2)) & 0x33333333
+        value = (value | (value << 1)) & 0x55555555
+        interleaved.append(value)
+    return (interleaved[1] << 1) | interleaved[0]
+
+# Find the order of points along a Hilbert curve drawn over their extent (ties keep their original order)
+# Returns: array of point positions, in Hilbert order
+def sort_points_by_hilbert(longitudes, latitudes):
+    grid_size = (1 << HILBERT_BITS) - 1
+    extent_width = max(longitudes.max() - longitudes.min(), 1e-12)
+    extent_height = max(latitudes.max() - latitudes.min(), 1e-12)
+    x = np.floor((longitudes - longitudes.min()) / extent_width * grid_size)
+    y = np.floor((latitudes - latitudes.min()) / extent_height * grid_size)
+    return np.argsort(find_hilbert_values(x, y), kind='stable')
+
+# Create the nodes of a packed Hilbert R-tree over features in Hilbert order. Each node is
+# [min longitude, min latitude, max longitude, max latitude, first byte, end byte], and nodes i * node_size to i * node_size + node_size - 1
+# of one level are the children of node i of the level above it.
+# Arguments: sorted longitudes, latitudes, and byte offsets (with the end of the file as a last offset). Returns: list of levels, root first
+def build_packed_index(longitudes, latitudes, byte_offsets, node_size=INDEX_NODE_SIZE):
+    starts = np.arange(0, len(longitudes), node_size)
+    ends = np.minimum(starts + node_size, len(longitudes))
+    level = np.column_stack([np.minimum.reduceat(longitudes, starts), np.minimum.reduceat(latitudes, starts),
+        np.maximum.reduceat(longitudes, starts), np.maximum.reduceat(latitudes, starts), byte_offsets[starts], byte_offsets[ends]])
+    levels = [level]
+    while len(level) > 1:
+        starts = np.arange(0, len(level), node_size)
+        ends = np.minimum(starts + node_size, len(level)) - 1
+        level = np.column_stack([np.minimum.reduceat(level[:, 0], starts), np.minimum.reduceat(level[:, 1], starts),
+            np.maximum.reduceat(level[:, 2], starts), np.maximum.reduceat(level[:, 3], starts), level[starts, 4], level[ends, 5]])
+        levels.append(level)
+    levels.reverse()
+    return [[[float(value) for value in node[:4]] + [int(node[4]), int(node[5])] for node in level] for level in levels]
+
+# Write point features in Hilbert order as a GeoJSON Text Sequence, along with the packed Hilbert R-tree index of the file
+# Returns: the index dictionary
+def write_sorted_features(output_directory_path, point_features, longitudes, latitudes, order):
+    sorted_file = open(os.path.join(output_directory_path, SORTED_GEOJSON_FILE_NAME), 'wb')
+    byte_offsets = [0]
+    for feature_position in order:
+        line = (json_streaming.RECORD_SEPARATOR + json_streaming.dump_value(point_features[feature_position], 'compact') + '\n').encode('utf-8')
+        sorted_file.write(line)
+        byte_offsets.append(byte_offsets[-1] + len(line))
+    sorted_file.close()
+
+    sorted_index = {
+        'GeoJSON File Name': SORTED_GEOJSON_FILE_NAME,
+        'Feature Count': len(order),
+        'Node Size': INDEX_NODE_SIZE,
+        'Extent': [float(longitudes.min()), float(latitudes.min()), float(longitudes.max()), float(latitudes.max())],
+        'Levels': build_packed_index(longitudes[order], latitudes[order], np.array(byte_offsets, dtype=np.int64))
+    }
+    json_streaming.write_json_document(os.path.join(output_directory_path, SORTED_INDEX_FILE_NAME), sorted_index, 'compact')
+    return sorted_index
+
+# Find the byte ranges of the Hilbert-sorted file holding the features within a bounding box, by walking down the packed index
+# Returns: list of (first byte, end byte) pairs, with neighboring ranges joined
+def find_sorted_byte_ranges(sorted_index, min_longitude, min_latitude, max_longitude, max_latitude):
+    node_size = sorted_index['Node Size']
+    node_positions = [0]
+    for level_number, level in enumerate(sorted_index['Levels']):
+        matching_positions = []
+        for node_position in node_positions:
+            node = level[node_position]
+            if node[0] <= max_longitude and node[2] >= min_longitude and node[1] <= max_latitude and node[3] >= min_latitude:
+                matching_positions.append(node_position)
+        if level_number == len(sorted_index['Levels']) - 1:
+            node_positions = matching_positions
+            break
+        next_level_length = len(sorted_index['Levels'][level_number + 1])
+        node_positions = [child_position for node_position in matching_positions
+            for child_position in range(node_position * node_size, min((node_position + 1) * node_size, next_level_length))]
+    byte_ranges = []
+    for node_position in node_positions:
+        node = sorted_index['Levels'][-1][node_position]
+        if byte_ranges and byte_ranges[-1][1] == node[4]:
+            byte_ranges[-1] = (byte_ranges[-1][0], node[5])
+        else:
+            byte_ranges.append((node[4], node[5]))
+    return byte_ranges
+
+# Read the features within a bounding box from the Hilbert-sorted file, reading only the byte ranges the index points to
+def read_sorted_features_in_bbox(output_directory_path, sorted_index, min_longitude, min_latitude, max_longitude, max_latitude):
+    sorted_file = open(os.path.join(output_directory_path, sorted_index['GeoJSON File Name']), 'rb')
+    for first_byte, end_byte in find_sorted_byte_ranges(sorted_index, min_longitude, min_latitude, max_longitude, max_latitude):
+        sorted_file.seek(first_byte)
+        for line in sorted_file.read(end_byte - first_byte).decode('utf-8').split(json_streaming.RECORD_SEPARATOR):
+            if line.strip():
+                feature = json.loads(line)
+                longitude, latitude = feature['geometry']['coordinates']
+                if min_longitude <= longitude <= max_longitude and min_latitude <= latitude <= max_latitude:
+                    yield feature
+    sorted_file.close()
+
+# Convert longitudes and latitudes to Web Mercator pixel coordinates at the maximum zoom level, in tile coordinate units
+# Returns: arrays of integer x and y coordinates, from 0 to TILE_EXTENT * 2 ** max_zoom - 1
+def find_mercator_coordinates(longitudes, latitudes, max_zoom=MAX_ZOOM):
+    world_size = TILE_EXTENT << max_zoom
+    latitude_radians = np.radians(np.clip(latitudes, -MAX_MERCATOR_LATITUDE, MAX_MERCATOR_LATITUDE))
+    x = (longitudes + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(latitude_radians) + 1.0 / np.cos(latitude_radians)) / np.pi) / 2.0
+    mercator_x = np.clip(np.floor(x * world_size), 0, world_size - 1).astype(np.int64)
+    mercator_y = np.clip(np.floor(y * world_size), 0, world_size - 1).astype(np.int64)
+    return mercator_x, mercator_y
+
+# Encode an unsigned integer as a Protocol Buffers varint (values below 128, like most tags and many coordinates, take one byte)
+def encode_varint(value):
+    if value < 0x80:
+        return SINGLE_BYTE_VARINTS[value]
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+# Encode a signed integer with ZigZag encoding, so small negative numbers stay small varints
+def encode_zigzag(value):
+    return (value << 1) if value >= 0 else ((-value) << 1) - 1
+
+# Encode a Protocol Buffers field holding a varint
+def encode_varint_field(field_number, value):
+    return encode_varint(field_number << 3) + encode_varint(value)
+
+# Encode a Protocol Buffers length-delimited field (a string, embedded message, or packed list)
+def encode_bytes_field(field_number, data):
+    return encode_varint((field_number << 3) | 2) + encode_varint(len(data)) + data
+
+# Encode a list of unsigned integers as a packed Protocol Buffers field
+def encode_packed_field(field_number, values):
+    return encode_bytes_field(field_number, b''.join(encode_varint(value) for value in values))
+
+# Find the properties of a feature stored in the tiles, as (name, string value) pairs
+def find_tile_properties(feature):
+    properties = feature.get('properties') or {}
+    return [(name, str(properties[name])) for name in FEATURE_PROPERTY_NAMES if properties.get(name) is not None]
+
+# Encode a vector tile with one layer of point features
+# Argument: list of (feature ID, tile x, tile y, properties) tuples. Returns: the tile as bytes
+def encode_point_tile(tile_features, layer_name=TILE_LAYER_NAME):
+    keys = {}
+    values = {}
+    encoded_features = []
+    for feature_id, tile_x, tile_y, properties in tile_features:
+        tags = []
+        for name, value in properties:
+            tags.append(keys.setdefault(name, len(keys)))
+            tags.append(values.setdefault(value, len(values)))
+        # A single MoveTo command (ID 1, count 1) to the point
+        geometry = [(1 << 3) | 1, encode_zigzag(tile_x), encode_zigzag(tile_y)]
+        encoded_feature = encode_varint_field(1, feature_id) + encode_packed_field(2, tags) + encode_varint_field(3, 1) + encode_packed_field(4, geometry)
+        encoded_features.append(encode_bytes_field(2, encoded_feature))
+    layer = encode_varint_field(15, 2) + encode_bytes_field(1, layer_name.encode('utf-8')) + b''.join(encoded_features)
+    layer += b''.join(encode_bytes_field(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(encode_bytes_field(4, encode_bytes_field(1, value.encode('utf-8'))) for value in values)
+    layer += encode_varint_field(5, TILE_EXTENT)
+    return encode_bytes_field(3, layer)
+
+# Create the vector tiles for every zoom level from points in Hilbert order, one tile at a time
+# Yields: zoom level, tile column, tile row (counted from the top, as in z/x/y URLs), and the encoded tile
+def generate_point_tiles(mercator_x, mercator_y, tile_properties, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    extent_bits = TILE_EXTENT.bit_length() - 1
+    feature_ids = np.arange(1, len(mercator_x) + 1)
+    for zoom in range(min_zoom, max_zoom + 1):
+        zoom_shift = max_zoom - zoom
+        zoom_x = mercator_x >> zoom_shift
+        zoom_y = mercator_y >> zoom_shift
+        tile_keys = ((zoom_x >> extent_bits) << zoom) + (zoom_y >> extent_bits)
+        tile_order = np.argsort(tile_keys, kind='stable')
+        sorted_keys = tile_keys[tile_order]
+        tile_starts = np.flatnonzero(np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]]))
+        tile_ends = np.append(tile_starts[1:], len(sorted_keys))
+        for tile_start, tile_end in zip(tile_starts, tile_ends):
+            tile_positions = tile_order[tile_start:tile_end]
+            tile_key = int(sorted_keys[tile_start])
+            tile_features = [(int(feature_ids[position]), int(zoom_x[position]) & (TILE_EXTENT - 1), int(zoom_y[position]) & (TILE_EXTENT - 1),
+                tile_properties[position]) for position in tile_positions]
+            yield zoom, tile_key >> zoom, tile_key & ((1 << zoom) - 1), encode_point_tile(tile_features)
+
+# Create the metadata describing a tile set, as stored in an MBTiles metadata table
+def create_tile_metadata(longitudes, latitudes, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    bounds = [float(longitudes.min()), float(latitudes.min()), float(longitudes.max()), float(latitudes.max())]
+    center_zoom = min(max(min_zoom, 8), max_zoom)
+    vector_layer = {
+        'id': TILE_LAYER_NAME,
+        'description': 'Locations of the DTE aerial photos',
+        'minzoom': min_zoom,
+        'maxzoom': max_zoom,
+        'fields': {name: 'String' for name in FEATURE_PROPERTY_NAMES}
+    }
+    return {
+        'name': 'DTE Aerial Photo Collection',
+        'format': 'pbf',
+        'type': 'overlay',
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': ','.join(str(bound) for bound in bounds),
+        'center': ','.join([str((bounds[0] + bounds[2]) / 2), str((bounds[1] + bounds[3]) / 2), str(center_zoom)]),
+        'json': json.dumps({'vector_layers': [vector_layer]})
+    }
+
+# Write tiles to an MBTiles file, replacing any earlier tile set. Tiles are stored gzipped, with rows counted from the bottom (TMS).
+# Returns: the number of tiles written
+def write_mbtiles(mbtiles_file_path, tiles, tile_metadata):
+    temporary_file_path = mbtiles_file_path + '.tmp'
+    if os.path.exists(temporary_file_path):
+        os.remove(temporary_file_path)
+    connection = sqlite3.connect(temporary_file_path)
+    tile_count = 0
+    with connection:
+        connection.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        connection.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        connection.executemany('INSERT INTO metadata VALUES (?, ?)', list(tile_metadata.items()))
+        for zoom, tile_column, tile_row, tile_data in tiles:
+            connection.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)', (zoom, tile_column, (1 << zoom) - 1 - tile_row, gzip.compress(tile_data)))
+            tile_count += 1
+        connection.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+    connection.close()
+    os.replace(temporary_file_path, mbtiles_file_path)
+    return tile_count
+
+# Write tiles to a z/x/y directory of uncompressed .pbf files, with the tile set metadata in metadata.json
+# Returns: the number of tiles written
+def write_tile_directory(tile_directory_path, tiles, tile_metadata):
+    os.makedirs(tile_directory_path, exist_ok=True)
+    tile_count = 0
+    for zoom, tile_column, tile_row, tile_data in tiles:
+        column_directory_path = os.path.join(tile_directory_path, str(zoom), str(tile_column))
+        os.makedirs(column_directory_path, exist_ok=True)
+        tile_file = open(os.path.join(column_directory_path, str(tile_row) + '.pbf'), 'wb')
+        tile_file.write(tile_data)
+        tile_file.close()
+        tile_count += 1
+    json_streaming.write_json_document(os.path.join(tile_directory_path, 'metadata.json'), tile_metadata)
+    return tile_count
+
+# Sort the point features of the collection along a Hilbert curve and write the sorted GeoJSON file, its index, and the vector tiles
+# Argument: GeoJSON features (e.g. streamed from the collection GeoJSON file). Returns: dictionary of counts
+def export_collection_tiles(output_directory_path, features, tile_format=TILE_FORMAT, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    print('\n** Collection Tile Export **')
+    export_start = time.time()
+    point_features, longitudes, latitudes = collect_point_features(features)
+    export_counts = {'Point Features': len(point_features), 'Tiles Written': 0}
+    if len(point_features) == 0:
+        print('-- No point features to export --')
+        return export_counts
+
+    order = sort_points_by_hilbert(longitudes, latitudes)
+    sorted_index = write_sorted_features(output_directory_path, point_features, longitudes, latitudes, order)
+    export_counts['Index Levels'] = len(sorted_index['Levels'])
+
+    sorted_longitudes = longitudes[order]
+    sorted_latitudes = latitudes[order]
+    mercator_x, mercator_y = find_mercator_coordinates(sorted_longitudes, sorted_latitudes, max_zoom)
+    tile_properties = [find_tile_properties(point_features[feature_position]) for feature_position in order]
+    tiles = generate_point_tiles(mercator_x, mercator_y, tile_properties, min_zoom, max_zoom)
+    tile_metadata = create_tile_metadata(longitudes, latitudes, min_zoom, max_zoom)
+    if tile_format == 'directory':
+        export_counts['Tiles Written'] = write_tile_directory(os.path.join(output_directory_path, TILE_DIRECTORY_NAME), tiles, tile_metadata)
+    else:
+        export_counts['Tiles Written'] = write_mbtiles(os.path.join(output_directory_path, MBTILES_FILE_NAME), tiles, tile_metadata)
+    print('** Exported {} point features and {} tiles (zoom levels {} to {}) in {:.2f} seconds **'.format(
+        str(export_counts['Point Features']), str(export_counts['Tiles Written']), str(min_zoom), str(max_zoom), time.time() - export_start))
+    return export_counts
+
+# Find the collection GeoJSON file in an output directory, in either output format (the most recently written one if both exist,
+# or None if there is none)
+def find_collection_geojson_file(output_directory_path):
+    file_paths = []
+    for output_format in ['pretty', 'lines']:
+        file_path = os.path.join(output_directory_path, json_streaming.add_file_extension(SOURCE_GEOJSON_FILENAME, output_format, geojson=True))
+        if os.path.exists(file_path):
+            file_paths.append(file_path)
+    if len(file_paths) == 0:
+        return None
+    return max(file_paths, key=os.path.getmtime)
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Collection Tile Export **")
+
+    # Setting output directory holding the collection GeoJSON file
+    try:
+        output_directory_path = sys.argv[1]
+    except:
+        output_directory_path = 'output/'
+
+    # Setting tile format ('mbtiles' or 'directory')
+    try:
+        tile_format = sys.argv[2]
+    except:
+        tile_format = TILE_FORMAT
+
+    collection_geojson_file_path = find_collection_geojson_file(output_directory_path)
+    if collection_geojson_file_path is None:
+        print('?? No collection GeoJSON file found in {}; run process_collection.py first ??'.format(output_directory_path))
+        sys.exit(1)
+    export_collection_tiles(output_directory_path, json_streaming.read_geojson_features(collection_geojson_file_path), tile_format)
@@ -0,0 +1,312 @@
+# DTE Aerial Photo Collection curation project
+# Columnar export of image and link records to Parquet or Arrow IPC files, partitioned by county and year
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# Apache Arrow (pyarrow) documentation: https://arrow.apache.org/docs/python/
+# Parquet documentation: https://parquet.apache.org/docs/
+
+# The JSON output files nest each record's metadata in dictionaries, so any query has to parse whole files. This module flattens
+# records into columns (nested keys are joined with COLUMN_SEPARATOR, e.g. 'Descriptive.ArcGIS Geocoordinates.Longitude') and writes
+# four tables for each batch:
+#   image_records        - the full image records created by process_batch.py
+#   extracted_images     - the image records in the batch metadata from extract_using_pypdf.py
+#   index_links          - the links in the index records of the batch metadata
+#   georeferenced_links  - the georeferenced link records from georeference_links.py
+# Details that apply to a whole batch (the index records without their links, and the georeferencing metadata) are stored as JSON in
+# the metadata of the table they belong to. Each table is written to its own directory, partitioned in the Hive style used by
+# Parquet tools (e.g. output/columnar/image_records/county=macomb/year=1961/part-0.parquet), so a query across the whole collection
+# only reads the columns it needs. Arrow IPC files are memory mapped when read, so their columns are not copied into memory.
+# The pyarrow library is imported when the first table is written or read, so the JSON workflows do not depend on it.
+
+# standard modules
+import os
+import sys
+import json
+import tempfile
+
+# global variables
+COLUMNAR_DIRECTORY_NAME = 'columnar/'
+COLUMNAR_FORMATS = ['parquet', 'arrow']
+COLUMNAR_FILE_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+COLUMN_SEPARATOR = '.'
+# Compression codec for Parquet files
+PARQUET_COMPRESSION = 'snappy'
+TABLE_NAMES = ['image_records', 'extracted_images', 'index_links', 'georeferenced_links']
+
+## Functions
+
+# Flatten a nested record dictionary into a dictionary with one key per value, joining nested keys with COLUMN_SEPARATOR.
+# Lists (e.g. link coordinates) are kept as values, and become list columns.
+def flatten_record(record, prefix=''):
+    flat_record = {}
+    for key, value in record.items():
+        if isinstance(value, dict) and len(value) > 0:
+            flat_record.update(flatten_record(value, prefix + key + COLUMN_SEPARATOR))
+        else:
+            flat_record[prefix + key] = value
+    return flat_record
+
+# Find the column names that are prefixes of columns holding a value (not None) in a flattened record
+def find_filled_prefixes(flat_record):
+    filled_prefixes = set()
+    for column_name, value in flat_record.items():
+        if value is not None:
+            keys = column_name.split(COLUMN_SEPARATOR)
+            for key_count in range(1, len(keys)):
+                filled_prefixes.add(COLUMN_SEPARATOR.join(keys[:key_count]))
+    return filled_prefixes
+
+# Rebuild a nested record dictionary from a flattened one.
+# A key can hold a dictionary in some records and None in others (e.g. 'Preservation.Fixity' in records reused from before fixity was
+# recorded), so the table has both a column for the key and columns for the keys nested in it. In a record where the nested columns
+# hold values, the key's None is skipped; where they are all None, the key is None and the nested columns are skipped.
+def unflatten_record(flat_record):
+    record = {}
+    filled_prefixes = find_filled_prefixes(flat_record)
+    for column_name, value in flat_record.items():
+        keys = column_name.split(COLUMN_SEPARATOR)
+        if value is None:
+            if column_name in filled_prefixes:
+                continue
+            prefixes = [COLUMN_SEPARATOR.join(keys[:key_count]) for key_count in range(1, len(keys))]
+            if any(prefix in flat_record and prefix not in filled_prefixes for prefix in prefixes):
+                continue
+        nested_dict = record
+        for key in keys[:-1]:
+            nested_dict = nested_dict.setdefault(key, {})
+        nested_dict[keys[-1]] = value
+    return record
+
+# Add a record to columns already holding record_count records. New columns are filled with None for the earlier records,
+# and columns the record does not have get None for it.
+def add_record_to_columns(columns, record, record_count):
+    flat_record = flatten_record(record)
+    for column_name in flat_record.keys():
+        if column_name not in columns:
+            columns[column_name] = [None] * record_count
+    for column_name, column in columns.items():
+        column.append(flat_record.get(column_name))
+
+# Convert a list or generator of records into columns: a dictionary mapping column names to lists of values,
+# in the order their keys first appear
+def convert_records_to_columns(records):
+    columns = {}
+    record_count = 0
+    for record in records:
+        add_record_to_columns(columns, record, record_count)
+        record_count += 1
+    return columns
+
+# Check that records come back unchanged after being written to a table file and read again
+# Returns: list of the positions of records that changed
+def check_round_trip(records, file_path, columnar_format='parquet'):
+    write_table(file_path, convert_records_to_columns(records), {}, columnar_format)
+    read_records = convert_columns_to_records(convert_table_to_columns(read_table(file_path, None, columnar_format)[0]))
+    os.remove(file_path)
+    return [position for position, record in enumerate(records) if read_records[position] != record]
+
+# Convert a pyarrow column into a list of Python values. Columns without nulls are converted through NumPy, which is much faster
+# than pyarrow's to_pylist (list columns are split using their offsets); columns with nulls use to_pylist, so nulls become None.
+def convert_column_to_list(column):
+    import pyarrow
+    column = column.combine_chunks() if isinstance(column, pyarrow.ChunkedArray) else column
+    if column.null_count > 0:
+        return column.to_pylist()
+    if pyarrow.types.is_list(column.type):
+        values = column.flatten()
+        if values.null_count > 0 or pyarrow.types.is_nested(values.type):
+            return column.to_pylist()
+        values = values.to_numpy(zero_copy_only=False)
+        offsets = column.offsets.to_numpy()
+        return [values[offsets[position]:offsets[position + 1]].tolist() for position in range(len(column))]
+    if pyarrow.types.is_nested(column.type):
+        return column.to_pylist()
+    return column.to_numpy(zero_copy_only=False).tolist()
+
+# Convert a pyarrow Table into columns: a dictionary mapping column names to lists of Python values
+def convert_table_to_columns(table):
+    columns = {}
+    for column_name, column in zip(table.column_names, table.columns):
+        columns[column_name] = convert_column_to_list(column)
+    return columns
+
+# Convert columns (as returned by convert_table_to_columns) back into a list of nested record dictionaries.
+# Flat columns are zipped straight into records; only records with nested columns are rebuilt with unflatten_record.
+def convert_columns_to_records(columns):
+    column_names = list(columns.keys())
+    nested = any(COLUMN_SEPARATOR in column_name for column_name in column_names)
+    records = []
+    for values in zip(*columns.values()):
+        record = dict(zip(column_names, values))
+        records.append(unflatten_record(record) if nested else record)
+    return records
+
+# Find the county and year partition values of a batch directory path ending in [county]/[year]
+def find_partition_values(batch_directory_path):
+    county, year = batch_directory_path.rstrip('/').split('/')[-2:]
+    return county, year
+
+# Make the path of the file holding one table for one batch (e.g. output/columnar/image_records/county=macomb/year=1961/part-0.parquet)
+def make_table_file_path(output_directory_path, table_name, county, year, columnar_format='parquet'):
+    partition_directory_path = '{}{}{}/county={}/year={}/'.format(output_directory_path, COLUMNAR_DIRECTORY_NAME, table_name, county, year)
+    return partition_directory_path + 'part-0' + COLUMNAR_FILE_EXTENSIONS[columnar_format]
+
+# Write columns to a Parquet or Arrow IPC file, storing table_metadata (a dictionary) as JSON strings in the table's metadata
+def write_table(file_path, columns, table_metadata=None, columnar_format='parquet'):
+    import pyarrow
+    if table_metadata is None:
+        table_metadata = {}
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    table = pyarrow.Table.from_pydict(columns)
+    schema_metadata = {}
+    for key, value in table_metadata.items():
+        schema_metadata[key] = json.dumps(value)
+    table = table.replace_schema_metadata(schema_metadata)
+    if columnar_format == 'parquet':
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, file_path, compression=PARQUET_COMPRESSION)
+    else:
+        table_writer = pyarrow.ipc.new_file(file_path, table.schema)
+        table_writer.write_table(table)
+        table_writer.close()
+
+# Read a Parquet or Arrow IPC table file, with only the given columns (or all of them).
+# Returns: the pyarrow Table and its metadata dictionary (with the JSON strings parsed)
+def read_table(file_path, columns=None, columnar_format='parquet'):
+    import pyarrow
+    if columnar_format == 'parquet':
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(file_path, columns=columns)
+    else:
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(file_path, 'r')).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    table_metadata = {}
+    for key, value in (table.schema.metadata or {}).items():
+        table_metadata[key.decode('utf-8')] = json.loads(value)
+    return table, table_metadata
+
+# Write the batch metadata from extract_using_pypdf.py as the extracted_images and index_links tables of a batch
+def write_batch_metadata(batch_metadata, output_directory_path, batch_directory_path, columnar_format='parquet'):
+    county, year = find_partition_values(batch_directory_path)
+    index_records = []
+    links = []
+    for index_record in batch_metadata['Index Records']:
+        index_records.append(dict((key, value) for key, value in index_record.items() if key != 'Links'))
+        for link in index_record['Links']:
+            link_with_index = {'Index File Name': index_record['Index File Name']}
+            link_with_index.update(link)
+            links.append(link_with_index)
+    image_columns = convert_records_to_columns(batch_metadata['Image Records'])
+    write_table(make_table_file_path(output_directory_path, 'extracted_images', county, year, columnar_format), image_columns, {'Index Records': index_records}, columnar_format)
+    link_columns = convert_records_to_columns(links)
+    write_table(make_table_file_path(output_directory_path, 'index_links', county, year, columnar_format), link_columns, {}, columnar_format)
+
+# Read the batch metadata of a batch back from its extracted_images and index_links tables, in the same form as the batch metadata file
+def read_batch_metadata(output_directory_path, batch_directory_path, columnar_format='parquet'):
+    county, year = find_partition_values(batch_directory_path)
+    image_table, image_table_metadata = read_table(make_table_file_path(output_directory_path, 'extracted_images', county, year, columnar_format), None, columnar_format)
+    link_table = read_table(make_table_file_path(output_directory_path, 'index_links', county, year, columnar_format), None, columnar_format)[0]
+    links_by_index = {}
+    for link in convert_columns_to_records(convert_table_to_columns(link_table)):
+        links_by_index.setdefault(link.pop('Index File Name'), []).append(link)
+    index_records = []
+    for index_record in image_table_metadata['Index Records']:
+        index_record['Links'] = links_by_index.get(index_record['Index File Name'], [])
+        index_records.append(index_record)
+    batch_metadata = {
+        'Index Records': index_records,
+        'Image Records': convert_columns_to_records(convert_table_to_columns(image_table))
+    }
+    return batch_metadata
+
+# Write georeferenced link data from georeference_links.py as the georeferenced_links table of a batch
+def write_georeferenced_link_data(georeferenced_link_data, output_directory_path, batch_directory_path, columnar_format='parquet'):
+    county, year = find_partition_values(batch_directory_path)
+    link_columns = convert_records_to_columns(georeferenced_link_data['Georeferenced Link Records'])
+    table_metadata = {'Georeferencing Metadata': georeferenced_link_data['Georeferencing Metadata']}
+    write_table(make_table_file_path(output_directory_path, 'georeferenced_links', county, year, columnar_format), link_columns, table_metadata, columnar_format)
+
+# Read the georeferenced link data of a batch back from its georeferenced_links table, in the same form as the georeferenced links file
+def read_georeferenced_link_data(output_directory_path, batch_directory_path, columnar_format='parquet'):
+    county, year = find_partition_values(batch_directory_path)
+    link_table, table_metadata = read_table(make_table_file_path(output_directory_path, 'georeferenced_links', county, year, columnar_format), None, columnar_format)
+    georeferenced_link_data = {
+        'Georeferencing Metadata': table_metadata['Georeferencing Metadata'],
+        'Georeferenced Link Records': convert_columns_to_records(convert_table_to_columns(link_table))
+    }
+    return georeferenced_link_data
+
+# Pass full image records through while adding them to columns, then write the columns as the image_records table of the batch
+# once all the records have been consumed (like json_streaming.pass_through_json_array, so records are only generated once)
+def pass_through_image_records(full_image_records, output_directory_path, batch_directory_path, columnar_format='parquet'):
+    county, year = find_partition_values(batch_directory_path)
+    columns = {}
+    record_count = 0
+    for full_image_record in full_image_records:
+        add_record_to_columns(columns, full_image_record, record_count)
+        record_count += 1
+        yield full_image_record
+    write_table(make_table_file_path(output_directory_path, 'image_records', county, year, columnar_format), columns, {}, columnar_format)
+
+# Read one table for every batch in the output directory into a single pyarrow Table, with county and year columns added from
+# the partition directories. Only the given columns (or all of them) are read from each file.
+def read_collection_table(output_directory_path, table_name, columns=None, columnar_format='parquet'):
+    import pyarrow
+    table_directory_path = output_directory_path + COLUMNAR_DIRECTORY_NAME + table_name + '/'
+    tables = []
+    county_directory_names = sorted(os.listdir(table_directory_path)) if os.path.isdir(table_directory_path) else []
+    for county_directory_name in county_directory_names:
+        for year_directory_name in sorted(os.listdir(table_directory_path + county_directory_name)):
+            file_path = '{}{}/{}/part-0{}'.format(table_directory_path, county_directory_name, year_directory_name, COLUMNAR_FILE_EXTENSIONS[columnar_format])
+            if not os.path.exists(file_path):
+                continue
+            table = read_table(file_path, columns, columnar_format)[0]
+            table = table.append_column('county', pyarrow.array([county_directory_name.split('=', 1)[1]] * table.num_rows, pyarrow.string()))
+            table = table.append_column('year', pyarrow.array([year_directory_name.split('=', 1)[1]] * table.num_rows, pyarrow.string()))
+            tables.append(table)
+    if len(tables) == 0:
+        return pyarrow.table(dict((column_name, pyarrow.array([], pyarrow.null())) for column_name in (columns or []) + ['county', 'year']))
+    # Columns missing from some batches are filled with nulls (promote_options replaced the promote argument in pyarrow 14)
+    try:
+        return pyarrow.concat_tables(tables, promote_options='default')
+    except TypeError:
+        return pyarrow.concat_tables(tables, promote=True)
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Columnar Tables **")
+
+    # Setting output directory holding the columnar directory
+    try:
+        output_directory_path = sys.argv[1].rstrip('/') + '/'
+    except:
+        output_directory_path = 'output/'
+
+    # Setting file format ('parquet' or 'arrow')
+    try:
+        columnar_format = sys.argv[2]
+    except:
+        columnar_format = 'parquet'
+
+    # Checking that keys holding a dictionary in some records and None in others (like Fixity in reused records) survive a round trip
+    round_trip_records = [
+        {'File Name': 'a.jpg', 'Preservation': {'Fixity': {'SHA-256': '9f86d081'}, 'JPEG Check': None}},
+        {'File Name': 'b.jpg', 'Preservation': {'Fixity': None, 'JPEG Check': {'Status': 'OK', 'Problems': []}}},
+        {'File Name': 'c.jpg', 'Preservation': {'Fixity': None, 'JPEG Check': None}}
+    ]
+    round_trip_file_path = os.path.join(tempfile.gettempdir(), 'dte_aerial_round_trip_check' + COLUMNAR_FILE_EXTENSIONS[columnar_format])
+    changed_positions = check_round_trip(round_trip_records, round_trip_file_path, columnar_format)
+    if len(changed_positions) > 0:
+        print('?? {} records changed in a round trip through a table ??'.format(str(len(changed_positions))))
+    else:
+        print('++ Records with mixed nested and None keys survive a round trip ++')
+
+    for table_name in TABLE_NAMES:
+        if os.path.isdir(output_directory_path + COLUMNAR_DIRECTORY_NAME + table_name):
+            table = read_collection_table(output_directory_path, table_name, None, columnar_format)
+            print('** {}: {} rows, {} columns **'.format(table_name, str(table.num_rows), str(table.num_columns)))
@@ -0,0 +1,152 @@
+# DTE Aerial Photo Collection curation project
+# Local point-in-polygon county lookup, used instead of reverse geocoding each link point with the ArcGIS API
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# NumPy documentation: https://numpy.org/doc/stable/
+# pyshp documentation: https://github.com/GeospatialPython/pyshp
+
+# County boundary polygons are loaded from a local GeoJSON file or shapefile (e.g. the Michigan county boundaries published
+# by the State of Michigan's GIS Open Data portal) and placed in a grid index. A batch of points is resolved by grouping the
+# points by grid cell and running a vectorized ray-casting test against only the polygons overlapping that cell.
+
+# standard modules
+import json
+
+# third-party modules
+import numpy as np
+
+# global variables
+COUNTY_BOUNDARIES_FILE_PATH = 'input/county_boundaries.geojson'
+# Property (or shapefile field) holding the county name
+COUNTY_NAME_PROPERTY = 'NAME'
+# Suffix added to county names so they match the 'Subregion' values returned by ArcGIS (e.g. "Macomb County")
+COUNTY_NAME_SUFFIX = ' County'
+# Width and height of grid index cells, in degrees
+GRID_CELL_SIZE = 0.1
+# Number of points tested against a polygon at once (limits the size of the point-by-vertex arrays)
+POINT_CHUNK_SIZE = 1024
+
+COUNTY_INDEX = None
+
+## Functions
+
+# Format a county name from the boundary file to match ArcGIS (e.g. "Macomb" becomes "Macomb County")
+def format_county_name(county_name):
+    county_name = str(county_name).strip()
+    if not county_name.endswith(COUNTY_NAME_SUFFIX.strip()):
+        county_name = county_name + COUNTY_NAME_SUFFIX
+    return county_name
+
+# Convert a GeoJSON Polygon or MultiPolygon geometry into a list of polygons, each a list of rings (NumPy arrays of lon/lat vertices)
+def split_geometry_into_polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        coordinate_lists = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        coordinate_lists = geometry['coordinates']
+    else:
+        return []
+    polygons = []
+    for ring_lists in coordinate_lists:
+        rings = []
+        for ring_list in ring_lists:
+            rings.append(np.asarray(ring_list, dtype=float)[:, :2])
+        polygons.append(rings)
+    return polygons
+
+# Load county names and geometries from a GeoJSON file or shapefile.
+# Returns: list of (county name, GeoJSON-style geometry dictionary) tuples
+def load_county_features(file_path=COUNTY_BOUNDARIES_FILE_PATH, name_property=COUNTY_NAME_PROPERTY):
+    county_features = []
+    if file_path.lower().endswith('.shp'):
+        import shapefile
+        shapefile_reader = shapefile.Reader(file_path)
+        for shape_record in shapefile_reader.iterShapeRecords():
+            county_features.append((shape_record.record[name_property], shape_record.shape.__geo_interface__))
+        shapefile_reader.close()
+    else:
+        boundaries_file = open(file_path, 'r', encoding='utf-8')
+        feature_collection = json.loads(boundaries_file.read())
+        boundaries_file.close()
+        for feature in feature_collection['features']:
+            county_features.append((feature['properties'][name_property], feature['geometry']))
+    return county_features
+
+# Find the range of grid cells covered by a bounding box
+def find_cell_range(min_x, min_y, max_x, max_y):
+    return (int(np.floor(min_x / GRID_CELL_SIZE)), int(np.floor(min_y / GRID_CELL_SIZE)),
+            int(np.floor(max_x / GRID_CELL_SIZE)), int(np.floor(max_y / GRID_CELL_SIZE)))
+
+# Build a grid index of county polygons from a boundary file.
+# Returns: dictionary with a list of county polygons ('Polygons', each a (county name, rings) tuple) and a dictionary mapping grid cells to polygon positions ('Grid')
+def build_county_index(file_path=COUNTY_BOUNDARIES_FILE_PATH, name_property=COUNTY_NAME_PROPERTY):
+    polygons = []
+    grid = {}
+    for county_name, geometry in load_county_features(file_path, name_property):
+        for rings in split_geometry_into_polygons(geometry):
+            polygon_position = len(polygons)
+            polygons.append((format_county_name(county_name), rings))
+            min_x, min_y = rings[0].min(axis=0)
+            max_x, max_y = rings[0].max(axis=0)
+            first_cell_x, first_cell_y, last_cell_x, last_cell_y = find_cell_range(min_x, min_y, max_x, max_y)
+            for cell_x in range(first_cell_x, last_cell_x + 1):
+                for cell_y in range(first_cell_y, last_cell_y + 1):
+                    grid.setdefault((cell_x, cell_y), []).append(polygon_position)
+    print('** Loaded {} county polygons from {} **'.format(str(len(polygons)), file_path))
+    return {'Polygons': polygons, 'Grid': grid}
+
+# Return the county index, building it from the boundary file the first time it is needed
+def get_county_index():
+    global COUNTY_INDEX
+    if COUNTY_INDEX is None:
+        COUNTY_INDEX = build_county_index(COUNTY_BOUNDARIES_FILE_PATH)
+    return COUNTY_INDEX
+
+# Test which points fall inside a polygon (a list of rings; rings after the first are holes) using even-odd ray casting.
+# Arguments: NumPy arrays of longitudes and latitudes. Returns: NumPy boolean array
+def find_points_in_polygon(longitudes, latitudes, rings):
+    inside = np.zeros(len(longitudes), dtype=bool)
+    for ring in rings:
+        x_one = ring[:, 0][np.newaxis, :]
+        y_one = ring[:, 1][np.newaxis, :]
+        x_two = np.roll(ring[:, 0], -1)[np.newaxis, :]
+        y_two = np.roll(ring[:, 1], -1)[np.newaxis, :]
+        for chunk_start in range(0, len(longitudes), POINT_CHUNK_SIZE):
+            point_x = longitudes[chunk_start:chunk_start + POINT_CHUNK_SIZE, np.newaxis]
+            point_y = latitudes[chunk_start:chunk_start + POINT_CHUNK_SIZE, np.newaxis]
+            straddles = (y_one > point_y) != (y_two > point_y)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing_x = x_one + (point_y - y_one) * (x_two - x_one) / (y_two - y_one)
+            crossings = np.count_nonzero(straddles & (point_x < crossing_x), axis=1)
+            inside[chunk_start:chunk_start + POINT_CHUNK_SIZE] ^= (crossings % 2 == 1)
+    return inside
+
+# Find the county containing each of a batch of points.
+# Arguments: sequences of longitudes and latitudes. Returns: list of county names (None for points outside every county polygon)
+def resolve_counties(longitudes, latitudes):
+    county_index = get_county_index()
+    longitudes = np.asarray(longitudes, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+    county_names = [None] * len(longitudes)
+    if len(longitudes) == 0:
+        return county_names
+
+    # Group points by grid cell so each group is only tested against the polygons overlapping its cell
+    cell_xs = np.floor(longitudes / GRID_CELL_SIZE).astype(int)
+    cell_ys = np.floor(latitudes / GRID_CELL_SIZE).astype(int)
+    cells, cell_positions = np.unique(np.stack([cell_xs, cell_ys], axis=1), axis=0, return_inverse=True)
+    cell_positions = cell_positions.reshape(-1)
+    point_order = np.argsort(cell_positions, kind='stable')
+    group_boundaries = np.cumsum(np.bincount(cell_positions, minlength=len(cells)))[:-1]
+    for cell, point_positions in zip(cells, np.split(point_order, group_boundaries)):
+        for polygon_position in county_index['Grid'].get((int(cell[0]), int(cell[1])), []):
+            if len(point_positions) == 0:
+                break
+            county_name, rings = county_index['Polygons'][polygon_position]
+            inside = find_points_in_polygon(longitudes[point_positions], latitudes[point_positions], rings)
+            for point_position in point_positions[inside]:
+                county_names[point_position] = county_name
+            point_positions = point_positions[~inside]
+    return county_names
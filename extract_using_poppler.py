@@ -8,6 +8,8 @@
 
 # os documentation: https://docs.python.org/3/library/os.html#module-os
 # subprocess documentation: https://docs.python.org/3/library/subprocess.html
+# concurrent.futures documentation: https://docs.python.org/3/library/concurrent.futures.html
+# JPEG specification (ITU T.81): https://www.w3.org/Graphics/JPEG/itu-t81.pdf
 
 # This implementation of Poppler requires a Linux operating system, or an equivalent setup.
 # Poppler documentation: https://poppler.freedesktop.org/
@@ -18,7 +20,9 @@
 import time
 import json
 import os
+import struct
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 
 # third-party modules
 import gi
@@ -27,6 +31,14 @@ from gi.repository import Gio, Poppler, cairo
 
 # local modules
 import misc_functions
+import pdf_scanner
+
+# global variables
+# Number of worker processes used to extract images (None uses one per CPU; 1 extracts serially)
+EXTRACTION_WORKERS = None
+# JPEG start of frame markers, which hold the image dimensions
+JPEG_FRAME_MARKERS = [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF]
+JPEG_COLOR_SPACES = {1: 'DeviceGray', 3: 'DeviceRGB', 4: 'DeviceCMYK'}
 
 ## Functions
 
@@ -39,7 +51,7 @@ def pull_links_from_index(relative_path):
 	# print(new_pdf_object.get_pdf_version())
 
 	if new_pdf_object.get_n_pages() > 1:
-		print('?? More than one page: {} ??'.format(str(new_pdf_object.getNumPages())))
+		print('?? More than one page: {} ??'.format(str(new_pdf_object.get_n_pages())))
 	pdf_page = new_pdf_object.get_page(0)
 
 	size_result = pdf_page.get_size()
@@ -90,7 +102,79 @@ def pull_links_from_index(relative_path):
 	}
 	return index_file_metadata
 
-# Identify JPEG bytestream in Image PDF, write it to a new file, and collect image-level metadata
+# Read the dimensions, number of color components, and bit depth from the frame header of a JPEG file, without decoding its pixels.
+# Returns: dictionary with the values, or None if no frame header is found
+def read_jpeg_header(jpeg_file_path):
+	jpeg_file = open(jpeg_file_path, 'rb')
+	jpeg_header = None
+	if jpeg_file.read(2) == b'\xff\xd8':
+		while True:
+			marker = jpeg_file.read(2)
+			if len(marker) < 2 or marker[0] != 0xFF or marker[1] in [0xD9, 0xDA]:
+				break
+			if marker[1] in JPEG_FRAME_MARKERS:
+				segment_length, precision, height, width, component_count = struct.unpack('>HBHHB', jpeg_file.read(8))
+				jpeg_header = {'Width': width, 'Height': height, 'Components': component_count, 'Precision': precision}
+				break
+			# Skip the other marker segments using their lengths
+			segment_length = struct.unpack('>H', jpeg_file.read(2))[0]
+			jpeg_file.seek(segment_length - 2, 1)
+	jpeg_file.close()
+	return jpeg_header
+
+# Copy the JPEG bytestream of an image PDF to a new file inside this process, locating it with pdf_scanner.py.
+# Returns: True if the bytestream was copied, or False if it could not be located (or is not a JPEG)
+def copy_jpeg_bytestream(relative_path, jpeg_file_path):
+	image_pdf_file = open(relative_path, 'rb')
+	try:
+		scanned_image = pdf_scanner.scan_image_pdf(image_pdf_file)
+	except (ValueError, KeyError, TypeError):
+		scanned_image = None
+	copied = False
+	if scanned_image is not None:
+		image_dictionary, data_offset, data_length = scanned_image['Images'][0]
+		if image_dictionary['/Filter'] == '/DCTDecode':
+			misc_functions.copy_byte_range(image_pdf_file, data_offset, data_length, jpeg_file_path)
+			copied = True
+	image_pdf_file.close()
+	return copied
+
+# Find the first image written by pdfimages for an image root. pdfimages numbers the images it writes (e.g. dte_aerial_fm-11-100-000.jpg),
+# and with -j only writes JPEGs for DCT-encoded images, using its other formats (e.g. .ppm, .pbm, .jp2) for the rest.
+# Returns: the path of the image, or None if pdfimages wrote no images
+def find_pdfimages_output(image_root):
+	image_directory = os.path.dirname(image_root) or '.'
+	image_prefix = os.path.basename(image_root) + '-000.'
+	image_file_names = sorted(file_name for file_name in os.listdir(image_directory) if file_name.startswith(image_prefix))
+	if len(image_file_names) == 0:
+		return None
+	# Prefer the JPEG if pdfimages wrote one
+	for image_file_name in image_file_names:
+		if image_file_name.endswith('.jpg'):
+			return os.path.join(image_directory, image_file_name)
+	return os.path.join(image_directory, image_file_names[0])
+
+# Convert an image written by pdfimages in another format to a JPEG with Pillow, removing the original.
+# Returns: True if the image was converted, or False if Pillow is not installed or cannot read the image
+def convert_to_jpeg(image_file_path, jpeg_file_path):
+	try:
+		from PIL import Image
+	except ImportError:
+		return False
+	try:
+		image = Image.open(image_file_path)
+		if image.mode not in ['L', 'RGB', 'CMYK']:
+			image = image.convert('L' if image.mode == '1' else 'RGB')
+		image.save(jpeg_file_path, 'JPEG', quality=95)
+		image.close()
+	except (OSError, Image.DecompressionBombError):
+		return False
+	os.remove(image_file_path)
+	return True
+
+# Identify JPEG bytestream in Image PDF, write it to a new file, and collect image-level metadata.
+# The bytestream is copied inside this process when it can be located, so pdfimages is only run for PDFs the scanner cannot read,
+# and image metadata comes from the JPEG's frame header instead of from rendering the image with Poppler.
 def extract_jpg_from_pdf(relative_path, output_location=''):
 	image_pdf_file_name = relative_path.split('/')[-1]
 	print('// Image: {} //'.format(image_pdf_file_name))
@@ -101,53 +185,83 @@ def extract_jpg_from_pdf(relative_path, output_location=''):
 	# print(new_pdf_object.get_pdf_version())
 
 	if new_pdf_object.get_n_pages() > 1:
-		print('** More than one page: {} **'.format(str(test_image_pdf_file_object.getNumPages())))
+		print('** More than one page: {} **'.format(str(new_pdf_object.get_n_pages())))
 	pdf_page = new_pdf_object.get_page(0)
 
-	# This block is used to enable the collection of the dimensions of the image (height, width).
-	# However, this seems to add a couple of seconds to the processing time required.
+	# Image mappings locate the images on the page without rendering them
 	image_mappings = pdf_page.get_image_mapping()
 	if len(image_mappings) > 1:
 		print("?? More than one image: {} ??".format(str(len(image_mappings))))
-	image_identifier = image_mappings[0].image_id
-	surface_object = pdf_page.get_image(image_identifier)
-	image_object = surface_object.map_to_image(None)
-	# bytestream = image_object.get_data().tobytes()
+
+	identifier = image_pdf_file_name.replace('.pdf', '')
+	new_image_file_name = 'dte_aerial_' + identifier + '.jpg'
+	if not copy_jpeg_bytestream(relative_path, output_location + new_image_file_name):
+		# This uses one of the poppler-utils, a command-line tool called pdfimages.
+		# This particular command-line tool can also output images as TIFFs.
+		image_root = (output_location + new_image_file_name).replace('.jpg', '')
+		subprocess.run(['pdfimages', '-j', relative_path, image_root])
+		# The first image is renamed to the expected file name, or converted to a JPEG if pdfimages wrote another format
+		image_file_path = find_pdfimages_output(image_root)
+		if image_file_path is None:
+			print('?? pdfimages wrote no image for {}; skipping ??'.format(image_pdf_file_name))
+			new_image_file_name = None
+		elif image_file_path.endswith('.jpg'):
+			os.replace(image_file_path, output_location + new_image_file_name)
+		elif convert_to_jpeg(image_file_path, output_location + new_image_file_name):
+			print('-- Converted {} written by pdfimages to a JPEG --'.format(os.path.basename(image_file_path)))
+		else:
+			print('?? pdfimages wrote {}, which could not be converted to a JPEG; skipping ??'.format(os.path.basename(image_file_path)))
+			new_image_file_name = None
 
 	image_pdf_metadata = {
 		'Image File Name': image_pdf_file_name,
-		'Source Relative Path': relative_path,
-		'Height': image_object.get_height(),
-		'Width': image_object.get_width()
+		'Source Relative Path': relative_path
 	}
-
-	# This uses one of the poppler-utils, a command-line tool called pdfimages.
-  	# I haven't yet found a way to accomplish the following through the Python interfaces.
-	# This particular command-line tool can also output images as TIFFs.
-
-	identifier = image_pdf_file_name.replace('.pdf', '')
-	new_image_file_name = 'dte_aerial_' + identifier + '.jpg'
-	subprocess.run(['pdfimages', '-j', relative_path, (output_location + new_image_file_name).replace('.jpg', '')])
+	if new_image_file_name is None:
+		jpeg_header = None
+	else:
+		jpeg_header = read_jpeg_header(output_location + new_image_file_name)
+	if jpeg_header is not None:
+		image_pdf_metadata['Width'] = jpeg_header['Width']
+		image_pdf_metadata['Height'] = jpeg_header['Height']
+		image_pdf_metadata['ColorSpace'] = JPEG_COLOR_SPACES.get(jpeg_header['Components'])
+		image_pdf_metadata['BitsPerComponent'] = jpeg_header['Precision']
+		image_pdf_metadata['Filter'] = 'DCTDecode'
+	elif new_image_file_name is not None:
+		print('?? No JPEG frame header found in {} ??'.format(new_image_file_name))
 	image_pdf_metadata['Created Image File Name'] = new_image_file_name
 
 	return image_pdf_metadata
 
-# Manage function invocations and write resulting metadata to a JSON file
-def run_poppler_workflow(pdf_file_paths, output_location, output_name):
+# Manage function invocations and write resulting metadata to a JSON file.
+# When workers is greater than one (or None, meaning one per CPU), image PDFs are extracted by a pool of long-lived worker processes,
+# each handling a chunk of PDFs, so Poppler is loaded once per worker instead of once per PDF.
+def run_poppler_workflow(pdf_file_paths, output_location, output_name, workers=1):
 	poppler_start = time.time()
-	image_metadata_dicts = []
+	if workers is None:
+		workers = os.cpu_count()
 	index_metadata_dicts = []
+	image_pdf_file_paths = []
 	for pdf_file_path in pdf_file_paths:
 		if 'Index' in pdf_file_path:
 			new_index_metadata_dict = pull_links_from_index(pdf_file_path)
 			index_metadata_dicts.append(new_index_metadata_dict)
 		else:
-			image_metadata_dict = extract_jpg_from_pdf(pdf_file_path, output_location)
+			image_pdf_file_paths.append(pdf_file_path)
+	if workers > 1 and len(image_pdf_file_paths) > 1:
+		output_locations = [output_location] * len(image_pdf_file_paths)
+		chunk_size = max(1, len(image_pdf_file_paths) // (workers * 4))
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			image_metadata_dicts = list(executor.map(extract_jpg_from_pdf, image_pdf_file_paths, output_locations, chunksize=chunk_size))
+	else:
+		image_metadata_dicts = []
+		for image_pdf_file_path in image_pdf_file_paths:
+			image_metadata_dict = extract_jpg_from_pdf(image_pdf_file_path, output_location)
 			image_metadata_dicts.append(image_metadata_dict)
 	sample_poppler_batch_metadata = {}
 	sample_poppler_batch_metadata['Index Records'] = index_metadata_dicts
 	sample_poppler_batch_metadata['Image Records'] = image_metadata_dicts
-	poppler_metadata_file = open('output/poppler/' + output_name, 'w', encoding='utf-8')
+	poppler_metadata_file = open(output_location + output_name, 'w', encoding='utf-8')
 	poppler_metadata_file.write(json.dumps(sample_poppler_batch_metadata, indent=4))
 	poppler_metadata_file.close()
 	poppler_end = time.time()
@@ -160,4 +274,4 @@ if __name__=="__main__":
 	print("** Poppler Solution **")
 	output_location = 'output/poppler/'
 	pdf_file_paths = misc_functions.collect_relative_paths_for_files('input/part1/macomb/1961')
-	run_poppler_workflow(pdf_file_paths, output_location, 'sample_poppler_batch_metadata.json')
+	run_poppler_workflow(pdf_file_paths, output_location, 'sample_poppler_batch_metadata.json', EXTRACTION_WORKERS)
@@ -8,34 +8,56 @@
 
 # PyPDF2 documentation: https://pythonhosted.org/PyPDF2/index.html
 # os documentation: https://docs.python.org/3/library/os.html#module-os
+# concurrent.futures documentation: https://docs.python.org/3/library/concurrent.futures.html
 
 # This script uses algorithmic features of a solution posted by sylvain to a Stack Overflow question:
 # https://stackoverflow.com/questions/2693820/extract-images-from-pdf-without-resampling-in-python
 
 # standard modules
+import io
 import os
-import json
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 # third-party modules
 import PyPDF2
 
 # local modules
 import misc_functions
+import pdf_scanner
+import extraction_manifest
+import fixity
+import json_streaming
+import pipeline_metrics
 
 # global variables
 PATH_DELIMITER = misc_functions.PATH_DELIMITER
+# Read the values needed from each PDF with pdf_scanner.py, using PyPDF2 only for PDFs the scanner cannot handle
+LIGHTWEIGHT_SCANNING = True
+# Copy image streams directly from the PDF file to the JPEG file instead of reading them into memory through PyPDF2
+ZERO_COPY_EXTRACTION = True
+# Calculate checksums and check the structure of each JPEG while it is written (see fixity.py).
+# The bytes then pass through a memory map instead of being copied inside the kernel.
+FIXITY_CHECKING = True
+# Maximum number of bytes read to find the dictionary and 'stream' keyword at the start of an image stream object
+STREAM_HEADER_MAX_SIZE = 64 * 1024
 
 ## Functions
 
-# Identify embedded links in Index PDF and collect metadata
-def pull_links_from_index(relative_path):
-	index_pdf_file_name = relative_path.split(PATH_DELIMITER)[-1]
-	print('// Index: {} //'.format(index_pdf_file_name))
-	index_pdf_file_object = PyPDF2.PdfFileReader(relative_path)
+# Scan an open PDF file with one of the pdf_scanner.py functions.
+# Returns: the scan results, or None if the scanner could not handle the PDF's structure (so PyPDF2 should be used instead)
+def scan_with_fallback(scan_function, pdf_file):
+	try:
+		return scan_function(pdf_file)
+	except (ValueError, KeyError, TypeError) as error:
+		print('?? Using PyPDF2 instead of the scanner: {} ??'.format(error))
+		pipeline_metrics.increment_counter('Scanner Fallbacks')
+		return None
 
-	if index_pdf_file_object.getNumPages() > 1:
-		print('?? More than one page: {} ??'.format(str(index_pdf_file_object.getNumPages())))
+# Collect the page count, media box, and link dictionaries from an open Index PDF file using PyPDF2
+def read_links_with_pypdf2(index_pdf_file):
+	index_pdf_file_object = PyPDF2.PdfFileReader(index_pdf_file)
+	page_count = index_pdf_file_object.getNumPages()
 	pdf_page = index_pdf_file_object.getPage(0)
 
 	media_box = pdf_page['/MediaBox']
@@ -74,6 +96,28 @@ def pull_links_from_index(relative_path):
 			print("?? Annotation does not have a '/A' key ??")
 			print(annot_object['/AP']['/N'].getObject()['/Subtype'])
 			#print(object_number) #for error testing
+	return page_count, media_box, links
+
+# Identify embedded links in Index PDF and collect metadata.
+# The links are found with pdf_scanner.py when scanning is True (or None and LIGHTWEIGHT_SCANNING is True), and with PyPDF2 otherwise.
+def pull_links_from_index(relative_path, scanning=None):
+	index_start = time.perf_counter()
+	index_pdf_file_name = relative_path.split(PATH_DELIMITER)[-1]
+	print('// Index: {} //'.format(index_pdf_file_name))
+	index_pdf_file = open(relative_path, 'rb')
+	scanned_index = None
+	if scanning or (scanning is None and LIGHTWEIGHT_SCANNING):
+		scanned_index = scan_with_fallback(pdf_scanner.scan_index_pdf, index_pdf_file)
+	if scanned_index is not None:
+		page_count, media_box, links = scanned_index['Page Count'], scanned_index['Media Box'], scanned_index['Links']
+	else:
+		page_count, media_box, links = read_links_with_pypdf2(index_pdf_file)
+	index_pdf_file.close()
+	pipeline_metrics.increment_counter('Index PDFs Read')
+	pipeline_metrics.increment_counter('Links Found', len(links))
+
+	if page_count > 1:
+		print('?? More than one page: {} ??'.format(str(page_count)))
 	links = sorted(links, key=lambda x: x['Linked Image File Name'])
 	print('** Number of links identified: {} **'.format(str(len(links))))
 
@@ -84,26 +128,90 @@ def pull_links_from_index(relative_path):
 		'Links': links,
 		'Media Box': media_box
 	}
+	pipeline_metrics.record_time('Index PDF Parsing', time.perf_counter() - index_start, 'Index PDF Latency')
 	return index_file_metadata
 
-# Identify JPEG bytestream in Image PDF, write it to a new file, and collect image-level metadata
-def extract_jpg_from_pdf(relative_path, output_location=''):
-	image_pdf_file_name = relative_path.split(PATH_DELIMITER)[-1]
-	print('// Image: {} //'.format(image_pdf_file_name))
-	image_pdf_file_object = PyPDF2.PdfFileReader(relative_path)
+# Find where the data of a stream object starts in the PDF file and how long it is, using the offset of the object in the xref table.
+# Only the stream dictionary is parsed; the stream data itself is not read.
+# Returns: stream dictionary, data offset, and data length, or None if the object cannot be located this way (e.g. in encrypted PDFs or object streams)
+def locate_stream_data(pdf_reader, indirect_object):
+	if pdf_reader.isEncrypted or indirect_object.idnum in pdf_reader.xref_objStm:
+		return None
+	object_offsets = pdf_reader.xref.get(indirect_object.generation, {})
+	if indirect_object.idnum not in object_offsets:
+		return None
+	pdf_file = pdf_reader.stream
+	pdf_file.seek(object_offsets[indirect_object.idnum])
+	pdf_reader.readObjectHeader(pdf_file)
+	header_start = pdf_file.tell()
+	header_bytes = pdf_file.read(STREAM_HEADER_MAX_SIZE)
+	keyword_position = header_bytes.find(b'stream')
+	if keyword_position == -1:
+		return None
+	stream_dictionary = PyPDF2.generic.readObject(io.BytesIO(header_bytes[:keyword_position].strip()), pdf_reader)
+	if not isinstance(stream_dictionary, PyPDF2.generic.DictionaryObject) or '/Length' not in stream_dictionary:
+		return None
+	# The 'stream' keyword is followed by CRLF or LF before the data begins
+	data_offset = header_start + keyword_position + 6
+	if header_bytes[keyword_position + 6:keyword_position + 8] == b'\r\n':
+		data_offset += 2
+	elif header_bytes[keyword_position + 6:keyword_position + 7] in [b'\n', b'\r']:
+		data_offset += 1
+	data_length = int(stream_dictionary['/Length'])
+	# Check that the length is right by looking for the 'endstream' keyword after the data
+	pdf_file.seek(data_offset + data_length)
+	if not pdf_file.read(32).lstrip().startswith(b'endstream'):
+		return None
+	return stream_dictionary, data_offset, data_length
 
-	if image_pdf_file_object.getNumPages() > 1:
-		print('?? More than one page: {} ??'.format(str(test_image_pdf_file_object.getNumPages())))
+# Collect the page count and image XObjects from an open Image PDF file using PyPDF2.
+# Image objects are located without resolving them when ZERO_COPY_EXTRACTION is True, so their data is not read by PyPDF2.
+# Returns: page count and list of (image dictionary, data offset, data length) tuples; the offset and length are None if the stream could not be located
+def read_images_with_pypdf2(image_pdf_file):
+	image_pdf_file_object = PyPDF2.PdfFileReader(image_pdf_file)
+	page_count = image_pdf_file_object.getNumPages()
 	pdf_page = image_pdf_file_object.getPage(0)
 
 	objects = pdf_page['/Resources']['/XObject']
-	image_objects = []
+	images = []
 	for object_name in objects:
-		if objects[object_name]['/Subtype'] == '/Image':
-			image_objects.append(objects[object_name])
-	if len(image_objects) > 1:
-		print("?? More than one image: {} ??".format(str(len(image_objects))))
-	image_object = image_objects[0]
+		raw_object = objects.raw_get(object_name)
+		stream_location = None
+		if ZERO_COPY_EXTRACTION and isinstance(raw_object, PyPDF2.generic.IndirectObject):
+			stream_location = locate_stream_data(image_pdf_file_object, raw_object)
+		if stream_location is not None:
+			xobject, data_offset, data_length = stream_location
+		else:
+			xobject, data_offset, data_length = objects[object_name], None, None
+		if xobject['/Subtype'] == '/Image':
+			images.append((xobject, data_offset, data_length))
+	return page_count, images
+
+# Identify JPEG bytestream in Image PDF, write it to a new file, and collect image-level metadata.
+# The image is found with pdf_scanner.py when scanning is True (or None and LIGHTWEIGHT_SCANNING is True), and with PyPDF2 otherwise
+# (or if the scanner cannot handle the PDF).
+# The PDF is read from an open file rather than loaded into memory, and when ZERO_COPY_EXTRACTION is True, the image stream is
+# copied straight from the PDF file to the JPEG file. Otherwise (or if the stream cannot be located), its data is read into memory first.
+# When FIXITY_CHECKING is True, the checksums and JPEG check results are collected from the bytes as they are written.
+def extract_jpg_from_pdf(relative_path, output_location='', scanning=None):
+	image_start = time.perf_counter()
+	image_pdf_file_name = relative_path.split(PATH_DELIMITER)[-1]
+	print('// Image: {} //'.format(image_pdf_file_name))
+	image_pdf_file = open(relative_path, 'rb')
+	scanned_image = None
+	if scanning or (scanning is None and LIGHTWEIGHT_SCANNING):
+		scanned_image = scan_with_fallback(pdf_scanner.scan_image_pdf, image_pdf_file)
+	if scanned_image is not None:
+		page_count, images = scanned_image['Page Count'], scanned_image['Images']
+	else:
+		page_count, images = read_images_with_pypdf2(image_pdf_file)
+	pipeline_metrics.record_time('Image PDF Parsing', time.perf_counter() - image_start)
+
+	if page_count > 1:
+		print('?? More than one page: {} ??'.format(str(page_count)))
+	if len(images) > 1:
+		print("?? More than one image: {} ??".format(str(len(images))))
+	image_object, data_offset, data_length = images[0]
 
 	image_metadata = {
 		'Image File Name': image_pdf_file_name,
@@ -117,32 +225,137 @@ def extract_jpg_from_pdf(relative_path, output_location=''):
 
 	identifier = image_pdf_file_name.replace('.pdf', '')
 	new_image_file_name = 'dte_aerial_' + identifier + '.jpg'
-	jpg_file = open(output_location + new_image_file_name, 'wb')
-	jpg_file.write(image_object._data)
-	jpg_file.close()
+	copy_start = time.perf_counter()
+	checksums, jpeg_check = None, None
+	if data_offset is not None and ZERO_COPY_EXTRACTION and FIXITY_CHECKING:
+		checksums, jpeg_check = fixity.copy_jpeg_with_fixity(image_pdf_file, data_offset, data_length, output_location + new_image_file_name, image_metadata['Width'], image_metadata['Height'])
+	elif data_offset is not None and ZERO_COPY_EXTRACTION:
+		misc_functions.copy_byte_range(image_pdf_file, data_offset, data_length, output_location + new_image_file_name)
+	else:
+		if data_offset is not None:
+			image_pdf_file.seek(data_offset)
+			image_data = image_pdf_file.read(data_length)
+		else:
+			image_data = image_object._data
+		if FIXITY_CHECKING:
+			checksums, jpeg_check = fixity.write_jpeg_with_fixity(image_data, output_location + new_image_file_name, image_metadata['Width'], image_metadata['Height'])
+		else:
+			jpg_file = open(output_location + new_image_file_name, 'wb')
+			jpg_file.write(image_data)
+			jpg_file.close()
+		data_length = len(image_data)
+	image_pdf_file.close()
 	image_metadata['Created Image File Name'] = new_image_file_name
+	image_metadata['Fixity'] = checksums
+	image_metadata['JPEG Check'] = jpeg_check
+	if jpeg_check is not None and jpeg_check['Status'] != 'Passed':
+		print('?? JPEG check failed: {} ??'.format('; '.join(jpeg_check['Problems'])))
+	pipeline_metrics.record_time('Image Byte Copying', time.perf_counter() - copy_start)
+	pipeline_metrics.increment_counter('Image PDFs Extracted')
+	pipeline_metrics.increment_counter('Image Bytes Copied', data_length)
+	pipeline_metrics.record_time('Image PDF Extraction', time.perf_counter() - image_start, 'Image PDF Latency')
 
 	return image_metadata
 
-# Manage function invocations and write resulting metadata to a JSON file
-def run_pypdf2_workflow(pdf_file_paths, output_location, output_name):
-	print('** Image Extraction: PyPDF2 Solution **')
+# Run extract_jpg_from_pdf (or another backend's image extraction function) inside a pool worker,
+# returning the worker's process ID, the time spent, the source file size, and the metrics recorded along with the image metadata
+def extract_jpg_in_worker(relative_path, output_location, extract_function=extract_jpg_from_pdf):
+	start = time.time()
+	image_metadata = extract_function(relative_path, output_location)
+	elapsed = time.time() - start
+	return os.getpid(), elapsed, os.path.getsize(relative_path), image_metadata, pipeline_metrics.take_metrics()
+
+# Print the number of files, megabytes, and files per second handled by each pool worker
+def report_worker_throughput(worker_results):
+	worker_stats = {}
+	for worker_id, elapsed, file_size, image_metadata, worker_metrics in worker_results:
+		if worker_id not in worker_stats:
+			worker_stats[worker_id] = {'Files': 0, 'Bytes': 0, 'Seconds': 0.0}
+		worker_stats[worker_id]['Files'] += 1
+		worker_stats[worker_id]['Bytes'] += file_size
+		worker_stats[worker_id]['Seconds'] += elapsed
+	print('** Worker Throughput **')
+	for worker_id in sorted(worker_stats):
+		stats = worker_stats[worker_id]
+		files_per_second = stats['Files'] / stats['Seconds'] if stats['Seconds'] > 0 else 0.0
+		megabytes = stats['Bytes'] / (1024 * 1024)
+		print('   Worker {}: {} files, {:.1f} MB, {:.2f} files/s'.format(worker_id, stats['Files'], megabytes, files_per_second))
+	return worker_stats
+
+# Extract JPEGs from image PDFs using a pool of worker processes.
+# Results are returned in the same order as image_pdf_file_paths, so Image Records are deterministic regardless of which worker finishes first.
+def extract_jpgs_in_parallel(image_pdf_file_paths, output_location, workers, extract_function=extract_jpg_from_pdf):
+	output_locations = [output_location] * len(image_pdf_file_paths)
+	extract_functions = [extract_function] * len(image_pdf_file_paths)
+	chunk_size = max(1, len(image_pdf_file_paths) // (workers * 4))
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		worker_results = list(executor.map(extract_jpg_in_worker, image_pdf_file_paths, output_locations, extract_functions, chunksize=chunk_size))
+	report_worker_throughput(worker_results)
+	image_metadata_dicts = []
+	for worker_result in worker_results:
+		image_metadata_dicts.append(worker_result[3])
+		pipeline_metrics.merge_metrics(worker_result[4])
+	return image_metadata_dicts
+
+# Manage function invocations and write resulting metadata to a JSON file.
+# When workers is greater than one (or None, meaning one per CPU), image PDFs are extracted in a process pool.
+# When incremental is True, only PDFs that are new or modified since the last run (according to the manifest file) are processed,
+# and the records from the previous batch metadata file are reused for the rest.
+# backend is an extraction backend from extraction_backends.py; by default, the functions in this script are used.
+def run_pypdf2_workflow(pdf_file_paths, output_location, output_name, workers=1, incremental=False, output_format='pretty', backend=None):
+	if backend is None:
+		print('** Image Extraction: PyPDF2 Solution **')
+		pull_links_function, extract_function = pull_links_from_index, extract_jpg_from_pdf
+	else:
+		print('** Image Extraction: {} Backend **'.format(backend['Name']))
+		pull_links_function, extract_function = backend['Index Function'], backend['Image Function']
 	pypdf_start = time.time()
+	if workers is None:
+		workers = os.cpu_count()
+
+	if incremental:
+		manifest_path = output_location + extraction_manifest.make_manifest_file_name(output_name)
+		manifest = extraction_manifest.load_manifest(manifest_path)
+		previous_records = extraction_manifest.load_previous_records(output_location + output_name)
+		changed_file_paths, records_by_path, manifest = extraction_manifest.find_changed_files(pdf_file_paths, manifest, previous_records, output_location, FIXITY_CHECKING)
+		print('** {} of {} PDFs are new or modified **'.format(str(len(changed_file_paths)), str(len(pdf_file_paths))))
+		pipeline_metrics.increment_counter('Unchanged PDFs Skipped', len(pdf_file_paths) - len(changed_file_paths))
+	else:
+		changed_file_paths = pdf_file_paths
+		records_by_path = {}
+
+	image_pdf_file_paths = []
+	for pdf_file_path in changed_file_paths:
+		if 'Index' in pdf_file_path:
+			records_by_path[pdf_file_path] = pull_links_function(pdf_file_path)
+		else:
+			image_pdf_file_paths.append(pdf_file_path)
+	if workers > 1 and len(image_pdf_file_paths) > 1:
+		print('** Extracting images with {} worker processes **'.format(str(workers)))
+		new_image_metadata_dicts = extract_jpgs_in_parallel(image_pdf_file_paths, output_location, workers, extract_function)
+	else:
+		new_image_metadata_dicts = []
+		for image_pdf_file_path in image_pdf_file_paths:
+			image_metadata_dict = extract_function(image_pdf_file_path, output_location)
+			new_image_metadata_dicts.append(image_metadata_dict)
+	for image_pdf_file_path, image_metadata_dict in zip(image_pdf_file_paths, new_image_metadata_dicts):
+		records_by_path[image_pdf_file_path] = image_metadata_dict
+
+	# Assemble new and reused records in the order the PDF paths were provided
 	image_metadata_dicts = []
 	index_metadata_dicts = []
 	for pdf_file_path in pdf_file_paths:
 		if 'Index' in pdf_file_path:
-			new_index_metadata_dict = pull_links_from_index(pdf_file_path)
-			index_metadata_dicts.append(new_index_metadata_dict)
+			index_metadata_dicts.append(records_by_path[pdf_file_path])
 		else:
-			image_metadata_dict = extract_jpg_from_pdf(pdf_file_path, output_location)
-			image_metadata_dicts.append(image_metadata_dict)
+			image_metadata_dicts.append(records_by_path[pdf_file_path])
 	pypdf2_batch_metadata = {}
 	pypdf2_batch_metadata['Index Records'] = index_metadata_dicts
 	pypdf2_batch_metadata['Image Records'] = image_metadata_dicts
-	pypdf2_metadata_file = open(output_location + output_name, 'w', encoding='utf-8')
-	pypdf2_metadata_file.write(json.dumps(pypdf2_batch_metadata, indent=4))
-	pypdf2_metadata_file.close()
+	with pipeline_metrics.time_block('Batch Metadata Serialization'):
+		json_streaming.write_json_document(output_location + output_name, pypdf2_batch_metadata, output_format)
+	if incremental:
+		extraction_manifest.write_manifest(manifest_path, manifest)
 	pypdf_end = time.time()
 	print('** Time to Run: {} **'.format(str(pypdf_end - pypdf_start)))
 	return pypdf2_batch_metadata
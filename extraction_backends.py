@@ -0,0 +1,157 @@
+# DTE Aerial Photo Collection curation project
+# Registry of extraction backends sharing one record schema
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# functools documentation: https://docs.python.org/3/library/functools.html
+# importlib documentation: https://docs.python.org/3/library/importlib.html
+
+# An extraction backend is a pair of functions: one taking the relative path of an index PDF and returning an index record,
+# and one taking the relative path of an image PDF and an output location, writing the JPEG, and returning an image record.
+# Every backend returns records with the same keys (listed below), using None for values it cannot collect, so the
+# georeferencing and matching workflows work the same way with any of them. Backends are registered by name, and
+# process_batch.py selects one with its EXTRACTION_BACKEND global variable.
+# Registered backends:
+#   'scanner' - extract_using_pypdf.py, reading PDFs with pdf_scanner.py (falling back to PyPDF2)
+#   'pypdf2'  - extract_using_pypdf.py, reading PDFs with PyPDF2
+#   'poppler' - extract_using_poppler.py (requires PyGObject, Poppler, and the pdfimages command as a fallback); Poppler does not report
+#               the object numbers of links, so each link is given a stand-in number from its page and position (see make_poppler_link_id)
+
+# standard modules
+import shutil
+import importlib.util
+from functools import partial
+
+# local modules
+import extract_using_pypdf
+import fixity
+
+# global variables
+INDEX_RECORD_KEYS = ['Index File Name', 'Source Relative Path', 'Links', 'Media Box']
+LINK_KEYS = ['PDF Object ID Number', 'Linked Image File Name', 'Link Coordinates', 'File or URI?']
+IMAGE_RECORD_KEYS = ['Image File Name', 'Source Relative Path', 'Width', 'Height', 'ColorSpace', 'BitsPerComponent', 'Filter', 'Created Image File Name', 'Fixity', 'JPEG Check']
+
+# Stand-in PDF Object ID Numbers for Poppler links are the page number times this base, plus the link's position on the page
+POPPLER_LINK_ID_BASE = 100000
+
+BACKENDS = {}
+
+## Functions
+
+# Add a backend to the registry. Backends needing modules or commands that may not be installed list them so availability can be checked.
+def register_backend(name, index_function, image_function, description='', required_modules=None, required_commands=None):
+    if required_modules is None:
+        required_modules = []
+    if required_commands is None:
+        required_commands = []
+    BACKENDS[name] = {
+        'Name': name,
+        'Description': description,
+        'Index Function': index_function,
+        'Image Function': image_function,
+        'Required Modules': required_modules,
+        'Required Commands': required_commands
+    }
+
+# Check whether the modules and commands a backend needs are installed
+def check_backend_available(name):
+    backend = BACKENDS[name]
+    for module_name in backend['Required Modules']:
+        if importlib.util.find_spec(module_name) is None:
+            return False
+    for command in backend['Required Commands']:
+        if shutil.which(command) is None:
+            return False
+    return True
+
+# List the names of registered backends that can run on this machine
+def list_available_backends():
+    available_backends = []
+    for name in BACKENDS:
+        if check_backend_available(name):
+            available_backends.append(name)
+    return available_backends
+
+# Look up a backend by name. Raises ValueError if the name is not registered or the backend's dependencies are missing.
+def get_backend(name):
+    if name not in BACKENDS:
+        raise ValueError('Unknown extraction backend: {} (registered backends: {})'.format(name, ', '.join(BACKENDS)))
+    if not check_backend_available(name):
+        raise ValueError('Extraction backend {} is not available; it requires {}'.format(name, ', '.join(BACKENDS[name]['Required Modules'] + BACKENDS[name]['Required Commands'])))
+    return BACKENDS[name]
+
+# Find the keys missing from a record and the keys it has that are not in the schema
+def check_record_keys(record, keys):
+    missing_keys = [key for key in keys if key not in record]
+    extra_keys = [key for key in record if key not in keys]
+    return missing_keys, extra_keys
+
+# Check an index or image record (and, for index records, its links) against the shared schema.
+# Returns: list of problems found, as strings (empty if the record matches the schema)
+def check_record_schema(record, record_type):
+    problems = []
+    keys = INDEX_RECORD_KEYS if record_type == 'Index' else IMAGE_RECORD_KEYS
+    missing_keys, extra_keys = check_record_keys(record, keys)
+    if missing_keys or extra_keys:
+        problems.append('{} record keys missing: {}; unexpected: {}'.format(record_type, missing_keys, extra_keys))
+    if record_type == 'Index':
+        for link in record.get('Links', []):
+            missing_keys, extra_keys = check_record_keys(link, LINK_KEYS)
+            if missing_keys or extra_keys:
+                problems.append('Link keys missing: {}; unexpected: {}'.format(missing_keys, extra_keys))
+                break
+    return problems
+
+# Make a stable stand-in for the PDF Object ID Number of a link found by Poppler, from the page number and the link's position on the page
+# (both counted from 1), e.g. 100007 for the seventh link on the first page. Used to report unmatched links and in manual_pairs.csv.
+def make_poppler_link_id(page_number, link_position):
+    return page_number * POPPLER_LINK_ID_BASE + link_position
+
+# Collect links and the page size from an index PDF with Poppler, converting the record to the shared schema
+def pull_links_with_poppler(relative_path):
+    import extract_using_poppler
+    poppler_index_record = extract_using_poppler.pull_links_from_index(relative_path)
+    links = []
+    # Poppler only reads the first page of an index PDF
+    for link_position, poppler_link in enumerate(poppler_index_record['Links'], 1):
+        coords = poppler_link['Link Coordinates']
+        links.append({
+            'PDF Object ID Number': make_poppler_link_id(1, link_position),
+            'Linked Image File Name': poppler_link['Photo File Name'],
+            'Link Coordinates': [coords['x1'], coords['y1'], coords['x2'], coords['y2']],
+            'File or URI?': 'File'
+        })
+    page_size = poppler_index_record['Page Size']
+    index_record = {
+        'Index File Name': poppler_index_record['Index File Name'],
+        'Source Relative Path': poppler_index_record['Source Relative Path'],
+        'Links': links,
+        'Media Box': [0, 0, page_size[0], page_size[1]]
+    }
+    return index_record
+
+# Extract the JPEG from an image PDF with Poppler, converting the record to the shared schema.
+# Poppler writes the JPEG itself, so its checksums and JPEG check results are collected by reading the new file.
+def extract_jpg_with_poppler(relative_path, output_location=''):
+    import extract_using_poppler
+    poppler_image_record = extract_using_poppler.extract_jpg_from_pdf(relative_path, output_location)
+    image_record = {}
+    for key in IMAGE_RECORD_KEYS:
+        image_record[key] = poppler_image_record.get(key)
+    if extract_using_pypdf.FIXITY_CHECKING and image_record['Created Image File Name'] is not None:
+        image_record['Fixity'], image_record['JPEG Check'] = fixity.check_jpeg_file(output_location + image_record['Created Image File Name'], image_record['Width'], image_record['Height'])
+    return image_record
+
+register_backend('scanner',
+    partial(extract_using_pypdf.pull_links_from_index, scanning=True),
+    partial(extract_using_pypdf.extract_jpg_from_pdf, scanning=True),
+    'PyPDF2 workflow reading PDFs with the lightweight pdf_scanner.py parser')
+register_backend('pypdf2',
+    partial(extract_using_pypdf.pull_links_from_index, scanning=False),
+    partial(extract_using_pypdf.extract_jpg_from_pdf, scanning=False),
+    'PyPDF2 workflow reading PDFs with PyPDF2 object parsing')
+register_backend('poppler', pull_links_with_poppler, extract_jpg_with_poppler,
+    'Poppler workflow using PyGObject and the pdfimages command',
+    required_modules=['gi'], required_commands=['pdfimages'])
@@ -0,0 +1,115 @@
+# DTE Aerial Photo Collection curation project
+# Manifest of previously extracted PDFs, used to skip unchanged files when re-running a batch
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# hashlib documentation: https://docs.python.org/3/library/hashlib.html
+
+# standard modules
+import os
+import json
+import hashlib
+
+# local modules
+import fixity
+import pipeline_metrics
+
+# global variables
+MANIFEST_SUFFIX = '_manifest.json'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+## Functions
+
+# Create the manifest file name from the batch metadata file name (e.g. macomb_1961_batch_metadata_manifest.json)
+def make_manifest_file_name(batch_metadata_file_name):
+    return batch_metadata_file_name.replace('.json', '') + MANIFEST_SUFFIX
+
+# Calculate the SHA-256 hash of a file's contents, reading it in chunks
+def calculate_file_hash(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file_object:
+        chunk = file_object.read(HASH_CHUNK_SIZE)
+        while chunk:
+            sha256.update(chunk)
+            chunk = file_object.read(HASH_CHUNK_SIZE)
+    return sha256.hexdigest()
+
+# Create a manifest entry (size, modification time, and content hash) for a source PDF
+def create_manifest_entry(file_path, file_hash=None):
+    file_stats = os.stat(file_path)
+    if file_hash is None:
+        file_hash = calculate_file_hash(file_path)
+    manifest_entry = {
+        'Size': file_stats.st_size,
+        'Modification Time': file_stats.st_mtime,
+        'SHA-256': file_hash
+    }
+    return manifest_entry
+
+# Load a manifest dictionary (keyed by source relative path) from a JSON file; returns an empty dictionary if there is none
+def load_manifest(manifest_path):
+    try:
+        manifest_file = open(manifest_path, 'r', encoding='utf-8')
+        manifest = json.loads(manifest_file.read())
+        manifest_file.close()
+    except (OSError, ValueError):
+        manifest = {}
+    return manifest
+
+# Write a manifest dictionary to a JSON file (with sort_keys False, the keys of entries keep their order)
+def write_manifest(manifest_path, manifest, sort_keys=True):
+    manifest_file = open(manifest_path, 'w', encoding='utf-8')
+    manifest_file.write(json.dumps(manifest, indent=4, sort_keys=sort_keys))
+    manifest_file.close()
+
+# Load the index and image records from a previous batch metadata file, keyed by source relative path
+def load_previous_records(batch_metadata_path):
+    try:
+        batch_metadata_file = open(batch_metadata_path, 'r', encoding='utf-8')
+        batch_metadata = json.loads(batch_metadata_file.read())
+        batch_metadata_file.close()
+    except (OSError, ValueError):
+        return {}
+    previous_records = {}
+    for record in batch_metadata['Index Records'] + batch_metadata['Image Records']:
+        previous_records[record['Source Relative Path']] = record
+    return previous_records
+
+# Check whether a file matches its manifest entry.
+# Size and modification time are checked first; the content hash is only calculated when the modification time has changed.
+# Returns: whether the file is unchanged (boolean) and an up-to-date manifest entry (dictionary)
+def check_file_unchanged(file_path, manifest_entry):
+    file_stats = os.stat(file_path)
+    if manifest_entry is None or file_stats.st_size != manifest_entry['Size']:
+        return False, create_manifest_entry(file_path)
+    if file_stats.st_mtime == manifest_entry['Modification Time']:
+        return True, manifest_entry
+    file_hash = calculate_file_hash(file_path)
+    new_manifest_entry = create_manifest_entry(file_path, file_hash)
+    return file_hash == manifest_entry['SHA-256'], new_manifest_entry
+
+# Split PDF paths into those that need to be (re)processed and those whose previous records can be reused.
+# An image PDF is only reused if the JPEG created from it still exists in the output location. When fixity_checking is True, reused
+# image records from before checksums were recorded get the checksums and JPEG check results of their JPEGs added.
+# Returns: list of paths to process, dictionary of reusable records keyed by path, and the updated manifest
+def find_changed_files(pdf_file_paths, manifest, previous_records, output_location, fixity_checking=False):
+    changed_file_paths = []
+    unchanged_records = {}
+    updated_manifest = {}
+    for pdf_file_path in pdf_file_paths:
+        unchanged, manifest_entry = check_file_unchanged(pdf_file_path, manifest.get(pdf_file_path))
+        updated_manifest[pdf_file_path] = manifest_entry
+        previous_record = previous_records.get(pdf_file_path)
+        if unchanged and previous_record is not None:
+            created_image_file_name = previous_record.get('Created Image File Name')
+            if created_image_file_name is None or os.path.exists(output_location + created_image_file_name):
+                if fixity_checking and created_image_file_name is not None and not previous_record.get('Fixity'):
+                    previous_record['Fixity'], previous_record['JPEG Check'] = fixity.check_jpeg_file(output_location + created_image_file_name,
+                        previous_record.get('Width'), previous_record.get('Height'))
+                    pipeline_metrics.increment_counter('Checksums Backfilled')
+                unchanged_records[pdf_file_path] = previous_record
+                continue
+        changed_file_paths.append(pdf_file_path)
+    return changed_file_paths, unchanged_records, updated_manifest
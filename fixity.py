@@ -0,0 +1,321 @@
+# DTE Aerial Photo Collection curation project
+# Fixity checksums and JPEG integrity checks for extracted images
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# hashlib documentation: https://docs.python.org/3/library/hashlib.html
+# mmap documentation: https://docs.python.org/3/library/mmap.html
+# JPEG specification (ITU T.81): https://www.w3.org/Graphics/JPEG/itu-t81.pdf
+# crc32c package documentation: https://pypi.org/project/crc32c/
+
+# Checksums of each extracted JPEG are calculated while its bytes are written, from the same memory-mapped view of the source PDF,
+# so the JPEG never has to be read again to record its fixity. The same view is given a quick structural check: the marker segments
+# before the image data are walked using their lengths (the compressed image data itself is never read), checking for the start of
+# image (SOI) marker, a start of frame (SOF) marker whose dimensions match the /Width and /Height of the PDF image object, and the
+# end of image (EOI) marker. The checksums and check results are added to the Preservation section of each image record.
+# Later, verify_output_tree re-reads every JPEG listed in the batch metadata files of an output directory with a pool of threads
+# (hashlib and file reads release the GIL, so the threads keep the disk busy) and compares them with the recorded checksums.
+
+# standard modules
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# local modules
+import pipeline_metrics
+
+# global variables
+# Checksums calculated for each JPEG: 'SHA-256', 'MD5', or 'CRC32C' (which requires the crc32c package)
+FIXITY_ALGORITHMS = ['SHA-256']
+# Number of bytes hashed and written at a time
+FIXITY_CHUNK_SIZE = 1024 * 1024
+# Number of threads used to verify JPEGs (None uses one per CPU)
+VERIFY_WORKERS = None
+BATCH_METADATA_SUFFIX = '_batch_metadata.json'
+FIXITY_REPORT_FILENAME = 'dte_aerial_fixity_report.json'
+JPEG_FRAME_MARKERS = [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF]
+# Markers with no length or segment data: TEM and the restart markers
+JPEG_STANDALONE_MARKERS = [0x01] + list(range(0xD0, 0xD8))
+# Bytes a PDF writer may leave after the end of image marker, inside the stream data
+JPEG_TRAILING_BYTES = b'\x00\r\n\t '
+
+## Functions
+
+# Create the hash objects for a list of algorithm names. CRC32C values are kept as integers and updated with the crc32c package,
+# which is only imported when it is requested.
+def create_hashers(algorithms=None):
+    if algorithms is None:
+        algorithms = FIXITY_ALGORITHMS
+    hashers = {}
+    for algorithm in algorithms:
+        if algorithm == 'SHA-256':
+            hashers[algorithm] = hashlib.sha256()
+        elif algorithm == 'MD5':
+            hashers[algorithm] = hashlib.md5()
+        elif algorithm == 'CRC32C':
+            import crc32c
+            hashers[algorithm] = 0
+        else:
+            raise ValueError('Unknown fixity algorithm: {}'.format(algorithm))
+    return hashers
+
+# Add a chunk of bytes to each hash
+def update_hashers(hashers, chunk):
+    for algorithm in hashers:
+        if algorithm == 'CRC32C':
+            import crc32c
+            hashers[algorithm] = crc32c.crc32c(chunk, hashers[algorithm])
+        else:
+            hashers[algorithm].update(chunk)
+
+# Finish the hashes. Returns: dictionary mapping algorithm names to hexadecimal checksums
+def finish_hashers(hashers):
+    checksums = {}
+    for algorithm, hasher in hashers.items():
+        if algorithm == 'CRC32C':
+            checksums[algorithm] = '{:08x}'.format(hasher)
+        else:
+            checksums[algorithm] = hasher.hexdigest()
+    return checksums
+
+# Calculate the checksums of a bytes-like object (e.g. a memoryview of a memory map), one chunk at a time.
+# If destination_file is given, each chunk is also written to it as soon as it is hashed, so the bytes are only read once.
+def hash_view(data_view, algorithms=None, destination_file=None):
+    hashers = create_hashers(algorithms)
+    for chunk_start in range(0, len(data_view), FIXITY_CHUNK_SIZE):
+        chunk = data_view[chunk_start:chunk_start + FIXITY_CHUNK_SIZE]
+        update_hashers(hashers, chunk)
+        if destination_file is not None:
+            destination_file.write(chunk)
+    return finish_hashers(hashers)
+
+# Walk the marker segments at the start of a JPEG (stopping at the first start of scan marker), and check its last marker.
+# Returns: dictionary with whether the SOI and EOI markers were found, the values from the SOF marker segment (None if there is none),
+# and a list of structural problems found
+def scan_jpeg_markers(jpeg_view):
+    marker_scan = {'SOI': False, 'SOF': None, 'EOI': False, 'Problems': []}
+    data_length = len(jpeg_view)
+    if bytes(jpeg_view[:2]) != b'\xff\xd8':
+        marker_scan['Problems'].append('Missing SOI marker')
+        return marker_scan
+    marker_scan['SOI'] = True
+    position = 2
+    while True:
+        if position + 2 > data_length or jpeg_view[position] != 0xFF:
+            marker_scan['Problems'].append('Invalid marker at byte {}'.format(str(position)))
+            break
+        marker = jpeg_view[position + 1]
+        # Markers may be preceded by any number of 0xFF fill bytes
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            position += 2
+            continue
+        if marker in [0xD8, 0xD9]:
+            marker_scan['Problems'].append('Unexpected {} marker before image data'.format('SOI' if marker == 0xD8 else 'EOI'))
+            break
+        if position + 4 > data_length:
+            marker_scan['Problems'].append('Truncated marker segment at byte {}'.format(str(position)))
+            break
+        segment_length = struct.unpack('>H', jpeg_view[position + 2:position + 4])[0]
+        if segment_length < 2 or position + 2 + segment_length > data_length:
+            marker_scan['Problems'].append('Truncated marker segment at byte {}'.format(str(position)))
+            break
+        if marker in JPEG_FRAME_MARKERS and segment_length >= 8:
+            precision, height, width, component_count = struct.unpack('>BHHB', jpeg_view[position + 4:position + 10])
+            marker_scan['SOF'] = {'Width': width, 'Height': height, 'Components': component_count, 'Precision': precision}
+        # The image data follows the start of scan marker segment
+        if marker == 0xDA:
+            break
+        position += 2 + segment_length
+    if marker_scan['SOF'] is None:
+        marker_scan['Problems'].append('Missing SOF marker')
+
+    # The EOI marker ends the data, apart from any padding bytes added by the PDF writer
+    end_position = data_length
+    while end_position > position and jpeg_view[end_position - 1] in JPEG_TRAILING_BYTES:
+        end_position -= 1
+    if bytes(jpeg_view[end_position - 2:end_position]) == b'\xff\xd9':
+        marker_scan['EOI'] = True
+    else:
+        marker_scan['Problems'].append('Missing EOI marker')
+    return marker_scan
+
+# Check the structure of a JPEG, comparing the dimensions in its SOF marker segment with those expected (e.g. from the PDF image object).
+# Returns: dictionary for the Preservation section of image records
+def check_jpeg_integrity(jpeg_view, expected_width=None, expected_height=None):
+    marker_scan = scan_jpeg_markers(jpeg_view)
+    frame = marker_scan['SOF']
+    problems = marker_scan['Problems']
+    if frame is not None and expected_width is not None and expected_height is not None:
+        if (frame['Width'], frame['Height']) != (int(expected_width), int(expected_height)):
+            problems.append('SOF dimensions {}x{} do not match PDF dimensions {}x{}'.format(frame['Width'], frame['Height'], expected_width, expected_height))
+    jpeg_check = {
+        'Status': 'Passed' if len(problems) == 0 else 'Failed',
+        'SOF Width': frame['Width'] if frame is not None else None,
+        'SOF Height': frame['Height'] if frame is not None else None,
+        'Problems': problems
+    }
+    if len(problems) > 0:
+        pipeline_metrics.increment_counter('JPEG Check Failures')
+    return jpeg_check
+
+# Write a JPEG held in memory (or in a memory map) to a new file, calculating its checksums and checking its structure along the way.
+# Returns: dictionary of checksums and dictionary of JPEG check results
+def write_jpeg_with_fixity(jpeg_data, destination_path, expected_width=None, expected_height=None, algorithms=None):
+    with memoryview(jpeg_data) as jpeg_view:
+        destination_file = open(destination_path, 'wb')
+        checksums = hash_view(jpeg_view, algorithms, destination_file)
+        destination_file.close()
+        jpeg_check = check_jpeg_integrity(jpeg_view, expected_width, expected_height)
+    return checksums, jpeg_check
+
+# Copy a range of bytes holding a JPEG from an open file to a new file through a memory map, calculating its checksums and checking
+# its structure from the same mapped pages. Returns: dictionary of checksums and dictionary of JPEG check results
+def copy_jpeg_with_fixity(source_file, offset, length, destination_path, expected_width=None, expected_height=None, algorithms=None):
+    source_map = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(source_map, 'madvise'):
+        source_map.madvise(mmap.MADV_SEQUENTIAL)
+    with memoryview(source_map) as source_view:
+        checksums, jpeg_check = write_jpeg_with_fixity(source_view[offset:offset + length], destination_path, expected_width, expected_height, algorithms)
+    source_map.close()
+    return checksums, jpeg_check
+
+# Calculate the checksums of a JPEG file and check its structure, reading it once through a memory map.
+# Returns: dictionary of checksums and dictionary of JPEG check results
+def check_jpeg_file(jpeg_file_path, expected_width=None, expected_height=None, algorithms=None):
+    jpeg_file = open(jpeg_file_path, 'rb')
+    if os.fstat(jpeg_file.fileno()).st_size == 0:
+        jpeg_file.close()
+        return hash_view(b'', algorithms), check_jpeg_integrity(b'', expected_width, expected_height)
+    jpeg_map = mmap.mmap(jpeg_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(jpeg_map, 'madvise'):
+        jpeg_map.madvise(mmap.MADV_SEQUENTIAL)
+    with memoryview(jpeg_map) as jpeg_view:
+        checksums = hash_view(jpeg_view, algorithms)
+        jpeg_check = check_jpeg_integrity(jpeg_view, expected_width, expected_height)
+    jpeg_map.close()
+    jpeg_file.close()
+    return checksums, jpeg_check
+
+# Verify one JPEG against the checksums recorded when it was extracted.
+# Returns: dictionary with the verification status ('Passed', 'Checksum Mismatch', 'JPEG Check Failed', or 'Missing') and details
+def verify_jpeg_file(jpeg_file_path, recorded_checksums, expected_width=None, expected_height=None):
+    verification = {'File Path': jpeg_file_path, 'Status': 'Passed', 'Size': 0}
+    if not os.path.isfile(jpeg_file_path):
+        verification['Status'] = 'Missing'
+        return verification
+    verification['Size'] = os.path.getsize(jpeg_file_path)
+    checksums, jpeg_check = check_jpeg_file(jpeg_file_path, expected_width, expected_height, list(recorded_checksums))
+    mismatched_algorithms = [algorithm for algorithm in recorded_checksums if checksums[algorithm] != recorded_checksums[algorithm]]
+    if len(mismatched_algorithms) > 0:
+        verification['Status'] = 'Checksum Mismatch'
+        verification['Mismatched Algorithms'] = mismatched_algorithms
+    elif jpeg_check['Status'] != 'Passed':
+        verification['Status'] = 'JPEG Check Failed'
+        verification['Problems'] = jpeg_check['Problems']
+    return verification
+
+# Find the batch metadata files in an output directory tree (e.g. output/pypdf2/macomb_1961_batch_metadata.json)
+def find_batch_metadata_files(output_directory_path):
+    batch_metadata_file_paths = []
+    for directory_path, directory_names, file_names in os.walk(output_directory_path):
+        for file_name in file_names:
+            if file_name.endswith(BATCH_METADATA_SUFFIX):
+                batch_metadata_file_paths.append(os.path.join(directory_path, file_name))
+    return sorted(batch_metadata_file_paths)
+
+# Collect the JPEGs to verify from the image records of a batch metadata file: each JPEG's path, recorded checksums, and PDF dimensions.
+# Image records extracted before checksums were recorded are skipped.
+def collect_jpegs_to_verify(batch_metadata_file_path):
+    batch_metadata_file = open(batch_metadata_file_path, 'r', encoding='utf-8')
+    batch_metadata = json.loads(batch_metadata_file.read())
+    batch_metadata_file.close()
+    image_location = os.path.dirname(batch_metadata_file_path)
+    jpegs_to_verify = []
+    unchecksummed_file_paths = []
+    for image_record in batch_metadata['Image Records']:
+        if image_record.get('Created Image File Name') is None:
+            continue
+        jpeg_file_path = os.path.join(image_location, image_record['Created Image File Name'])
+        if image_record.get('Fixity'):
+            jpegs_to_verify.append((jpeg_file_path, image_record['Fixity'], image_record['Width'], image_record['Height']))
+        else:
+            unchecksummed_file_paths.append(jpeg_file_path)
+    return jpegs_to_verify, unchecksummed_file_paths
+
+# Re-check every JPEG listed in the batch metadata files of an output directory tree, using a pool of threads, and write a report
+# of the results to FIXITY_REPORT_FILENAME in the output directory. Returns: the report as a dictionary
+def verify_output_tree(output_directory_path, workers=VERIFY_WORKERS):
+    print('\n** Fixity Verification **')
+    verify_start = time.time()
+    if workers is None:
+        workers = os.cpu_count()
+    jpegs_to_verify = []
+    unchecksummed_file_paths = []
+    for batch_metadata_file_path in find_batch_metadata_files(output_directory_path):
+        batch_jpegs_to_verify, batch_unchecksummed_file_paths = collect_jpegs_to_verify(batch_metadata_file_path)
+        jpegs_to_verify += batch_jpegs_to_verify
+        unchecksummed_file_paths += batch_unchecksummed_file_paths
+    print('** Verifying {} JPEGs with {} threads **'.format(str(len(jpegs_to_verify)), str(workers)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        verifications = list(executor.map(lambda jpeg_to_verify: verify_jpeg_file(*jpeg_to_verify), jpegs_to_verify))
+    # JPEGs whose records have no checksums (e.g. records from before checksums were recorded) cannot be verified, and count as failures
+    for jpeg_file_path in unchecksummed_file_paths:
+        verifications.append({'File Path': jpeg_file_path, 'Status': 'No Checksum', 'Size': 0})
+
+    elapsed = time.time() - verify_start
+    status_counts = {}
+    for verification in verifications:
+        status_counts[verification['Status']] = status_counts.get(verification['Status'], 0) + 1
+    total_bytes = sum(verification['Size'] for verification in verifications)
+    fixity_report = {
+        'Number of JPEGs Verified': len(jpegs_to_verify),
+        'Status Counts': status_counts,
+        'Megabytes Read': total_bytes / (1024 * 1024),
+        'Megabytes per Second': total_bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0.0,
+        'Time to Run': elapsed,
+        'Failures': [verification for verification in verifications if verification['Status'] != 'Passed']
+    }
+    # Verification only passes if at least one JPEG was checked and none failed
+    fixity_report['Passed'] = len(jpegs_to_verify) > 0 and len(fixity_report['Failures']) == 0
+    fixity_report_file = open(os.path.join(output_directory_path, FIXITY_REPORT_FILENAME), 'w', encoding='utf-8')
+    fixity_report_file.write(json.dumps(fixity_report, indent=4))
+    fixity_report_file.close()
+
+    for verification in fixity_report['Failures']:
+        print('-- {}: {} --'.format(verification['Status'], verification['File Path']))
+    if len(jpegs_to_verify) == 0:
+        print('?? No JPEGs with recorded checksums were found to verify ??')
+    elif fixity_report['Passed']:
+        print('++ All JPEGs passed verification ++')
+    print('** Read {:.1f} MB at {:.1f} MB/s **'.format(fixity_report['Megabytes Read'], fixity_report['Megabytes per Second']))
+    return fixity_report
+
+## Main Program
+
+if __name__=="__main__":
+    # Setting output directory to verify
+    try:
+        output_directory_path = sys.argv[1]
+    except:
+        output_directory_path = 'output/'
+
+    # Setting number of threads
+    try:
+        verify_workers = int(sys.argv[2])
+    except:
+        verify_workers = VERIFY_WORKERS
+
+    fixity_report = verify_output_tree(output_directory_path, verify_workers)
+    if not fixity_report['Passed']:
+        sys.exit(1)
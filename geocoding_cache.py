@@ -0,0 +1,199 @@
+# DTE Aerial Photo Collection curation project
+# SQLite-backed cache for ArcGIS geocoding and reverse geocoding results
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# sqlite3 documentation: https://docs.python.org/3/library/sqlite3.html
+
+# This module replaces the arcgis_geocoding_cache.json file, which was rewritten in full after every new API call.
+# Entries are stored as rows keyed by the cache key, so each lookup reads one row and each new result is an upsert.
+# The file is not opened until the first lookup, and entries are never all loaded into memory at once.
+# New entries are held in memory and written in batches; SQLite's write-ahead log and busy timeout make the file safe
+# to share between the processes used by process_collection.py.
+# Reverse geocoded points are also stored with their counties in a second table, indexed by grid cell, so the county of a new point
+# can be taken from the nearest cached point within a tolerance (see find_nearest_cached_point) instead of making another request.
+
+# standard modules
+import os
+import json
+import math
+import atexit
+import sqlite3
+
+# global variables
+SQLITE_CACHE_FILE_NAME = 'arcgis_geocoding_cache.sqlite'
+JSON_CACHE_FILE_NAME = 'arcgis_geocoding_cache.json'
+# Number of new entries held in memory before they are written to the cache file
+FLUSH_BATCH_SIZE = 50
+# Seconds to wait for another process to release its lock on the cache file
+BUSY_TIMEOUT = 30
+# Width and height of the grid cells indexing reverse geocoded points, in degrees
+POINT_GRID_CELL_SIZE = 0.001
+METERS_PER_DEGREE = 111320.0
+
+CACHE_FILE_PATH = SQLITE_CACHE_FILE_NAME
+CACHE_CONNECTION = None
+CACHE_PROCESS_ID = None
+PENDING_ENTRIES = {}
+PENDING_POINTS = {}
+
+## Functions
+
+# Copy entries from the old JSON cache file into the SQLite cache. Existing rows are left as they are.
+def migrate_json_cache(connection, json_cache_file_path=JSON_CACHE_FILE_NAME):
+    try:
+        json_cache_file = open(json_cache_file_path, 'r', encoding='utf-8')
+        json_cache = json.loads(json_cache_file.read())
+        json_cache_file.close()
+    except (OSError, ValueError):
+        return 0
+    rows = []
+    for cache_key, data in json_cache.items():
+        rows.append((cache_key, json.dumps(data)))
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO geocoding_cache (cache_key, data) VALUES (?, ?)', rows)
+    print('** Migrated {} entries from {} **'.format(str(len(rows)), json_cache_file_path))
+    return len(rows)
+
+# Parse a reverse geocoding cache key (e.g. '-83.04567, 42.33143') into a longitude latitude pair; returns None for other keys
+def parse_point_key(cache_key):
+    try:
+        longitude, latitude = [float(value) for value in cache_key.split(',')]
+    except ValueError:
+        return None
+    return longitude, latitude
+
+# Find the grid cell of a point, as (column, row)
+def find_point_cell(longitude, latitude):
+    return math.floor(longitude / POINT_GRID_CELL_SIZE), math.floor(latitude / POINT_GRID_CELL_SIZE)
+
+# Create a row for the reverse_geocoding_points table
+def make_point_row(cache_key, longitude, latitude, county):
+    cell_x, cell_y = find_point_cell(longitude, latitude)
+    return (cache_key, cell_x, cell_y, longitude, latitude, county)
+
+# Add the reverse geocoding results already in the cache (including those cached before points were indexed) to the
+# reverse_geocoding_points table. Rows are read one at a time, so the cache is never all loaded into memory.
+def index_cached_points(connection):
+    rows = []
+    for cache_key, data in connection.execute('SELECT cache_key, data FROM geocoding_cache'):
+        point = parse_point_key(cache_key)
+        if point is None:
+            continue
+        try:
+            county = json.loads(data)['address']['Subregion']
+        except (KeyError, TypeError, ValueError):
+            continue
+        rows.append(make_point_row(cache_key, point[0], point[1], county))
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO reverse_geocoding_points VALUES (?, ?, ?, ?, ?, ?)', rows)
+    if len(rows) > 0:
+        print('** Indexed {} cached reverse geocoding results **'.format(str(len(rows))))
+    return len(rows)
+
+# Open (and, if needed, create and migrate) the SQLite cache file
+def open_cache(cache_file_path=SQLITE_CACHE_FILE_NAME, json_cache_file_path=JSON_CACHE_FILE_NAME):
+    global CACHE_FILE_PATH, CACHE_CONNECTION, CACHE_PROCESS_ID
+    new_cache_file = not os.path.exists(cache_file_path)
+    connection = sqlite3.connect(cache_file_path, timeout=BUSY_TIMEOUT)
+    connection.execute('PRAGMA journal_mode=WAL')
+    points_table_row = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'reverse_geocoding_points'").fetchone()
+    with connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS geocoding_cache (cache_key TEXT PRIMARY KEY, data TEXT NOT NULL)')
+        connection.execute('''CREATE TABLE IF NOT EXISTS reverse_geocoding_points (cache_key TEXT PRIMARY KEY, cell_x INTEGER NOT NULL,
+            cell_y INTEGER NOT NULL, longitude REAL NOT NULL, latitude REAL NOT NULL, county TEXT NOT NULL)''')
+        connection.execute('CREATE INDEX IF NOT EXISTS reverse_geocoding_point_cells ON reverse_geocoding_points (cell_x, cell_y)')
+    if new_cache_file:
+        migrate_json_cache(connection, json_cache_file_path)
+    if points_table_row is None:
+        index_cached_points(connection)
+    CACHE_FILE_PATH = cache_file_path
+    CACHE_CONNECTION = connection
+    CACHE_PROCESS_ID = os.getpid()
+    return connection
+
+# Set the cache file to use without opening it; the file is opened on the first lookup
+def configure_cache(cache_file_path=SQLITE_CACHE_FILE_NAME):
+    global CACHE_FILE_PATH, CACHE_CONNECTION
+    if CACHE_FILE_PATH != cache_file_path:
+        flush_cache()
+        CACHE_CONNECTION = None
+    CACHE_FILE_PATH = cache_file_path
+
+# Return the cache connection for the current process, opening the cache file on first use.
+# A connection inherited from a parent process (e.g. by a forked pool worker) is not reused; a new one is opened instead.
+def get_connection():
+    global PENDING_ENTRIES, PENDING_POINTS
+    if CACHE_CONNECTION is None or CACHE_PROCESS_ID != os.getpid():
+        if CACHE_PROCESS_ID != os.getpid():
+            PENDING_ENTRIES = {}
+            PENDING_POINTS = {}
+        open_cache(CACHE_FILE_PATH)
+    return CACHE_CONNECTION
+
+# Look up a cache entry by key; returns None if the key is not cached
+def get_cached_data(cache_key):
+    if cache_key in PENDING_ENTRIES and CACHE_PROCESS_ID == os.getpid():
+        return PENDING_ENTRIES[cache_key]
+    row = get_connection().execute('SELECT data FROM geocoding_cache WHERE cache_key = ?', (cache_key,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+# Add an entry to the cache. Entries are written to the cache file once FLUSH_BATCH_SIZE entries are pending.
+def set_cached_data(cache_key, data):
+    get_connection()
+    PENDING_ENTRIES[cache_key] = data
+    if len(PENDING_ENTRIES) >= FLUSH_BATCH_SIZE:
+        flush_cache()
+
+# Add a reverse geocoded point and its county to the point index. Points are written along with the pending entries.
+def set_cached_point(cache_key, longitude, latitude, county):
+    get_connection()
+    PENDING_POINTS[cache_key] = make_point_row(cache_key, longitude, latitude, county)
+
+# Find the distance in meters between two nearby points, treating degrees of longitude as shorter away from the equator
+def find_distance_in_meters(longitude_one, latitude_one, longitude_two, latitude_two):
+    x_distance = (longitude_one - longitude_two) * METERS_PER_DEGREE * math.cos(math.radians((latitude_one + latitude_two) / 2))
+    y_distance = (latitude_one - latitude_two) * METERS_PER_DEGREE
+    return math.hypot(x_distance, y_distance)
+
+# Find the nearest reverse geocoded point within tolerance_meters of a point, searching only the grid cells the tolerance reaches.
+# Returns: the county of the nearest point and its distance in meters, or None if no cached point is close enough
+def find_nearest_cached_point(longitude, latitude, tolerance_meters):
+    latitude_tolerance = tolerance_meters / METERS_PER_DEGREE
+    longitude_tolerance = latitude_tolerance / max(math.cos(math.radians(latitude)), 0.01)
+    min_cell_x, min_cell_y = find_point_cell(longitude - longitude_tolerance, latitude - latitude_tolerance)
+    max_cell_x, max_cell_y = find_point_cell(longitude + longitude_tolerance, latitude + latitude_tolerance)
+    candidates = get_connection().execute(
+        'SELECT longitude, latitude, county FROM reverse_geocoding_points WHERE cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?',
+        (min_cell_x, max_cell_x, min_cell_y, max_cell_y)
+    ).fetchall()
+    for point_row in PENDING_POINTS.values():
+        if min_cell_x <= point_row[1] <= max_cell_x and min_cell_y <= point_row[2] <= max_cell_y:
+            candidates.append(point_row[3:])
+    nearest = None
+    for candidate_longitude, candidate_latitude, county in candidates:
+        distance = find_distance_in_meters(longitude, latitude, candidate_longitude, candidate_latitude)
+        if distance <= tolerance_meters and (nearest is None or distance < nearest[1]):
+            nearest = (county, distance)
+    return nearest
+
+# Write all pending entries and points to the cache file in one transaction
+def flush_cache():
+    if (len(PENDING_ENTRIES) == 0 and len(PENDING_POINTS) == 0) or CACHE_PROCESS_ID != os.getpid():
+        return 0
+    rows = []
+    for cache_key, data in PENDING_ENTRIES.items():
+        rows.append((cache_key, json.dumps(data)))
+    with get_connection() as connection:
+        connection.executemany('INSERT OR REPLACE INTO geocoding_cache (cache_key, data) VALUES (?, ?)', rows)
+        connection.executemany('INSERT OR REPLACE INTO reverse_geocoding_points VALUES (?, ?, ?, ?, ?, ?)', list(PENDING_POINTS.values()))
+    PENDING_ENTRIES.clear()
+    PENDING_POINTS.clear()
+    return len(rows)
+
+# Make sure pending entries are written when the program exits normally
+atexit.register(flush_cache)
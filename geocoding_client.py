@@ -0,0 +1,173 @@
+# DTE Aerial Photo Collection curation project
+# Concurrent, rate-limited client for geocoding requests
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# concurrent.futures documentation: https://docs.python.org/3/library/concurrent.futures.html
+# Requests documentation: https://requests.readthedocs.io/en/master/
+# ArcGIS World Geocoding Service documentation: https://developers.arcgis.com/rest/geocode/api-reference/overview-world-geocoding-service.htm
+
+# Geocoding requests that miss the cache are sent concurrently by a pool of threads, rather than one at a time, so the time spent
+# waiting on round trips to the service overlaps. Requests are deduplicated by their cache keys before they are sent, are spaced out
+# to stay under MAX_REQUESTS_PER_SECOND (a limit for each process; process_collection.py divides it among its batch workers with
+# share_rate_limit), and are retried with exponential backoff (and random jitter) when they fail.
+# By default, requests are made with the geocode and reverse_geocode functions of the ArcGIS API for Python. When SERVICE_URL is set,
+# they are instead sent straight to a geocoding service with the ArcGIS REST API (e.g. the ArcGIS World Geocoding Service, or the stub
+# server in geocoding_stub_server.py) over one Requests session shared by all threads, so connections are reused.
+
+# standard modules
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# local modules
+import pipeline_metrics
+
+# global variables
+# These settings are read each time requests are sent, so they can be changed after this module is imported
+# Number of requests sent at the same time
+MAX_CONCURRENT_REQUESTS = 8
+# Requests per second sent by this process, or None for no limit (e.g. for offline stand-ins)
+MAX_REQUESTS_PER_SECOND = 20.0
+# Number of times a failed request is retried, and the seconds waited before the first retry (doubled for each later retry)
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 0.5
+# URL of an ArcGIS REST geocoding service (e.g. 'https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer'),
+# or None to use the ArcGIS API for Python
+SERVICE_URL = None
+REQUEST_TIMEOUT = 30
+# HTTP status codes of responses that are retried; other error responses fail immediately
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+RATE_LIMIT_LOCK = threading.Lock()
+NEXT_REQUEST_TIME = 0.0
+SESSION = None
+SESSION_PROCESS_ID = None
+
+## Functions
+
+# Wait until another request can be sent without exceeding MAX_REQUESTS_PER_SECOND. Requests are given evenly spaced send times,
+# so waiting threads do not all send at once when the limit is reached.
+def wait_for_rate_limit():
+    global NEXT_REQUEST_TIME
+    if MAX_REQUESTS_PER_SECOND is None:
+        return
+    with RATE_LIMIT_LOCK:
+        now = time.monotonic()
+        send_time = max(now, NEXT_REQUEST_TIME)
+        NEXT_REQUEST_TIME = send_time + 1.0 / MAX_REQUESTS_PER_SECOND
+    if send_time > now:
+        time.sleep(send_time - now)
+
+# Divide MAX_REQUESTS_PER_SECOND among process_count processes sending requests at the same time, so together they stay under
+# the limit. Run once in each worker process (e.g. as the initializer of a process pool).
+def share_rate_limit(process_count):
+    global MAX_REQUESTS_PER_SECOND
+    if MAX_REQUESTS_PER_SECOND is not None and process_count > 1:
+        MAX_REQUESTS_PER_SECOND = MAX_REQUESTS_PER_SECOND / process_count
+
+# Find the seconds to wait before retrying a request (retry_number is 0 for the first retry), with random jitter
+# so requests that failed together are not retried together
+def find_backoff_seconds(retry_number):
+    return BACKOFF_SECONDS * (2 ** retry_number) * (0.5 + random.random())
+
+# Check whether a failed request should be retried: errors with HTTP responses are only retried for the status codes in
+# RETRY_STATUS_CODES, and other errors only if they are connection errors or timeouts (so programming errors fail immediately)
+def check_retryable(error):
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'status_code', None) is not None:
+        return response.status_code in RETRY_STATUS_CODES
+    retryable_error_types = (ConnectionError, TimeoutError)
+    try:
+        import requests
+        retryable_error_types += (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    except ImportError:
+        pass
+    return isinstance(error, retryable_error_types)
+
+# Send one request with request_function (e.g. geocode), respecting the rate limit and retrying failed requests with backoff.
+# Raises the last error if the request still fails after MAX_RETRIES retries.
+def send_with_retries(request_function, request_input):
+    for retry_number in range(MAX_RETRIES + 1):
+        wait_for_rate_limit()
+        try:
+            with pipeline_metrics.time_block('Geocoding API Calls', 'Geocoding API Latency'):
+                return request_function(request_input)
+        except Exception as error:
+            if not check_retryable(error) or retry_number == MAX_RETRIES:
+                pipeline_metrics.increment_counter('Geocoding Request Failures')
+                raise
+            pipeline_metrics.increment_counter('Geocoding Request Retries')
+            delay = find_backoff_seconds(retry_number)
+            print('?? Geocoding request failed ({}); retrying in {:.1f} seconds ??'.format(error, delay))
+            time.sleep(delay)
+
+# Send requests concurrently, one for each distinct cache key. Arguments: dictionary mapping cache keys to request inputs, the function
+# making a request, and an optional function called with each cache key and result as soon as the result arrives (e.g. to cache it),
+# in the calling thread. If any request fails, the results that did arrive are still passed to result_function before the first
+# error is raised. Returns: dictionary mapping cache keys to results
+def fetch_concurrently(request_inputs, request_function, result_function=None):
+    results = {}
+    if len(request_inputs) == 1 or MAX_CONCURRENT_REQUESTS == 1:
+        for cache_key, request_input in request_inputs.items():
+            results[cache_key] = send_with_retries(request_function, request_input)
+            if result_function is not None:
+                result_function(cache_key, results[cache_key])
+        return results
+    first_error = None
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(request_inputs))) as executor:
+        futures = {}
+        for cache_key, request_input in request_inputs.items():
+            futures[executor.submit(send_with_retries, request_function, request_input)] = cache_key
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:
+                if first_error is None:
+                    first_error = error
+                continue
+            if result_function is not None:
+                result_function(futures[future], results[futures[future]])
+    if first_error is not None:
+        raise first_error
+    # Returning the results in the order of the inputs
+    return dict((cache_key, results[cache_key]) for cache_key in request_inputs)
+
+# Return the Requests session shared by all threads in this process, creating it (with a connection pool large enough
+# for MAX_CONCURRENT_REQUESTS) the first time it is needed
+def get_session():
+    global SESSION, SESSION_PROCESS_ID
+    if SESSION is None or SESSION_PROCESS_ID != os.getpid():
+        import requests
+        SESSION = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+        SESSION.mount('http://', adapter)
+        SESSION.mount('https://', adapter)
+        SESSION_PROCESS_ID = os.getpid()
+    return SESSION
+
+# Send a GET request to an operation of the geocoding service at SERVICE_URL, raising an error for error responses.
+# Returns: the JSON response as a dictionary
+def request_service_data(operation, parameters):
+    response = get_session().get(SERVICE_URL.rstrip('/') + '/' + operation, params=parameters, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    # The ArcGIS REST API reports some errors in the body of a response with status 200
+    if 'error' in data:
+        raise ValueError('Geocoding service error: {}'.format(data['error']))
+    return data
+
+# Geocode a single-line address with the geocoding service at SERVICE_URL.
+# Returns: list of candidate dictionaries, like the geocode function of the ArcGIS API for Python
+def geocode_with_service(address):
+    data = request_service_data('findAddressCandidates', {'SingleLine': address, 'outFields': '*', 'f': 'json'})
+    return data['candidates']
+
+# Reverse geocode a longitude latitude pair with the geocoding service at SERVICE_URL.
+# Returns: dictionary with 'address' and 'location' keys, like the reverse_geocode function of the ArcGIS API for Python
+def reverse_geocode_with_service(coordinate_pair):
+    return request_service_data('reverseGeocode', {'location': '{},{}'.format(coordinate_pair[0], coordinate_pair[1]), 'f': 'json'})
@@ -0,0 +1,143 @@
+# DTE Aerial Photo Collection curation project
+# Local stub server standing in for the ArcGIS geocoding service
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# http.server documentation: https://docs.python.org/3/library/http.server.html
+# ArcGIS REST API documentation: https://developers.arcgis.com/rest/geocode/api-reference/geocoding-find-address-candidates.htm
+
+# The server answers the findAddressCandidates and reverseGeocode operations of the ArcGIS REST API with responses in the same
+# format, so geocoding_client.py can be tested and benchmarked without a network connection or ArcGIS account (by setting
+# geocoding_client.SERVICE_URL to the server's URL). Synthetic addresses from synthetic_corpus.py are geocoded to their own
+# coordinates, and other addresses to made-up coordinates in Detroit based on a checksum of the address. Every point is reverse
+# geocoded to STUB_COUNTY. The server can add latency to each response, fail a share of requests, and refuse requests above a
+# rate limit, to test concurrency, retries, and backoff.
+
+# standard modules
+import sys
+import json
+import time
+import zlib
+import random
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local modules
+import synthetic_corpus
+
+# global variables
+STUB_PORT = 8123
+STUB_COUNTY = 'Wayne County'
+# Seconds waited before answering each request
+STUB_LATENCY = 0.05
+# Share of requests answered with a 503 (Service Unavailable) error
+STUB_FAILURE_RATE = 0.0
+# Requests per second above which requests are answered with a 429 (Too Many Requests) error, or None for no limit
+STUB_RATE_LIMIT = None
+
+STUB_STATISTICS = {'Requests': 0, 'Failures': 0, 'Rate Limited': 0}
+STUB_LOCK = threading.Lock()
+REQUEST_TIMES = []
+
+## Functions
+
+# Find coordinates for an address: synthetic addresses have their own coordinates, and other addresses get made-up ones
+def find_stub_geocoordinates(address):
+    geocoordinates = synthetic_corpus.geocode_synthetic_address(address)
+    if geocoordinates is None:
+        checksum = zlib.crc32(address.encode('utf-8'))
+        geocoordinates = (-83.25 + (checksum % 1000) / 5000, 42.3 + (checksum // 1000 % 1000) / 5000)
+    return geocoordinates
+
+# Create the response to a findAddressCandidates request
+def create_geocode_response(parameters):
+    address = parameters.get('SingleLine', [''])[0]
+    longitude, latitude = find_stub_geocoordinates(address)
+    candidate = {'address': address, 'location': {'x': longitude, 'y': latitude}, 'score': 100, 'attributes': {}}
+    return {'spatialReference': {'wkid': 4326}, 'candidates': [candidate]}
+
+# Create the response to a reverseGeocode request
+def create_reverse_geocode_response(parameters):
+    longitude, latitude = [float(value) for value in parameters.get('location', ['0,0'])[0].split(',')]
+    return {'address': {'Subregion': STUB_COUNTY, 'Region': 'Michigan', 'CountryCode': 'USA'}, 'location': {'x': longitude, 'y': latitude, 'spatialReference': {'wkid': 4326}}}
+
+# Check whether a request arriving now would go over STUB_RATE_LIMIT, counting the requests received in the last second
+def check_rate_limited():
+    if STUB_RATE_LIMIT is None:
+        return False
+    with STUB_LOCK:
+        now = time.monotonic()
+        while REQUEST_TIMES and REQUEST_TIMES[0] < now - 1.0:
+            REQUEST_TIMES.pop(0)
+        if len(REQUEST_TIMES) >= STUB_RATE_LIMIT:
+            return True
+        REQUEST_TIMES.append(now)
+        return False
+
+# Count a request in STUB_STATISTICS
+def count_request(statistic_name):
+    with STUB_LOCK:
+        STUB_STATISTICS[statistic_name] += 1
+
+# Request handler answering geocoding operations (http.server handles requests with a handler class)
+class StubGeocodingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        count_request('Requests')
+        parsed_url = urlparse(self.path)
+        operation = parsed_url.path.rstrip('/').split('/')[-1]
+        parameters = parse_qs(parsed_url.query)
+        time.sleep(STUB_LATENCY)
+        if check_rate_limited():
+            count_request('Rate Limited')
+            self.send_json(429, {'error': {'code': 429, 'message': 'Too many requests'}})
+        elif random.random() < STUB_FAILURE_RATE:
+            count_request('Failures')
+            self.send_json(503, {'error': {'code': 503, 'message': 'Service unavailable'}})
+        elif operation == 'findAddressCandidates':
+            self.send_json(200, create_geocode_response(parameters))
+        elif operation == 'reverseGeocode':
+            self.send_json(200, create_reverse_geocode_response(parameters))
+        else:
+            self.send_json(404, {'error': {'code': 404, 'message': 'Unknown operation: {}'.format(operation)}})
+
+    def send_json(self, status_code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are not logged, since there can be thousands of them
+    def log_message(self, format, *args):
+        pass
+
+# Start the stub server in a background thread (port 0 picks a free port).
+# Returns: the server (stop it with its shutdown method) and its URL, for geocoding_client.SERVICE_URL
+def start_stub_server(port=0):
+    stub_server = ThreadingHTTPServer(('127.0.0.1', port), StubGeocodingHandler)
+    stub_server.daemon_threads = True
+    server_thread = threading.Thread(target=stub_server.serve_forever, daemon=True)
+    server_thread.start()
+    stub_url = 'http://127.0.0.1:{}/arcgis/rest/services/World/GeocodeServer'.format(stub_server.server_address[1])
+    return stub_server, stub_url
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Geocoding Stub Server **")
+    try:
+        port = int(sys.argv[1])
+    except:
+        port = STUB_PORT
+    stub_server = ThreadingHTTPServer(('127.0.0.1', port), StubGeocodingHandler)
+    print('** Serving at http://127.0.0.1:{}/arcgis/rest/services/World/GeocodeServer **'.format(str(port)))
+    try:
+        stub_server.serve_forever()
+    except KeyboardInterrupt:
+        print('** Requests: {} **'.format(STUB_STATISTICS))
@@ -8,60 +8,125 @@
 # ArcGIS documentation: https://esri.github.io/arcgis-python-api/apidoc/html/
 
 # standard modules
+import os
 import json
 import csv
 import sys
 
 # third-party modules
-from arcgis import GIS
-from arcgis.geocoding import geocode, reverse_geocode
+import numpy as np
+# The ArcGIS API for Python is imported when the first uncached geocoding request is made (see connect_to_arcgis), since importing it is slow
+# and many runs (e.g. process_batch.py in 'load' mode) never need it.
 
 # local modules
 import misc_functions
-
-ARCGIS_CACHE_FILE_NAME = 'arcgis_geocoding_cache.json'
+import geocoding_cache
+import geocoding_client
+import county_lookup
+import georeferencing_transforms
+import json_streaming
+import pipeline_metrics
+
+ARCGIS_CACHE_FILE_NAME = 'arcgis_geocoding_cache.sqlite'
 ADDRESS_PAIRS_FILE_PATH = 'input/address_pairs.csv'
-global HIT_API_YET
-HIT_API_YET = False
+CONTROL_POINTS_FILE_PATH = 'input/control_points.csv'
+# Type of transform fitted to an index's control points: 'linear', 'affine', or 'projective' (see georeferencing_transforms.py)
+TRANSFORM_TYPE = 'affine'
+ARCGIS_CONNECTION = None
+# Engine used to find the county of each point: 'arcgis' reverse geocodes each point, 'local' uses the county boundary polygons
+# in county_lookup.COUNTY_BOUNDARIES_FILE_PATH, and 'auto' uses 'local' whenever that file exists.
+COUNTY_LOOKUP_ENGINE = 'auto'
+# Number of decimal places longitudes and latitudes are rounded to in reverse geocoding cache keys (5 places is about 1 meter),
+# or None to use full precision
+REVERSE_GEOCODING_KEY_PRECISION = 5
+# Distance in meters within which the county of the nearest reverse geocoded point in the cache is reused, or 0 to always
+# reverse geocode points that are not cached exactly
+NEAREST_COUNTY_TOLERANCE_METERS = 50
+# Georeference all four corners of each link box, adding a footprint polygon (roughly the area the photo covers) to each link record
+FOOTPRINTS = False
 
 ## Caching
 
-# Setting up geocoding caching dictionary.
-try:
-    file_open = open(ARCGIS_CACHE_FILE_NAME, "r")
-    json_string = file_open.read()
-    CACHE_DICTION = json.loads(json_string)
-    file_open.close()
-except:
-    CACHE_DICTION = {}
+# Setting up geocoding cache; the cache file is opened on the first lookup rather than when this module is imported
+# (entries from the older arcgis_geocoding_cache.json file are migrated when the cache file is first created)
+geocoding_cache.configure_cache(ARCGIS_CACHE_FILE_NAME)
+
+# Import the ArcGIS API for Python and connect anonymously to ArcGIS Online, the first time it is needed.
+# Returns: the geocode and reverse_geocode functions
+def connect_to_arcgis():
+    global ARCGIS_CONNECTION
+    from arcgis import GIS
+    from arcgis.geocoding import geocode, reverse_geocode
+    if ARCGIS_CONNECTION is None:
+        ARCGIS_CONNECTION = GIS()
+    return geocode, reverse_geocode
+
+# Find the geocode and reverse_geocode functions to use: those sending requests to geocoding_client.SERVICE_URL if it is set,
+# and those of the ArcGIS API for Python otherwise
+def find_geocoding_functions():
+    if geocoding_client.SERVICE_URL is not None:
+        return geocoding_client.geocode_with_service, geocoding_client.reverse_geocode_with_service
+    return connect_to_arcgis()
+
+# Round a longitude latitude pair to REVERSE_GEOCODING_KEY_PRECISION decimal places, so nearby points share a cache key
+def quantize_coordinate_pair(coordinate_pair):
+    if REVERSE_GEOCODING_KEY_PRECISION is None:
+        return coordinate_pair[0], coordinate_pair[1]
+    return round(coordinate_pair[0], REVERSE_GEOCODING_KEY_PRECISION), round(coordinate_pair[1], REVERSE_GEOCODING_KEY_PRECISION)
+
+# Create the cache key for geocoding input data (an address, or a quantized longitude latitude pair converted into a string)
+def make_geocoding_cache_key(input_data, reverse=False):
+    if reverse == True:
+        longitude, latitude = quantize_coordinate_pair(input_data)
+        return str(longitude) + ', ' + str(latitude)
+    return input_data
+
+# Geocode or reverse geocode a list of inputs at once, returning the results in the same order.
+# Cached results are used where possible; the remaining inputs are deduplicated and fetched concurrently by geocoding_client.py.
+def fetch_geocoding_data_for_batch(input_data_list, reverse=False):
+    cache_keys = [make_geocoding_cache_key(input_data, reverse) for input_data in input_data_list]
+    results = {}
+    uncached_inputs = {}
+    for cache_key, input_data in zip(cache_keys, input_data_list):
+        if cache_key in results or cache_key in uncached_inputs:
+            pipeline_metrics.increment_counter('Duplicate Geocoding Requests')
+            continue
+        cached_data = geocoding_cache.get_cached_data(cache_key)
+        if cached_data is not None:
+            pipeline_metrics.increment_counter('Geocoding Cache Hits')
+            results[cache_key] = cached_data
+        else:
+            pipeline_metrics.increment_counter('Geocoding Cache Misses')
+            # geocode() takes an address string, and reverse_geocode() takes a list (of the quantized coordinates, matching the cache key)
+            uncached_inputs[cache_key] = list(quantize_coordinate_pair(input_data)) if reverse else input_data
+    # Each result is cached as soon as it arrives, so results fetched before a request fails are not lost
+    def cache_result(cache_key, data):
+        geocoding_cache.set_cached_data(cache_key, data)
+        if reverse == True and 'Subregion' in data.get('address', {}):
+            geocoding_cache.set_cached_point(cache_key, uncached_inputs[cache_key][0], uncached_inputs[cache_key][1], data['address']['Subregion'])
+        results[cache_key] = data
+
+    if len(uncached_inputs) > 0:
+        print("** Fetching {} new results from API **".format(str(len(uncached_inputs))))
+        geocode, reverse_geocode = find_geocoding_functions()
+        try:
+            if reverse == False:
+                pipeline_metrics.increment_counter('Geocode API Calls', len(uncached_inputs))
+                geocoding_client.fetch_concurrently(uncached_inputs, geocode, cache_result)
+            else:
+                pipeline_metrics.increment_counter('Reverse Geocode API Calls', len(uncached_inputs))
+                geocoding_client.fetch_concurrently(uncached_inputs, reverse_geocode, cache_result)
+        except Exception:
+            # Writing the results that did arrive before the error stops the run
+            geocoding_cache.flush_cache()
+            raise
+    return [results[cache_key] for cache_key in cache_keys]
 
 # Geocode (converts street address to coordinates) or reverse geocodes (converts coordinates to street address).
 # When reverse == False, input_data should be a single-line address (string) that is used to query a set of coordinates.
 # When reverse == True, input_data should be a longitude latitude pair (tuple or list) that is used to look up a street address (used here to find county name).
 def fetch_geocoding_data_with_caching(input_data, reverse=False):
-    global HIT_API_YET
-    if reverse == True:
-        # Convert longitude latitude pair into a string to serve as a key in the cache dictionary
-        input_string = str(input_data[0]) + ', ' + str(input_data[1])
-    else:
-        input_string = input_data
-    if input_string in CACHE_DICTION:
-        # print("** Pulling data from cache **")
-        return CACHE_DICTION[input_string]
-    else:
-        print("** Fetching new data from API **")
-        if not HIT_API_YET:
-            gis = GIS()
-            HIT_API_YET = True
-        if reverse == False:
-            data = geocode(input_string) # geocode() argument is a string
-        else:
-            data = reverse_geocode(input_data) # reverse_geocode() argument is a list
-        CACHE_DICTION[input_string] = data
-        cache_file_open = open(ARCGIS_CACHE_FILE_NAME, "w")
-        cache_file_open.write(json.dumps(CACHE_DICTION, indent=4))
-        cache_file_open.close()
-        return data
+    return fetch_geocoding_data_for_batch([input_data], reverse)[0]
 
 ## General Functions
 
@@ -75,19 +140,75 @@ def find_mid_left_point(link_coords):
     y_value = (y_two - y_one)/2 + y_one
     return (x_value, y_value)
 
-# Extract link metadata (linked image identifier, PDF Object ID Number, and PDF X and Y coordinates) from batch_metadata, and store in list of dictionaries
-def create_new_link_records(batch_metadata):
+# Standardize points on index PDF link boxes for a whole batch at once. Argument: NumPy array of link coordinates with one row per link box.
+# Returns: NumPy arrays of x and y values
+def find_mid_left_points(link_coords_array):
+    x_values = link_coords_array[:, 0]
+    y_values = (link_coords_array[:, 3] - link_coords_array[:, 1])/2 + link_coords_array[:, 1]
+    return x_values, y_values
+
+# Find the corners of index PDF link boxes for a whole batch at once, counterclockwise from the lower left (PDF y values increase upward).
+# Argument: NumPy array of link coordinates with one row per link box. Returns: NumPy arrays of x and y values, with a row of four corners per link box
+def find_link_box_corners(link_coords_array):
+    min_x_values = np.minimum(link_coords_array[:, 0], link_coords_array[:, 2])
+    max_x_values = np.maximum(link_coords_array[:, 0], link_coords_array[:, 2])
+    min_y_values = np.minimum(link_coords_array[:, 1], link_coords_array[:, 3])
+    max_y_values = np.maximum(link_coords_array[:, 1], link_coords_array[:, 3])
+    x_values = np.column_stack([min_x_values, max_x_values, max_x_values, min_x_values])
+    y_values = np.column_stack([min_y_values, min_y_values, max_y_values, max_y_values])
+    return x_values, y_values
+
+# Create footprint polygons from the georeferenced corners of link boxes, as closed GeoJSON rings of [longitude, latitude] pairs.
+# Arguments: NumPy arrays of corner longitudes and latitudes, with a row per link box. Returns: NumPy array with a 5 x 2 ring per link box
+def create_footprint_rings(corner_longitudes, corner_latitudes):
+    # GeoJSON rings run counterclockwise, so rings a transform has mirrored (with negative shoelace areas) are reversed
+    signed_areas = (corner_longitudes * np.roll(corner_latitudes, -1, axis=1) - np.roll(corner_longitudes, -1, axis=1) * corner_latitudes).sum(axis=1)
+    clockwise = (signed_areas < 0)[:, np.newaxis]
+    corner_longitudes = np.where(clockwise, corner_longitudes[:, ::-1], corner_longitudes)
+    corner_latitudes = np.where(clockwise, corner_latitudes[:, ::-1], corner_latitudes)
+    rings = np.stack([corner_longitudes, corner_latitudes], axis=2)
+    return np.concatenate([rings, rings[:, :1, :]], axis=1)
+
+# Extract link metadata from batch_metadata into columns: lists of PDF Object ID Numbers and linked image identifiers,
+# and NumPy arrays of PDF X and Y coordinates (and, when footprints is True, of the full link coordinates)
+def create_link_columns(batch_metadata, footprints=FOOTPRINTS):
     links = batch_metadata['Index Records'][0]['Links']
-    link_location_dicts = []
-    for link in links:
-        link_location_dict = {}
-        link_location_dict['PDF Object ID Number'] = link['PDF Object ID Number']
-        link_location_dict['Linked Image PDF Identifier'] = link['Linked Image File Name'].replace('.pdf', '')
-        x_value, y_value = find_mid_left_point(link['Link Coordinates'])
-        link_location_dict['PDF X Coordinate'] = x_value
-        link_location_dict['PDF Y Coordinate'] = y_value
-        link_location_dicts.append(link_location_dict)
-    return link_location_dicts
+    link_columns = {}
+    link_columns['PDF Object ID Number'] = [link['PDF Object ID Number'] for link in links]
+    link_columns['Linked Image PDF Identifier'] = [link['Linked Image File Name'].replace('.pdf', '') for link in links]
+    link_coords_array = np.array([link['Link Coordinates'] for link in links], dtype=float).reshape(-1, 4)
+    link_columns['PDF X Coordinate'], link_columns['PDF Y Coordinate'] = find_mid_left_points(link_coords_array)
+    if footprints:
+        link_columns['PDF Link Coordinates'] = link_coords_array
+    return link_columns
+
+# Convert link columns into a list of link record dictionaries (one per link), converting NumPy arrays into Python lists
+def convert_link_columns_to_records(link_columns):
+    column_lists = {}
+    for column_name, column in link_columns.items():
+        if isinstance(column, np.ndarray):
+            column = column.tolist()
+        column_lists[column_name] = column
+    column_names = list(column_lists.keys())
+    link_records = []
+    for values in zip(*column_lists.values()):
+        link_records.append(dict(zip(column_names, values)))
+    return link_records
+
+# Convert a list of link record dictionaries into link columns
+def convert_link_records_to_columns(link_records):
+    link_columns = {}
+    link_columns['PDF Object ID Number'] = [link_record['PDF Object ID Number'] for link_record in link_records]
+    link_columns['Linked Image PDF Identifier'] = [link_record['Linked Image PDF Identifier'] for link_record in link_records]
+    link_columns['PDF X Coordinate'] = np.array([link_record['PDF X Coordinate'] for link_record in link_records], dtype=float)
+    link_columns['PDF Y Coordinate'] = np.array([link_record['PDF Y Coordinate'] for link_record in link_records], dtype=float)
+    if len(link_records) > 0 and 'PDF Link Coordinates' in link_records[0]:
+        link_columns['PDF Link Coordinates'] = np.array([link_record['PDF Link Coordinates'] for link_record in link_records], dtype=float).reshape(-1, 4)
+    return link_columns
+
+# Extract link metadata (linked image identifier, PDF Object ID Number, and PDF X and Y coordinates) from batch_metadata, and store in list of dictionaries
+def create_new_link_records(batch_metadata, footprints=FOOTPRINTS):
+    return convert_link_columns_to_records(create_link_columns(batch_metadata, footprints))
 
 # Pulls the longitude and latitude from the geocoding data returned from the ArcGIS API
 def pull_lon_and_lat(geocoding_dict):
@@ -126,14 +247,8 @@ def convert_between_systems(value, slope, intercept):
     new_value = (slope * value) + intercept
     return new_value
 
-# Reverse geocode input coordinates (as a list), extracts county name from result, and return county name (string).
-def check_county_using_geocoordinates(coordinate_pair):
-    data = fetch_geocoding_data_with_caching(coordinate_pair, reverse=True)
-    county = data['address']['Subregion']
-    return county
-
-# Calculates real-world coordinates of images using link records and address pair data
-def georeference_link_records(link_records, address_pair_dict):
+# Create a dictionary of the slopes and intercepts calculated from an index's two address pairs
+def create_constant_dict(address_pair_dict):
     constants = find_constants_for_formulas(address_pair_dict)
     constant_dict = {
         'X Slope': constants[0],
@@ -141,20 +256,184 @@ def georeference_link_records(link_records, address_pair_dict):
         'Y Slope': constants[2],
         'Y Intercept': constants[3]
     }
+    return constant_dict
+
+# Collect the ground control points for an index: the two addresses from address_pairs.csv plus any rows for the index in control_points.csv.
+# Each address is geocoded to find its real-world coordinates.
+# Returns: list of dictionaries with the address, PDF coordinates, longitude, and latitude of each control point
+def collect_control_points(address_pair_dict, control_point_dicts):
+    control_point_inputs = []
+    for address_number in ['1', '2']:
+        control_point_inputs.append((
+            address_pair_dict['Address ' + address_number],
+            address_pair_dict['Address ' + address_number + ' GIMP X Coordinate'],
+            address_pair_dict['Address ' + address_number + ' GIMP Y Coordinate']
+        ))
+    for control_point_dict in control_point_dicts:
+        control_point_inputs.append((control_point_dict['Address'], control_point_dict['GIMP X Coordinate'], control_point_dict['GIMP Y Coordinate']))
+    # Geocoding all of the addresses at once, so uncached addresses are fetched concurrently
+    geocoding_results = fetch_geocoding_data_for_batch([control_point_input[0] for control_point_input in control_point_inputs])
+    control_points = []
+    for (address, x_value, y_value), geocoding_result in zip(control_point_inputs, geocoding_results):
+        longitude, latitude = pull_lon_and_lat(geocoding_result[0])
+        control_points.append({
+            'Address': address,
+            'PDF X Coordinate': float(x_value),
+            'PDF Y Coordinate': float(y_value),
+            'Longitude': longitude,
+            'Latitude': latitude
+        })
+    return control_points
+
+# Fit a transform from PDF coordinates to geocoordinates using all of an index's control points.
+# Returns: dictionary with the transform type, 3x3 matrix, RMSE in meters, and control points with their residuals
+def fit_georeferencing_transform(address_pair_dict, control_point_dicts=None, transform_type=TRANSFORM_TYPE):
+    if control_point_dicts is None:
+        control_point_dicts = []
+    control_points = collect_control_points(address_pair_dict, control_point_dicts)
+    transform_dict = georeferencing_transforms.fit_transform(
+        [control_point['PDF X Coordinate'] for control_point in control_points],
+        [control_point['PDF Y Coordinate'] for control_point in control_points],
+        [control_point['Longitude'] for control_point in control_points],
+        [control_point['Latitude'] for control_point in control_points],
+        transform_type
+    )
+    for control_point, residual in zip(control_points, transform_dict.pop('Residuals (Meters)')):
+        control_point['Residual (Meters)'] = residual
+    transform_dict['Control Points'] = control_points
+    print('** Fitted {} transform to {} control points; RMSE: {:.1f} meters **'.format(transform_dict['Type'], str(len(control_points)), transform_dict['RMSE (Meters)']))
+    return transform_dict
+
+# Find the transform matrix in Georeferencing Metadata, building it from the formula constants for files written before transforms were stored
+def find_transform_matrix(georeferencing_metadata):
+    if georeferencing_metadata.get('Transform') is not None:
+        return georeferencing_metadata['Transform']['Matrix']
+    return georeferencing_transforms.create_matrix_from_constants(georeferencing_metadata['Constants'])
+
+# Convert PDF coordinates (single values or arrays) to longitudes and latitudes using a transform matrix
+def convert_pdf_coordinates(x_values, y_values, transform_matrix):
+    return georeferencing_transforms.apply_transform(transform_matrix, x_values, y_values)
+
+# Determine which county lookup engine to use ('arcgis' or 'local')
+def find_county_lookup_engine():
+    if COUNTY_LOOKUP_ENGINE == 'auto':
+        if os.path.exists(county_lookup.COUNTY_BOUNDARIES_FILE_PATH):
+            return 'local'
+        return 'arcgis'
+    return COUNTY_LOOKUP_ENGINE
 
-    # Calculate real-world coordinates, query ArcGIS API for county, and return data
-    georeferenced_link_records = []
-    for link_record in link_records:
-        georeferenced_link_record = link_record.copy()
-        georeferenced_link_record['Longitude'] = convert_between_systems(georeferenced_link_record['PDF X Coordinate'], constant_dict['X Slope'], constant_dict['X Intercept'])
-        georeferenced_link_record['Latitude'] = convert_between_systems(georeferenced_link_record['PDF Y Coordinate'], constant_dict['Y Slope'], constant_dict['Y Intercept'])
-        coordinate_pair = [georeferenced_link_record['Longitude'], georeferenced_link_record['Latitude']]
-        georeferenced_link_record['Current County'] = check_county_using_geocoordinates(coordinate_pair)
-        georeferenced_link_records.append(georeferenced_link_record)
-    return georeferenced_link_records, constant_dict
+# Reverse geocode input coordinates (as a list), extracts county name from result, and return county name (string).
+def reverse_geocode_county(coordinate_pair):
+    data = fetch_geocoding_data_with_caching(coordinate_pair, reverse=True)
+    county = data['address']['Subregion']
+    return county
+
+# Find the county of each point from the nearest reverse geocoded point in the cache within NEAREST_COUNTY_TOLERANCE_METERS,
+# filling in the counties list where one is found (so points only moved slightly since they were reverse geocoded are not requested again)
+def reuse_nearest_cached_counties(longitudes, latitudes, counties):
+    if NEAREST_COUNTY_TOLERANCE_METERS <= 0:
+        return
+    for point_position in range(len(counties)):
+        if counties[point_position] is not None:
+            continue
+        nearest = geocoding_cache.find_nearest_cached_point(longitudes[point_position], latitudes[point_position], NEAREST_COUNTY_TOLERANCE_METERS)
+        if nearest is not None:
+            counties[point_position] = nearest[0]
+            pipeline_metrics.increment_counter('Geocoding Cache Hits')
+            if nearest[1] > 0:
+                pipeline_metrics.increment_counter('Nearest Cached Counties Reused')
+
+# Find the counties for a batch of points, using the configured county lookup engine.
+# Points the local engine cannot place in any county polygon are given the county of the nearest cached point if one is close enough,
+# and are reverse geocoded otherwise, all at once.
+# Arguments: sequences of longitudes and latitudes. Returns: list of county names (strings)
+def check_counties_using_geocoordinates(longitudes, latitudes):
+    if find_county_lookup_engine() == 'local':
+        counties = county_lookup.resolve_counties(longitudes, latitudes)
+    else:
+        counties = [None] * len(longitudes)
+    reuse_nearest_cached_counties(longitudes, latitudes, counties)
+    unresolved_positions = [point_position for point_position in range(len(counties)) if counties[point_position] is None]
+    coordinate_pairs = [[longitudes[point_position], latitudes[point_position]] for point_position in unresolved_positions]
+    for point_position, data in zip(unresolved_positions, fetch_geocoding_data_for_batch(coordinate_pairs, reverse=True)):
+        counties[point_position] = data['address']['Subregion']
+    return counties
+
+# Find the county for input coordinates (as a list), and return county name (string).
+def check_county_using_geocoordinates(coordinate_pair):
+    return check_counties_using_geocoordinates([coordinate_pair[0]], [coordinate_pair[1]])[0]
+
+# Calculates real-world coordinates and counties for link columns in one vectorized pass, using a transform matrix.
+# If the columns include 'PDF Link Coordinates', the four corners of every link box are converted in the same pass.
+# Returns: new link columns with 'Longitude' and 'Latitude' NumPy arrays, a 'Footprint' array of rings (if corners were converted),
+# and a 'Current County' list added
+def georeference_link_columns(link_columns, transform_matrix):
+    georeferenced_link_columns = dict(link_columns)
+    with pipeline_metrics.time_block('Coordinate Conversion'):
+        longitudes, latitudes = convert_pdf_coordinates(link_columns['PDF X Coordinate'], link_columns['PDF Y Coordinate'], transform_matrix)
+        if 'PDF Link Coordinates' in link_columns:
+            corner_x_values, corner_y_values = find_link_box_corners(link_columns['PDF Link Coordinates'])
+            corner_longitudes, corner_latitudes = convert_pdf_coordinates(corner_x_values, corner_y_values, transform_matrix)
+            footprint_rings = create_footprint_rings(corner_longitudes, corner_latitudes)
+    georeferenced_link_columns['Longitude'] = longitudes
+    georeferenced_link_columns['Latitude'] = latitudes
+    if 'PDF Link Coordinates' in link_columns:
+        georeferenced_link_columns['Footprint'] = footprint_rings
+        pipeline_metrics.increment_counter('Footprints Georeferenced', len(footprint_rings))
+    with pipeline_metrics.time_block('County Lookup'):
+        georeferenced_link_columns['Current County'] = check_counties_using_geocoordinates(longitudes.tolist(), latitudes.tolist())
+    pipeline_metrics.increment_counter('Links Georeferenced', len(longitudes))
+    return georeferenced_link_columns
+
+# Calculates real-world coordinates of images using link records, address pair data, and any additional control points
+# Returns: list of georeferenced link records and the transform dictionary used
+def georeference_link_records(link_records, address_pair_dict, control_point_dicts=None):
+    if control_point_dicts is None:
+        control_point_dicts = []
+    with pipeline_metrics.time_block('Transform Fitting'):
+        transform_dict = fit_georeferencing_transform(address_pair_dict, control_point_dicts)
+
+    # Calculate real-world coordinates and find counties for all links at once, then convert back into records
+    link_columns = convert_link_records_to_columns(link_records)
+    georeferenced_link_columns = georeference_link_columns(link_columns, transform_dict['Matrix'])
+    georeferenced_link_records = convert_link_columns_to_records(georeferenced_link_columns)
+    return georeferenced_link_records, transform_dict
+
+# Load link records from a previous georeferencing output file, keyed by PDF Object ID Number, identifier, and PDF coordinates.
+# Previous records are only returned if they were georeferenced with a transform fitted to the same address pair and control point data,
+# and with footprints only if footprints is True.
+# Returns: dictionary of previous link records and the previous transform dictionary (or an empty dictionary and None)
+def load_previous_georeferenced_links(georeferenced_links_file_path, address_pair_dict, control_point_dicts=None, footprints=FOOTPRINTS):
+    if control_point_dicts is None:
+        control_point_dicts = []
+    try:
+        georeferenced_links_file = open(georeferenced_links_file_path, 'r', encoding='utf-8')
+        previous_georeferenced_link_data = json.loads(georeferenced_links_file.read())
+        georeferenced_links_file.close()
+    except (OSError, ValueError):
+        return {}, None
+    previous_metadata = previous_georeferenced_link_data['Georeferencing Metadata']
+    if previous_metadata['Address Pair Data'] != address_pair_dict or previous_metadata.get('Control Point Data') != control_point_dicts:
+        return {}, None
+    if previous_metadata.get('Transform') is None or previous_metadata.get('Transform Type Requested') != TRANSFORM_TYPE:
+        return {}, None
+    if previous_metadata.get('Footprints', False) != footprints:
+        return {}, None
+    previous_link_records = {}
+    for link_record in previous_georeferenced_link_data['Georeferenced Link Records']:
+        previous_link_records[make_link_record_key(link_record)] = link_record
+    return previous_link_records, previous_metadata['Transform']
+
+# Create a key identifying a link record by its PDF Object ID Number, linked image identifier, and PDF coordinates (including the full link
+# coordinates of records with footprints, since the size of a link box can change without moving its mid-left point)
+def make_link_record_key(link_record):
+    return (link_record['PDF Object ID Number'], link_record['Linked Image PDF Identifier'], link_record['PDF X Coordinate'], link_record['PDF Y Coordinate'], tuple(link_record.get('PDF Link Coordinates', [])))
 
 # Performs georeferencing workflow on all extracted links from one county index in one year (e.g. all Macomb 1961 images)
-def run_georeferencing_workflow(batch_metadata_file_path, output_name, output_location='output/'):
+# When incremental is True, link records already georeferenced in a previous output file (with the same address pair and control points) are reused,
+# and only new or modified links are georeferenced.
+# When footprints is True, each link record also gets a 'Footprint' polygon georeferenced from the four corners of its link box.
+def run_georeferencing_workflow(batch_metadata_file_path, output_name, output_location='output/', incremental=False, output_format='pretty', footprints=FOOTPRINTS):
     print('\n** Link Georeferencing **')
 
     # Load data from batch metadata file
@@ -177,22 +456,53 @@ def run_georeferencing_workflow(batch_metadata_file_path, output_name, output_lo
     if pair_index == len(address_pairs):
         print('?? No address pair found for {} ??'.format(index_file_name))
 
+    # Find any additional control points for the index in control_points.csv
+    control_point_dicts = []
+    for control_point_dict in misc_functions.load_csv_data(CONTROL_POINTS_FILE_PATH):
+        if control_point_dict['Index File Name'] == index_file_name:
+            control_point_dicts.append(control_point_dict)
+
     # Create link records to use in georeferencing
-    link_records = create_new_link_records(batch_metadata)
+    link_records = create_new_link_records(batch_metadata, footprints)
 
-    # Store georeferencing data and metadata (address pair used, formula constants)
-    georeferenced_link_records, constants = georeference_link_records(link_records, current_index_address_pair)
+    # Split link records into those that can be reused from the previous output and those that need georeferencing
+    if incremental:
+        previous_link_records, transform_dict = load_previous_georeferenced_links(output_location + output_name, current_index_address_pair, control_point_dicts, footprints)
+    else:
+        previous_link_records, transform_dict = {}, None
+    new_link_records = []
+    for link_record in link_records:
+        if make_link_record_key(link_record) not in previous_link_records:
+            new_link_records.append(link_record)
+    if incremental:
+        print('** {} of {} link records are new or modified **'.format(str(len(new_link_records)), str(len(link_records))))
+        pipeline_metrics.increment_counter('Links Reused', len(link_records) - len(new_link_records))
+
+    # Store georeferencing data and metadata (address pair and control points used, formula constants, fitted transform)
+    if len(new_link_records) > 0 or transform_dict is None:
+        new_georeferenced_link_records, transform_dict = georeference_link_records(new_link_records, current_index_address_pair, control_point_dicts)
+        for georeferenced_link_record in new_georeferenced_link_records:
+            previous_link_records[make_link_record_key(georeferenced_link_record)] = georeferenced_link_record
+    georeferenced_link_records = []
+    for link_record in link_records:
+        georeferenced_link_records.append(previous_link_records[make_link_record_key(link_record)])
     georeferenced_link_data = {}
     georeferenced_link_data['Georeferencing Metadata'] = {
         'Address Pair Data': current_index_address_pair,
-        'Constants': constants,
+        'Control Point Data': control_point_dicts,
+        'Constants': create_constant_dict(current_index_address_pair),
+        'Transform Type Requested': TRANSFORM_TYPE,
+        'Transform': transform_dict,
+        'Footprints': footprints
     }
     georeferenced_link_data['Georeferenced Link Records'] = georeferenced_link_records
 
+    # Write any new geocoding results to the cache file
+    geocoding_cache.flush_cache()
+
     # Write georeferencing data to file as JSON
-    georeferenced_links_file = open(output_location + output_name, 'w', encoding='utf-8')
-    georeferenced_links_file.write(json.dumps(georeferenced_link_data, indent=4))
-    georeferenced_links_file.close()
+    with pipeline_metrics.time_block('Georeferenced Links Serialization'):
+        json_streaming.write_json_document(output_location + output_name, georeferenced_link_data, output_format)
 
     return georeferenced_link_data
 
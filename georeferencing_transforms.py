@@ -0,0 +1,126 @@
+# DTE Aerial Photo Collection curation project
+# Least-squares transforms from PDF coordinates to geocoordinates, fitted to any number of ground control points
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# NumPy linear algebra documentation: https://numpy.org/doc/stable/reference/routines.linalg.html
+
+# Three transform types are supported, each stored as a 3x3 matrix applied to homogeneous PDF coordinates (x, y, 1):
+#   'linear'     - an independent slope and intercept for each axis (the original two-address-pair formulas); needs 2 points
+#   'affine'     - adds rotation and shear; needs 3 points
+#   'projective' - also corrects for keystone distortion; needs 4 points
+# With more points than needed, the transform is fitted by least squares, and the residuals show how well it fits.
+
+# third-party modules
+import numpy as np
+
+# global variables
+MINIMUM_POINTS = {'linear': 2, 'affine': 3, 'projective': 4}
+# Approximate meters per degree of latitude, used to report residuals in meters
+METERS_PER_DEGREE = 111320.0
+
+## Functions
+
+# Create a matrix that shifts points to their centroid and scales them to an average distance of one, to keep the fitting well conditioned
+def create_normalizing_matrix(points):
+    centroid = points.mean(axis=0)
+    average_distance = np.sqrt(((points - centroid) ** 2).sum(axis=1)).mean()
+    scale = 1.0 / average_distance if average_distance > 0 else 1.0
+    return np.array([
+        [scale, 0.0, -scale * centroid[0]],
+        [0.0, scale, -scale * centroid[1]],
+        [0.0, 0.0, 1.0]
+    ])
+
+# Apply a 3x3 transform matrix to arrays of x and y values. Returns: NumPy arrays of transformed x and y values
+def apply_transform(transform_matrix, x_values, y_values):
+    transform_matrix = np.asarray(transform_matrix, dtype=float)
+    x_values = np.asarray(x_values, dtype=float)
+    y_values = np.asarray(y_values, dtype=float)
+    new_x_values = transform_matrix[0, 0] * x_values + transform_matrix[0, 1] * y_values + transform_matrix[0, 2]
+    new_y_values = transform_matrix[1, 0] * x_values + transform_matrix[1, 1] * y_values + transform_matrix[1, 2]
+    weights = transform_matrix[2, 0] * x_values + transform_matrix[2, 1] * y_values + transform_matrix[2, 2]
+    return new_x_values / weights, new_y_values / weights
+
+# Solve for the transform matrix of the given type mapping normalized PDF points to normalized geographic points
+def solve_normalized_transform(pdf_points, geo_points, transform_type):
+    point_count = len(pdf_points)
+    ones = np.ones(point_count)
+    zeros = np.zeros(point_count)
+    if transform_type == 'linear':
+        x_solution = np.linalg.lstsq(np.column_stack([pdf_points[:, 0], ones]), geo_points[:, 0], rcond=None)[0]
+        y_solution = np.linalg.lstsq(np.column_stack([pdf_points[:, 1], ones]), geo_points[:, 1], rcond=None)[0]
+        return np.array([
+            [x_solution[0], 0.0, x_solution[1]],
+            [0.0, y_solution[0], y_solution[1]],
+            [0.0, 0.0, 1.0]
+        ])
+    if transform_type == 'affine':
+        design_matrix = np.column_stack([pdf_points[:, 0], pdf_points[:, 1], ones])
+        solution = np.linalg.lstsq(design_matrix, geo_points, rcond=None)[0]
+        return np.vstack([solution.T, [0.0, 0.0, 1.0]])
+    if transform_type == 'projective':
+        x, y = pdf_points[:, 0], pdf_points[:, 1]
+        lon, lat = geo_points[:, 0], geo_points[:, 1]
+        design_matrix = np.vstack([
+            np.column_stack([x, y, ones, zeros, zeros, zeros, -x * lon, -y * lon]),
+            np.column_stack([zeros, zeros, zeros, x, y, ones, -x * lat, -y * lat])
+        ])
+        solution = np.linalg.lstsq(design_matrix, np.concatenate([lon, lat]), rcond=None)[0]
+        return np.append(solution, 1.0).reshape(3, 3)
+    raise ValueError('Unknown transform type: {}'.format(transform_type))
+
+# Calculate the distance in meters between fitted and actual geocoordinates for each control point
+def calculate_residuals_in_meters(fitted_lons, fitted_lats, lons, lats):
+    lon_errors = (fitted_lons - lons) * METERS_PER_DEGREE * np.cos(np.radians(lats))
+    lat_errors = (fitted_lats - lats) * METERS_PER_DEGREE
+    return np.sqrt(lon_errors ** 2 + lat_errors ** 2)
+
+# Fit a transform from PDF coordinates to geocoordinates using control points.
+# If there are too few points for the requested transform type, the most complex type the points allow is used instead.
+# Arguments: sequences of PDF x values, PDF y values, longitudes, and latitudes, and the transform type (string)
+# Returns: dictionary with the transform type, 3x3 matrix, per-point residuals in meters, and root mean square error in meters
+def fit_transform(pdf_x_values, pdf_y_values, longitudes, latitudes, transform_type='affine'):
+    pdf_points = np.column_stack([pdf_x_values, pdf_y_values]).astype(float)
+    geo_points = np.column_stack([longitudes, latitudes]).astype(float)
+    if len(pdf_points) < MINIMUM_POINTS['linear']:
+        raise ValueError('At least two control points are needed to georeference an index')
+    if len(pdf_points) < MINIMUM_POINTS[transform_type]:
+        for fallback_type in ['affine', 'linear']:
+            if MINIMUM_POINTS[fallback_type] <= len(pdf_points):
+                break
+        print('** {} control points available; using a {} transform instead of {} **'.format(str(len(pdf_points)), fallback_type, transform_type))
+        transform_type = fallback_type
+
+    # Fit the transform in normalized coordinates, then undo the normalization
+    pdf_normalizing_matrix = create_normalizing_matrix(pdf_points)
+    geo_normalizing_matrix = create_normalizing_matrix(geo_points)
+    if transform_type == 'linear':
+        # Axes are fitted independently, so each axis must be scaled independently
+        pdf_normalizing_matrix = np.diag([1.0, 1.0, 1.0])
+        geo_normalizing_matrix = np.diag([1.0, 1.0, 1.0])
+    normalized_pdf_points = np.column_stack(apply_transform(pdf_normalizing_matrix, pdf_points[:, 0], pdf_points[:, 1]))
+    normalized_geo_points = np.column_stack(apply_transform(geo_normalizing_matrix, geo_points[:, 0], geo_points[:, 1]))
+    normalized_matrix = solve_normalized_transform(normalized_pdf_points, normalized_geo_points, transform_type)
+    transform_matrix = np.linalg.inv(geo_normalizing_matrix).dot(normalized_matrix).dot(pdf_normalizing_matrix)
+    transform_matrix = transform_matrix / transform_matrix[2, 2]
+
+    fitted_lons, fitted_lats = apply_transform(transform_matrix, pdf_points[:, 0], pdf_points[:, 1])
+    residuals = calculate_residuals_in_meters(fitted_lons, fitted_lats, geo_points[:, 0], geo_points[:, 1])
+    transform_dict = {
+        'Type': transform_type,
+        'Matrix': transform_matrix.tolist(),
+        'Residuals (Meters)': residuals.tolist(),
+        'RMSE (Meters)': float(np.sqrt((residuals ** 2).mean()))
+    }
+    return transform_dict
+
+# Create the matrix for a 'linear' transform from a dictionary of slopes and intercepts (as produced by georeference_links.find_constants_for_formulas)
+def create_matrix_from_constants(constant_dict):
+    return [
+        [constant_dict['X Slope'], 0.0, constant_dict['X Intercept']],
+        [0.0, constant_dict['Y Slope'], constant_dict['Y Intercept']],
+        [0.0, 0.0, 1.0]
+    ]
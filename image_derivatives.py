@@ -0,0 +1,251 @@
+# DTE Aerial Photo Collection curation project
+# Thumbnails and Deep Zoom tile pyramids for the JPEG files extracted from image PDFs
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# Pillow documentation: https://pillow.readthedocs.io/en/stable/
+# Deep Zoom file format documentation: https://docs.microsoft.com/en-us/previous-versions/windows/silverlight/dotnet-windows-silverlight/cc645077(v=vs.95)
+
+# For each extracted JPEG, a thumbnail and a Deep Zoom pyramid are written to the derivatives subdirectory of the extraction output
+# location: dte_aerial_[identifier]_thumbnail.jpg, dte_aerial_[identifier].dzi (the descriptor read by viewers like OpenSeadragon),
+# and dte_aerial_[identifier]_files/[level]/[column]_[row].jpg (the tiles). Each level of the pyramid is half the width and height
+# of the level above it, down to a single pixel. JPEGs are opened in Pillow's draft mode, which has the decoder scale the image
+# down by 1/2, 1/4, or 1/8 while decoding (using the DCT coefficients), so thumbnails are made without decoding the full image.
+# The pyramid is decoded once, at the size of its top level, and each lower level is reduced from the one above it.
+# Images are processed on a pool of worker processes. A manifest records the size and modification time of each source JPEG
+# along with its derivatives, so images that have not changed since the last run are skipped.
+
+# standard modules
+import os
+import math
+import time
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+# third-party modules
+from PIL import Image
+
+# local modules
+import extraction_manifest
+import pipeline_metrics
+
+# global variables
+DERIVATIVES_DIRECTORY_NAME = 'derivatives/'
+DERIVATIVES_MANIFEST_SUFFIX = '_derivatives_manifest.json'
+# Largest width or height of thumbnails, in pixels
+THUMBNAIL_SIZE = 256
+TILE_SIZE = 254
+# Pixels each tile shares with its neighbors, so viewers can blend tile edges
+TILE_OVERLAP = 1
+JPEG_QUALITY = 85
+# Largest width or height of the top level of pyramids, in pixels (None uses the full resolution of the image)
+PYRAMID_MAX_SIZE = None
+# Number of worker processes used to create derivatives (None uses one per CPU; 1 creates them serially)
+DERIVATIVE_WORKERS = None
+
+## Functions
+
+# Open a JPEG in draft mode, so it is decoded at the smallest DCT scale (1/1, 1/2, 1/4, or 1/8) still at least requested_size.
+# Images in modes other than grayscale and RGB (e.g. CMYK) are converted to RGB, since browsers do not display them reliably.
+def open_image_in_draft_mode(image_file_path, requested_size):
+    image = Image.open(image_file_path)
+    if image.format == 'JPEG':
+        image.draft(None, requested_size)
+    if image.mode not in ['L', 'RGB']:
+        image = image.convert('RGB')
+    return image
+
+# Find the size of an image scaled down (never up) to fit within max_size pixels
+def find_fitted_size(width, height, max_size):
+    if max_size is None or max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+# Create a thumbnail of a JPEG. Returns: the thumbnail's width and height
+def create_thumbnail(image_file_path, thumbnail_file_path):
+    image = open_image_in_draft_mode(image_file_path, (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    image.save(thumbnail_file_path, 'JPEG', quality=JPEG_QUALITY)
+    return image.size
+
+# Find the number of levels in a Deep Zoom pyramid: level 0 is a single pixel, and the last level is the full image
+def find_pyramid_level_count(width, height):
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+# Find the box of pixels covered by a tile, including the overlap with its neighbors
+def find_tile_box(column, row, level_width, level_height):
+    left = max(0, column * TILE_SIZE - TILE_OVERLAP)
+    upper = max(0, row * TILE_SIZE - TILE_OVERLAP)
+    right = min(level_width, (column + 1) * TILE_SIZE + TILE_OVERLAP)
+    lower = min(level_height, (row + 1) * TILE_SIZE + TILE_OVERLAP)
+    return (left, upper, right, lower)
+
+# Create the Deep Zoom descriptor for an image of the given size
+def create_dzi_descriptor(width, height):
+    descriptor = '<?xml version="1.0" encoding="UTF-8"?>\n'
+    descriptor += '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="{}" TileSize="{}">\n'.format(str(TILE_OVERLAP), str(TILE_SIZE))
+    descriptor += '    <Size Width="{}" Height="{}"/>\n'.format(str(width), str(height))
+    descriptor += '</Image>\n'
+    return descriptor
+
+# Create a Deep Zoom pyramid for a JPEG: the descriptor file and a directory of tiles for each level.
+# Returns: the width and height of the top level, the number of levels, the number of tiles, and the bytes written
+def create_pyramid(image_file_path, descriptor_file_path, tile_directory_path):
+    source_image = Image.open(image_file_path)
+    width, height = find_fitted_size(source_image.size[0], source_image.size[1], PYRAMID_MAX_SIZE)
+    source_image.close()
+    image = open_image_in_draft_mode(image_file_path, (width, height))
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.LANCZOS)
+
+    # Replacing any tiles from an earlier version of the image, since its size may have changed
+    if os.path.exists(tile_directory_path):
+        shutil.rmtree(tile_directory_path)
+    level_count = find_pyramid_level_count(width, height)
+    tile_count = 0
+    bytes_written = 0
+    for level in range(level_count - 1, -1, -1):
+        level_directory_path = tile_directory_path + str(level) + '/'
+        os.makedirs(level_directory_path)
+        level_width, level_height = image.size
+        for column in range(int(math.ceil(level_width / TILE_SIZE))):
+            for row in range(int(math.ceil(level_height / TILE_SIZE))):
+                tile_file_path = '{}{}_{}.jpg'.format(level_directory_path, str(column), str(row))
+                image.crop(find_tile_box(column, row, level_width, level_height)).save(tile_file_path, 'JPEG', quality=JPEG_QUALITY)
+                tile_count += 1
+                bytes_written += os.path.getsize(tile_file_path)
+        # Each level is half the size of the one above it, rounded up
+        if level > 0:
+            image = image.reduce(2)
+
+    descriptor_file = open(descriptor_file_path, 'w', encoding='utf-8')
+    descriptor_file.write(create_dzi_descriptor(width, height))
+    descriptor_file.close()
+    bytes_written += os.path.getsize(descriptor_file_path)
+    return width, height, level_count, tile_count, bytes_written
+
+# Create the thumbnail and pyramid for one extracted JPEG.
+# Returns: dictionary with the paths (relative to derivatives_location) and sizes of the derivatives
+def create_derivatives(image_file_path, derivatives_location):
+    with pipeline_metrics.time_block('Derivative Creation', 'Derivative Latency'):
+        image_stem = os.path.basename(image_file_path).rsplit('.', 1)[0]
+        thumbnail_file_name = image_stem + '_thumbnail.jpg'
+        thumbnail_width, thumbnail_height = create_thumbnail(image_file_path, derivatives_location + thumbnail_file_name)
+        descriptor_file_name = image_stem + '.dzi'
+        tile_directory_name = image_stem + '_files/'
+        pyramid_width, pyramid_height, level_count, tile_count, pyramid_bytes = create_pyramid(image_file_path, derivatives_location + descriptor_file_name, derivatives_location + tile_directory_name)
+    derivative_record = {
+        'Thumbnail File Name': thumbnail_file_name,
+        'Thumbnail Width': thumbnail_width,
+        'Thumbnail Height': thumbnail_height,
+        'Thumbnail Size': os.path.getsize(derivatives_location + thumbnail_file_name),
+        'Pyramid Descriptor File Name': descriptor_file_name,
+        'Pyramid Tile Directory Name': tile_directory_name,
+        'Pyramid Width': pyramid_width,
+        'Pyramid Height': pyramid_height,
+        'Pyramid Level Count': level_count,
+        'Pyramid Tile Count': tile_count,
+        'Pyramid Size': pyramid_bytes
+    }
+    pipeline_metrics.increment_counter('Derivatives Created')
+    pipeline_metrics.increment_counter('Pyramid Tiles Created', tile_count)
+    pipeline_metrics.increment_counter('Derivative Bytes Written', derivative_record['Thumbnail Size'] + pyramid_bytes)
+    return derivative_record
+
+# Create the derivatives for one extracted JPEG, catching errors from JPEGs Pillow cannot decode so one bad image does not stop the batch.
+# Returns: the derivative record (None if the derivatives could not be created) and the error (None if there was none)
+def try_creating_derivatives(image_file_path, derivatives_location):
+    try:
+        return create_derivatives(image_file_path, derivatives_location), None
+    except (OSError, Image.DecompressionBombError) as error:
+        pipeline_metrics.increment_counter('Derivative Failures')
+        return None, repr(error)
+
+# Create derivatives inside a pool worker, returning the worker's metrics along with the derivative record and any error
+def create_derivatives_in_worker(image_file_path, derivatives_location):
+    derivative_record, error = try_creating_derivatives(image_file_path, derivatives_location)
+    return derivative_record, error, pipeline_metrics.take_metrics()
+
+# Check whether the derivatives of an image can be reused: the source JPEG has the same size and modification time as when
+# they were created, and the derivative files still exist
+def check_derivatives_unchanged(image_file_path, manifest_entry, derivatives_location):
+    if manifest_entry is None:
+        return False
+    file_stats = os.stat(image_file_path)
+    if file_stats.st_size != manifest_entry['Source Size'] or file_stats.st_mtime != manifest_entry['Source Modification Time']:
+        return False
+    derivative_record = manifest_entry['Derivatives']
+    return os.path.exists(derivatives_location + derivative_record['Thumbnail File Name']) and os.path.exists(derivatives_location + derivative_record['Pyramid Descriptor File Name'])
+
+# Make the manifest file name for a batch (e.g. macomb_1961_derivatives_manifest.json)
+def make_manifest_file_name(county_year_combo):
+    return county_year_combo + DERIVATIVES_MANIFEST_SUFFIX
+
+# Load the derivative records of a batch from its manifest, keyed by created image file name, without creating any derivatives
+def load_derivative_records(image_location, county_year_combo):
+    manifest = extraction_manifest.load_manifest(image_location + DERIVATIVES_DIRECTORY_NAME + make_manifest_file_name(county_year_combo))
+    derivative_records = {}
+    for created_image_file_name, manifest_entry in manifest.items():
+        derivative_records[created_image_file_name] = manifest_entry['Derivatives']
+    return derivative_records
+
+# Create derivatives for the JPEGs created from a batch's image records, skipping images whose derivatives are up to date.
+# Arguments: image records from the batch metadata, the directory holding the extracted JPEGs, the county/year combination naming the manifest,
+# and the number of worker processes. Returns: dictionary of derivative records keyed by created image file name
+def run_derivative_workflow(image_records, image_location, county_year_combo, workers=DERIVATIVE_WORKERS):
+    print('\n** Derivative Creation **')
+    derivatives_start = time.time()
+    if workers is None:
+        workers = os.cpu_count()
+    derivatives_location = image_location + DERIVATIVES_DIRECTORY_NAME
+    os.makedirs(derivatives_location, exist_ok=True)
+    manifest_path = derivatives_location + make_manifest_file_name(county_year_combo)
+    manifest = extraction_manifest.load_manifest(manifest_path)
+
+    # Split images into those whose derivatives can be reused and those that need new ones
+    updated_manifest = {}
+    changed_image_file_names = []
+    for image_record in image_records:
+        created_image_file_name = image_record.get('Created Image File Name')
+        if created_image_file_name is None or not os.path.exists(image_location + created_image_file_name):
+            continue
+        if check_derivatives_unchanged(image_location + created_image_file_name, manifest.get(created_image_file_name), derivatives_location):
+            updated_manifest[created_image_file_name] = manifest[created_image_file_name]
+        else:
+            changed_image_file_names.append(created_image_file_name)
+    print('** {} of {} images need new derivatives **'.format(str(len(changed_image_file_names)), str(len(changed_image_file_names) + len(updated_manifest))))
+    pipeline_metrics.increment_counter('Unchanged Derivatives Skipped', len(updated_manifest))
+
+    image_file_paths = [image_location + created_image_file_name for created_image_file_name in changed_image_file_names]
+    if workers > 1 and len(image_file_paths) > 1:
+        chunk_size = max(1, len(image_file_paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            worker_results = list(executor.map(create_derivatives_in_worker, image_file_paths, [derivatives_location] * len(image_file_paths), chunksize=chunk_size))
+        derivative_results = []
+        for derivative_record, error, worker_metrics in worker_results:
+            derivative_results.append((derivative_record, error))
+            pipeline_metrics.merge_metrics(worker_metrics)
+    else:
+        derivative_results = [try_creating_derivatives(image_file_path, derivatives_location) for image_file_path in image_file_paths]
+
+    # Images whose derivatives could not be created are left out of the manifest, so they are tried again on the next run
+    for created_image_file_name, image_file_path, (derivative_record, error) in zip(changed_image_file_names, image_file_paths, derivative_results):
+        if derivative_record is None:
+            print('?? Derivatives could not be created for {}: {} ??'.format(created_image_file_name, error))
+            continue
+        file_stats = os.stat(image_file_path)
+        updated_manifest[created_image_file_name] = {
+            'Source Size': file_stats.st_size,
+            'Source Modification Time': file_stats.st_mtime,
+            'Derivatives': derivative_record
+        }
+    extraction_manifest.write_manifest(manifest_path, updated_manifest, sort_keys=False)
+    print('** Time to Run: {} **'.format(str(time.time() - derivatives_start)))
+
+    derivative_records_by_name = {}
+    for created_image_file_name, manifest_entry in updated_manifest.items():
+        derivative_records_by_name[created_image_file_name] = manifest_entry['Derivatives']
+    return derivative_records_by_name
@@ -0,0 +1,151 @@
+# DTE Aerial Photo Collection curation project
+# Streaming JSON, JSON Lines, and GeoJSON writers for workflow output files
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# JSON Lines: https://jsonlines.org/
+# GeoJSON Text Sequences (GeoJSONSeq): https://tools.ietf.org/html/rfc8142
+
+# The writers in this module write one record or feature at a time as they are produced, instead of building the whole
+# output document with json.dumps(). Any list or generator at the top level of a document is streamed item by item.
+# Three output formats are supported:
+#   'pretty'  - indented JSON, identical to json.dumps(document, indent=4) (the original output)
+#   'compact' - JSON without indentation or extra whitespace
+#   'lines'   - newline-delimited output: JSON Lines for record lists and GeoJSONSeq for GeoJSON features
+#               (documents that are not lists, like batch metadata, are written in the compact format)
+
+# standard modules
+import json
+
+# global variables
+OUTPUT_FORMATS = ['pretty', 'compact', 'lines']
+RECORD_SEPARATOR = '\x1e'
+
+## Functions
+
+# Serialize one value in the given output format, indenting it to the given nesting level when pretty printing
+def dump_value(value, output_format, level=0):
+    if output_format == 'pretty':
+        return json.dumps(value, indent=4).replace('\n', '\n' + '    ' * level)
+    return json.dumps(value, separators=(',', ':'))
+
+# Write the items of a list or generator to an open file as a JSON array, one item at a time
+def write_json_array(file_object, items, output_format='pretty', level=0):
+    if output_format == 'lines' and level == 0:
+        for item in items:
+            file_object.write(dump_value(item, 'compact') + '\n')
+        return
+    if output_format != 'pretty':
+        output_format = 'compact'
+    item_count = 0
+    file_object.write('[')
+    for item in items:
+        if item_count > 0:
+            file_object.write(',')
+        if output_format == 'pretty':
+            file_object.write('\n' + '    ' * (level + 1))
+        file_object.write(dump_value(item, output_format, level + 1))
+        item_count += 1
+    if item_count > 0 and output_format == 'pretty':
+        file_object.write('\n' + '    ' * level)
+    file_object.write(']')
+
+# Pass items through while writing each one to an open file as part of a JSON array (or JSON Lines), so the same items
+# can be written to a second output file in the same pass. The array is closed once all the items have been consumed.
+def pass_through_json_array(file_object, items, output_format='pretty'):
+    started = False
+    if output_format != 'lines':
+        file_object.write('[')
+    for item in items:
+        if output_format == 'lines':
+            file_object.write(dump_value(item, 'compact') + '\n')
+        elif output_format == 'pretty':
+            file_object.write((',' if started else '') + '\n    ' + dump_value(item, 'pretty', 1))
+        else:
+            file_object.write((',' if started else '') + dump_value(item, 'compact'))
+        started = True
+        yield item
+    if output_format != 'lines':
+        file_object.write('\n]' if started and output_format == 'pretty' else ']')
+
+# Write a JSON document to a file. If the document is a dictionary, lists and generators among its values are streamed;
+# if it is a list or generator itself, its items are streamed.
+def write_json_document(file_path, document, output_format='pretty'):
+    document_file = open(file_path, 'w', encoding='utf-8')
+    if isinstance(document, dict):
+        if output_format == 'lines':
+            output_format = 'compact'
+        document_file.write('{')
+        key_count = 0
+        for key, value in document.items():
+            if key_count > 0:
+                document_file.write(',')
+            if output_format == 'pretty':
+                document_file.write('\n    ' + json.dumps(key) + ': ')
+            else:
+                document_file.write(json.dumps(key) + ':')
+            if isinstance(value, dict) or isinstance(value, (str, int, float, bool)) or value is None:
+                document_file.write(dump_value(value, output_format, 1))
+            else:
+                write_json_array(document_file, value, output_format, 1)
+            key_count += 1
+        if key_count > 0 and output_format == 'pretty':
+            document_file.write('\n')
+        document_file.write('}')
+    else:
+        write_json_array(document_file, document, output_format)
+    document_file.close()
+
+# Write GeoJSON features to a file: as a FeatureCollection for the 'pretty' and 'compact' formats, or as a GeoJSONSeq for 'lines'
+def write_geojson_features(file_path, features, output_format='pretty'):
+    if output_format == 'lines':
+        geojson_file = open(file_path, 'w', encoding='utf-8')
+        for feature in features:
+            geojson_file.write(RECORD_SEPARATOR + dump_value(feature, 'compact') + '\n')
+        geojson_file.close()
+    else:
+        geojson_wrapper = {}
+        geojson_wrapper['type'] = 'FeatureCollection'
+        geojson_wrapper['features'] = features
+        write_json_document(file_path, geojson_wrapper, output_format)
+
+# Read GeoJSON features one at a time from a FeatureCollection or GeoJSONSeq file written by write_geojson_features
+def read_geojson_features(file_path):
+    geojson_file = open(file_path, 'r', encoding='utf-8')
+    first_character = geojson_file.read(1)
+    geojson_file.seek(0)
+    if first_character == RECORD_SEPARATOR:
+        for line in geojson_file:
+            line = line.strip(RECORD_SEPARATOR + '\n')
+            if line:
+                yield json.loads(line)
+    else:
+        feature_collection = json.loads(geojson_file.read())
+        for feature in feature_collection['features']:
+            yield feature
+    geojson_file.close()
+
+# Read records one at a time from a JSON array or JSON Lines file written by write_json_array or pass_through_json_array
+def read_json_records(file_path):
+    records_file = open(file_path, 'r', encoding='utf-8')
+    first_character = records_file.read(1)
+    records_file.seek(0)
+    if first_character == '[':
+        for record in json.loads(records_file.read()):
+            yield record
+    else:
+        for line in records_file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    records_file.close()
+
+# Add the file extension for the output format to a file name without one (.json or .jsonl for records, .geojson or .geojsons for GeoJSON)
+def add_file_extension(file_name, output_format='pretty', geojson=False):
+    if geojson:
+        extension = '.geojsons' if output_format == 'lines' else '.geojson'
+    else:
+        extension = '.jsonl' if output_format == 'lines' else '.json'
+    return file_name + extension
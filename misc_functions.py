@@ -3,12 +3,14 @@
 # SI 699
 
 # os documentation: https://docs.python.org/3/library/os.html#module-os
+# mmap documentation: https://docs.python.org/3/library/mmap.html
 
 # standard modules
 import os
 import sys
 import time
 import csv
+import mmap
 
 # global variables
 os_name = os.name
@@ -18,6 +20,8 @@ elif os_name == 'nt':
     PATH_DELIMITER = '\\'
 else:
     print("?? Unknown OS in use ??")
+# Number of bytes copied at a time when a memory map has to be used instead of os.sendfile
+COPY_CHUNK_SIZE = 1024 * 1024
 
 # Use time module to create a timestamp to indicate when a record was created
 def make_timestamp():
@@ -31,20 +35,15 @@ def make_timestamp():
 	)
     return timestamp
 
-# Collect all relative paths from root directory to files
+# Collect relative paths (from the current working directory) to all PDF files in the target directory, in order by file name
 def collect_relative_paths_for_files(target_directory_path):
-	root_directory = os.getcwd()
-	os.chdir(target_directory_path)
-	dir_objects = os.scandir()
 	pdf_file_paths = []
-	for dir_object in dir_objects:
-		if '.pdf' in dir_object.name:
-			absolute_path = os.path.abspath(dir_object.name)
-			relative_path = absolute_path.replace(root_directory + PATH_DELIMITER, '')
-			pdf_file_paths.append(relative_path)
-		else:
-			("** Non-PDF file present! **")
-	os.chdir(root_directory)
+	with os.scandir(target_directory_path) as dir_objects:
+		for dir_object in dir_objects:
+			if dir_object.is_file() and dir_object.name.lower().endswith('.pdf'):
+				relative_path = os.path.normpath(os.path.join(target_directory_path, dir_object.name))
+				pdf_file_paths.append(relative_path)
+	pdf_file_paths.sort()
 	return pdf_file_paths
 
 # Check if output directory has correct subdirectory; adds subdirectory if does not already exit.
@@ -89,4 +88,27 @@ def normalize_dir_path(dir_path):
     if dir_path[-1] != '/':
         return dir_path + '/'
     else:
-        return dir_path
\ No newline at end of file
+        return dir_path
+
+# Copy a range of bytes from an open file to a new file. os.sendfile copies the bytes inside the kernel, so they are never read into Python memory;
+# where it is not available, the bytes are copied from a memory map of the source file in chunks.
+def copy_byte_range(source_file, offset, length, destination_path):
+    destination_file = open(destination_path, 'wb')
+    position = offset
+    end = offset + length
+    if hasattr(os, 'sendfile'):
+        try:
+            while position < end:
+                bytes_sent = os.sendfile(destination_file.fileno(), source_file.fileno(), position, end - position)
+                if bytes_sent == 0:
+                    break
+                position += bytes_sent
+        except OSError:
+            pass
+    if position < end:
+        source_map = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with memoryview(source_map) as source_view:
+            for chunk_start in range(position, end, COPY_CHUNK_SIZE):
+                destination_file.write(source_view[chunk_start:min(chunk_start + COPY_CHUNK_SIZE, end)])
+        source_map.close()
+    destination_file.close()
@@ -0,0 +1,253 @@
+# DTE Aerial Photo Collection curation project
+# Persistent SQLite catalog of the PDF files in the collection, refreshed incrementally
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# os.scandir documentation: https://docs.python.org/3/library/os.html#os.scandir
+# sqlite3 documentation: https://docs.python.org/3/library/sqlite3.html
+
+# The catalog records every PDF file in the collection with its county, year, role (index or image), size, modification time,
+# and PDF version (from the %PDF-x.y header), along with the modification time of every directory scanned. The collection is scanned
+# one directory level at a time by a pool of threads calling os.scandir. A directory whose modification time has not changed since
+# the last scan has had no files added, removed, or renamed, so it is not listed again: its files are only checked with os.stat for
+# changes in size or modification time, and only new or changed files have their PDF headers read. Batch discovery for
+# process_collection.py and the PDF version report are then single queries against the catalog.
+
+# standard modules
+import os
+import sys
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+# global variables
+CATALOG_FILE_NAME = 'pdf_catalog.sqlite'
+CATALOG_FILE_PATH = 'output/' + CATALOG_FILE_NAME
+# Number of directories (or files) scanned at the same time; scanning mostly waits on the file system, so threads are used
+SCAN_WORKERS = 8
+# Number of bytes read from the start of a PDF to find its version header
+HEADER_SEARCH_SIZE = 1024
+
+## Functions
+
+# Open (and, if needed, create) the catalog file
+def open_catalog(catalog_file_path=CATALOG_FILE_PATH):
+    connection = sqlite3.connect(catalog_file_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    with connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS directories (directory_path TEXT PRIMARY KEY, parent_path TEXT, mtime_ns INTEGER NOT NULL)')
+        connection.execute('''CREATE TABLE IF NOT EXISTS pdf_files (relative_path TEXT PRIMARY KEY, directory_path TEXT NOT NULL, file_name TEXT NOT NULL,
+            county TEXT, year TEXT, role TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, pdf_version TEXT)''')
+        connection.execute('CREATE INDEX IF NOT EXISTS pdf_files_directories ON pdf_files (directory_path)')
+        connection.execute('CREATE INDEX IF NOT EXISTS directories_parents ON directories (parent_path)')
+    return connection
+
+# Read the PDF version from the %PDF-x.y header at the start of a file; returns None if no header is found
+def read_pdf_version(file_path):
+    try:
+        pdf_file = open(file_path, 'rb')
+        header_bytes = pdf_file.read(HEADER_SEARCH_SIZE)
+        pdf_file.close()
+    except OSError:
+        return None
+    header_position = header_bytes.find(b'%PDF-')
+    if header_position == -1:
+        return None
+    version = header_bytes[header_position + 5:header_position + 8].decode('latin-1')
+    if len(version) != 3 or not version[0].isdigit() or version[1] != '.' or not version[2].isdigit():
+        return None
+    return version
+
+# Find the county and year of a batch directory path ending in [county]/[year]; both are None for other directories
+def find_county_and_year(directory_path):
+    path_parts = directory_path.split('/')
+    if len(path_parts) >= 2 and len(path_parts[-1]) == 4 and path_parts[-1].isdigit():
+        return path_parts[-2], path_parts[-1]
+    return None, None
+
+# Find the role of a PDF file from its name: index PDFs have 'Index' in their names, like in extract_using_pypdf.py
+def find_pdf_role(file_name):
+    if 'Index' in file_name:
+        return 'index'
+    return 'image'
+
+# Normalize a directory path entered by the user, so different spellings of the same path (e.g. './input/pdf_files/' and
+# 'input/pdf_files') are stored under the same key in the catalog
+def normalize_directory_path(directory_path):
+    return os.path.normpath(directory_path).replace(os.sep, '/')
+
+# Escape the wildcard characters of a LIKE pattern ('%' and '_', e.g. in 'input/pdf_files'), using '\' as the escape character
+def escape_like_pattern(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# List one directory with os.scandir. Returns: the directory path, its modification time, its subdirectory paths,
+# and the name, size, and modification time of each PDF file in it
+def list_directory(directory_path):
+    subdirectory_paths = []
+    pdf_file_stats = []
+    directory_mtime_ns = os.stat(directory_path).st_mtime_ns
+    with os.scandir(directory_path) as dir_objects:
+        for dir_object in dir_objects:
+            if dir_object.is_dir():
+                subdirectory_paths.append(directory_path + '/' + dir_object.name)
+            elif dir_object.is_file() and dir_object.name.lower().endswith('.pdf'):
+                file_stat = dir_object.stat()
+                pdf_file_stats.append((dir_object.name, file_stat.st_size, file_stat.st_mtime_ns))
+    return directory_path, directory_mtime_ns, sorted(subdirectory_paths), pdf_file_stats
+
+# Find the modification time of a directory (changed whenever an entry in it is added, removed, or renamed)
+def find_directory_mtime(directory_path):
+    return os.stat(directory_path).st_mtime_ns
+
+# Check the size and modification time of a file already in the catalog; returns None if the file no longer exists
+def stat_file(relative_path):
+    try:
+        file_stat = os.stat(relative_path)
+    except OSError:
+        return None
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+# Scan the collection directory tree and bring the catalog up to date: new and changed PDF files are added (with their PDF versions),
+# and PDF files and directories that no longer exist are removed.
+# Returns: dictionary counting the directories listed and skipped and the files added, updated, and removed
+def refresh_catalog(collection_directory_path, catalog_file_path=CATALOG_FILE_PATH, workers=SCAN_WORKERS):
+    collection_directory_path = normalize_directory_path(collection_directory_path)
+    connection = open_catalog(catalog_file_path)
+    known_directories = dict(connection.execute('SELECT directory_path, mtime_ns FROM directories'))
+    scan_counts = {'Directories Listed': 0, 'Directories Unchanged': 0, 'Files Added': 0, 'Files Updated': 0, 'Files Removed': 0}
+    directory_rows = []
+    found_directory_paths = set()
+    changed_files = {}
+    updated_file_paths = set()
+    removed_file_paths = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Scanning one level of the directory tree at a time, so all the directories on a level are listed at the same time
+        level_directory_paths = [collection_directory_path]
+        parent_paths = {collection_directory_path: None}
+        while len(level_directory_paths) > 0:
+            next_level_directory_paths = []
+            unchanged_directory_paths = []
+            for directory_path, directory_mtime_ns in zip(level_directory_paths, executor.map(find_directory_mtime, level_directory_paths)):
+                found_directory_paths.add(directory_path)
+                directory_rows.append((directory_path, parent_paths[directory_path], directory_mtime_ns))
+                if known_directories.get(directory_path) == directory_mtime_ns:
+                    unchanged_directory_paths.append(directory_path)
+            changed_directory_paths = [path for path in level_directory_paths if path not in unchanged_directory_paths]
+
+            # Unchanged directories have the same entries as last time, so only their known files are checked for changes
+            for directory_path in unchanged_directory_paths:
+                scan_counts['Directories Unchanged'] += 1
+                for (subdirectory_path,) in connection.execute('SELECT directory_path FROM directories WHERE parent_path = ? ORDER BY directory_path', (directory_path,)):
+                    if os.path.isdir(subdirectory_path):
+                        next_level_directory_paths.append(subdirectory_path)
+                        parent_paths[subdirectory_path] = directory_path
+                known_files = connection.execute('SELECT relative_path, size, mtime_ns FROM pdf_files WHERE directory_path = ?', (directory_path,)).fetchall()
+                for (relative_path, size, mtime_ns), file_stats in zip(known_files, executor.map(stat_file, [row[0] for row in known_files])):
+                    if file_stats is None:
+                        removed_file_paths.append(relative_path)
+                    elif file_stats != (size, mtime_ns):
+                        changed_files[relative_path] = (directory_path, relative_path.split('/')[-1]) + file_stats
+                        updated_file_paths.add(relative_path)
+
+            # Changed (or new) directories are listed again
+            for directory_path, directory_mtime_ns, subdirectory_paths, pdf_file_stats in executor.map(list_directory, changed_directory_paths):
+                scan_counts['Directories Listed'] += 1
+                for subdirectory_path in subdirectory_paths:
+                    next_level_directory_paths.append(subdirectory_path)
+                    parent_paths[subdirectory_path] = directory_path
+                known_files = dict((row[0], (row[1], row[2])) for row in connection.execute('SELECT relative_path, size, mtime_ns FROM pdf_files WHERE directory_path = ?', (directory_path,)))
+                for file_name, size, mtime_ns in pdf_file_stats:
+                    relative_path = directory_path + '/' + file_name
+                    known_file_stats = known_files.pop(relative_path, None)
+                    if known_file_stats != (size, mtime_ns):
+                        changed_files[relative_path] = (directory_path, file_name, size, mtime_ns)
+                        if known_file_stats is not None:
+                            updated_file_paths.add(relative_path)
+                removed_file_paths.extend(known_files.keys())
+            level_directory_paths = next_level_directory_paths
+
+        # Reading the PDF headers of new and changed files
+        changed_file_paths = sorted(changed_files.keys())
+        pdf_versions = list(executor.map(read_pdf_version, changed_file_paths))
+
+    file_rows = []
+    for relative_path, pdf_version in zip(changed_file_paths, pdf_versions):
+        directory_path, file_name, size, mtime_ns = changed_files[relative_path]
+        county, year = find_county_and_year(directory_path)
+        file_rows.append((relative_path, directory_path, file_name, county, year, find_pdf_role(file_name), size, mtime_ns, pdf_version))
+    scan_counts['Files Updated'] = len(updated_file_paths)
+    scan_counts['Files Added'] = len(file_rows) - len(updated_file_paths)
+
+    # Directories under the collection directory that were not found have been removed, along with their files
+    removed_directory_paths = []
+    for directory_path in known_directories.keys():
+        in_collection = directory_path == collection_directory_path or directory_path.startswith(collection_directory_path + '/')
+        if in_collection and directory_path not in found_directory_paths:
+            removed_directory_paths.append(directory_path)
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO directories VALUES (?, ?, ?)', directory_rows)
+        connection.executemany('INSERT OR REPLACE INTO pdf_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', file_rows)
+        connection.executemany('DELETE FROM pdf_files WHERE relative_path = ?', [(relative_path,) for relative_path in removed_file_paths])
+        for directory_path in removed_directory_paths:
+            connection.execute('DELETE FROM directories WHERE directory_path = ?', (directory_path,))
+            scan_counts['Files Removed'] += connection.execute('DELETE FROM pdf_files WHERE directory_path = ?', (directory_path,)).rowcount
+    scan_counts['Files Removed'] += len(removed_file_paths)
+    connection.close()
+    print('** Catalog refreshed: {} **'.format(', '.join('{} {}'.format(str(count), name.lower()) for name, count in scan_counts.items())))
+    return scan_counts
+
+# Find the relative paths of all [county]/[year] directories containing PDF files under the collection directory, in order
+def find_batch_directories(collection_directory_path, catalog_file_path=CATALOG_FILE_PATH):
+    collection_directory_path = normalize_directory_path(collection_directory_path)
+    connection = open_catalog(catalog_file_path)
+    rows = connection.execute(
+        "SELECT DISTINCT directory_path FROM pdf_files WHERE year IS NOT NULL AND (directory_path = ? OR directory_path LIKE ? ESCAPE '\\') ORDER BY directory_path",
+        (collection_directory_path, escape_like_pattern(collection_directory_path) + '/%')
+    ).fetchall()
+    connection.close()
+    return [row[0] for row in rows]
+
+# Find the relative paths of the PDF files in one batch directory, in order
+def find_batch_file_paths(batch_directory_path, catalog_file_path=CATALOG_FILE_PATH):
+    connection = open_catalog(catalog_file_path)
+    rows = connection.execute('SELECT relative_path FROM pdf_files WHERE directory_path = ? ORDER BY file_name', (normalize_directory_path(batch_directory_path),)).fetchall()
+    connection.close()
+    return [row[0] for row in rows]
+
+# Report the PDF versions present in the catalog. Returns: list of dictionaries with the version, role, number of files, and total bytes
+def create_version_report(catalog_file_path=CATALOG_FILE_PATH):
+    connection = open_catalog(catalog_file_path)
+    rows = connection.execute('SELECT pdf_version, role, COUNT(*), SUM(size) FROM pdf_files GROUP BY pdf_version, role ORDER BY pdf_version, role').fetchall()
+    connection.close()
+    version_report = []
+    for pdf_version, role, file_count, total_size in rows:
+        version_report.append({'PDF Version': pdf_version, 'Role': role, 'Number of Files': file_count, 'Total Bytes': total_size})
+    return version_report
+
+# Output the PDF version report to command prompt
+def print_version_report(version_report):
+    print('\n** PDF Version Report **')
+    for report_row in version_report:
+        print('PDF {} ({} files): {} files, {} bytes'.format(str(report_row['PDF Version']), report_row['Role'], str(report_row['Number of Files']), str(report_row['Total Bytes'])))
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial PDF Catalog **")
+
+    # Setting top-level collection directory
+    try:
+        collection_directory_path = sys.argv[1]
+    except:
+        collection_directory_path = 'input/pdf_files'
+
+    # Setting catalog file path
+    try:
+        catalog_file_path = sys.argv[2]
+    except:
+        catalog_file_path = CATALOG_FILE_PATH
+
+    refresh_catalog(collection_directory_path, catalog_file_path)
+    print('** Batch directories: {} **'.format(str(len(find_batch_directories(collection_directory_path, catalog_file_path)))))
+    print_version_report(create_version_report(catalog_file_path))
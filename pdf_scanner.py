@@ -0,0 +1,357 @@
+# DTE Aerial Photo Collection curation project
+# Lightweight PDF object scanner for the collection's single-page image and index PDFs
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# PDF 1.7 specification (ISO 32000-1): https://www.adobe.com/content/dam/acom/en/devnet/pdf/pdfs/PDF32000_2008.pdf
+# (Section 7.3 describes the object syntax, and Section 7.5 describes the cross-reference table and trailer)
+
+# PyPDF2 builds a full object graph for each PDF it opens, even though the workflow only needs a few values from each file:
+# the dictionary and stream location of the image in an image PDF, and the rectangles and launch targets of the link
+# annotations in an index PDF. This module reads the cross-reference table and trailer and parses only the objects needed
+# to find those values. It handles the simple structure of the collection's PDFs; when it meets anything else (cross-reference
+# streams, object streams, encryption, or unexpected object types), it raises a ValueError so callers can fall back to PyPDF2.
+
+# standard modules
+import re
+from collections import namedtuple
+
+# global variables
+WHITESPACE = b'\x00\t\n\x0c\r '
+DELIMITERS = b'()<>[]{}/%'
+# Number of bytes read from the end of the file to find the 'startxref' keyword
+TAIL_SIZE = 1024
+# Number of bytes first read for an object or cross-reference section; the read is repeated with more bytes if the object is longer
+READ_SIZE = 4096
+MAX_READ_SIZE = 64 * 1024 * 1024
+# Page attributes inherited from parent page tree nodes
+INHERITABLE_PAGE_ATTRIBUTES = ['/Resources', '/MediaBox', '/CropBox', '/Rotate']
+ESCAPE_CHARACTERS = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f', b'(': b'(', b')': b')', b'\\': b'\\'}
+
+# Indirect reference to another object in the PDF (e.g. "4 0 R")
+PdfReference = namedtuple('PdfReference', ['idnum', 'generation'])
+
+## Functions
+
+# Skip whitespace and comments, returning the position of the next token
+def skip_whitespace(data, position):
+    while position < len(data):
+        if data[position] in WHITESPACE:
+            position += 1
+        elif data[position:position + 1] == b'%':
+            while position < len(data) and data[position] not in b'\r\n':
+                position += 1
+        else:
+            break
+    return position
+
+# Read a run of regular (non-whitespace, non-delimiter) characters, such as a number or keyword
+def read_token(data, position):
+    end = position
+    while end < len(data) and data[end] not in WHITESPACE and data[end] not in DELIMITERS:
+        end += 1
+    return data[position:end], end
+
+# Decode the bytes of a PDF string to text: UTF-16 if they start with a byte order mark, otherwise Latin-1 (close to PDFDocEncoding)
+def decode_string(string_bytes):
+    if string_bytes.startswith(b'\xfe\xff'):
+        return string_bytes[2:].decode('utf-16-be')
+    return string_bytes.decode('latin-1')
+
+# Parse a literal string, e.g. "(fm-11-100.pdf)", handling escapes and balanced parentheses
+def parse_literal_string(data, position):
+    string_bytes = bytearray()
+    depth = 1
+    position += 1
+    while True:
+        character = data[position:position + 1]
+        if character == b'':
+            raise IndexError('Unterminated string')
+        if character == b'\\':
+            next_character = data[position + 1:position + 2]
+            octal_match = re.match(rb'[0-7]{1,3}', data[position + 1:position + 4])
+            if next_character in ESCAPE_CHARACTERS:
+                string_bytes += ESCAPE_CHARACTERS[next_character]
+                position += 2
+            elif octal_match is not None:
+                string_bytes.append(int(octal_match.group(0), 8) & 0xFF)
+                position += 1 + len(octal_match.group(0))
+            elif next_character == b'\r':
+                position += 3 if data[position + 2:position + 3] == b'\n' else 2
+            elif next_character == b'\n':
+                position += 2
+            else:
+                position += 1
+            continue
+        if character == b'(':
+            depth += 1
+        elif character == b')':
+            depth -= 1
+            if depth == 0:
+                return decode_string(bytes(string_bytes)), position + 1
+        string_bytes += character
+        position += 1
+
+# Parse one PDF object starting at position. Dictionaries become dicts, arrays become lists, names become strings starting with '/'
+# (as in PyPDF2), strings become text, and indirect references become PdfReference tuples.
+# Returns: the parsed value and the position after it. Raises IndexError if the data ends before the object does.
+def parse_value(data, position):
+    position = skip_whitespace(data, position)
+    if position >= len(data):
+        raise IndexError('Unexpected end of data')
+    if data[position:position + 2] == b'<<':
+        dictionary = {}
+        position += 2
+        while True:
+            position = skip_whitespace(data, position)
+            if position >= len(data):
+                raise IndexError('Unexpected end of data')
+            if data[position:position + 2] == b'>>':
+                return dictionary, position + 2
+            key, position = parse_value(data, position)
+            if not isinstance(key, str) or not key.startswith('/'):
+                raise ValueError('Dictionary key is not a name')
+            dictionary[key], position = parse_value(data, position)
+    if data[position:position + 1] == b'[':
+        array = []
+        position += 1
+        while True:
+            position = skip_whitespace(data, position)
+            if position >= len(data):
+                raise IndexError('Unexpected end of data')
+            if data[position:position + 1] == b']':
+                return array, position + 1
+            value, position = parse_value(data, position)
+            array.append(value)
+    if data[position:position + 1] == b'(':
+        return parse_literal_string(data, position)
+    if data[position:position + 1] == b'<':
+        end = data.find(b'>', position)
+        if end == -1:
+            raise IndexError('Unterminated hexadecimal string')
+        hex_digits = re.sub(rb'\s', b'', data[position + 1:end])
+        if len(hex_digits) % 2 == 1:
+            hex_digits += b'0'
+        return decode_string(bytes.fromhex(hex_digits.decode('ascii'))), end + 1
+    if data[position:position + 1] == b'/':
+        name, end = read_token(data, position + 1)
+        name = re.sub(rb'#([0-9A-Fa-f]{2})', lambda match: bytes([int(match.group(1), 16)]), name)
+        return '/' + name.decode('latin-1'), end
+    token, end = read_token(data, position)
+    if token == b'':
+        raise ValueError('Unexpected character: {}'.format(data[position:position + 1]))
+    if token == b'true':
+        return True, end
+    if token == b'false':
+        return False, end
+    if token == b'null':
+        return None, end
+    if re.fullmatch(rb'[+-]?\d+', token):
+        # An integer followed by another integer and 'R' is an indirect reference
+        reference_match = re.match(rb'\s+(\d+)\s+R(?=[\s\x00()<>\[\]{}/%]|$)', data[end:end + 32])
+        if reference_match is not None:
+            return PdfReference(int(token), int(reference_match.group(1))), end + reference_match.end()
+        return int(token), end
+    if re.fullmatch(rb'[+-]?(\d+\.\d*|\.\d+)', token):
+        return float(token), end
+    raise ValueError('Unexpected token: {}'.format(token))
+
+# Read bytes from an open file starting at offset until parse_function succeeds, reading more bytes each time the data runs out
+def read_and_parse(pdf_file, offset, parse_function):
+    read_size = READ_SIZE
+    while True:
+        pdf_file.seek(offset)
+        data = pdf_file.read(read_size)
+        try:
+            return parse_function(data)
+        except IndexError:
+            if len(data) < read_size or read_size >= MAX_READ_SIZE:
+                raise ValueError('Object at offset {} is incomplete'.format(str(offset)))
+            read_size *= 4
+
+# Parse one cross-reference section (starting with 'xref') and the trailer dictionary that follows it.
+# Returns: dictionary mapping object numbers to (generation, offset or None for free objects), and the trailer dictionary
+def parse_cross_reference_section(data):
+    if not data.startswith(b'xref'):
+        raise ValueError('Cross-reference streams are not supported')
+    if b'trailer' not in data:
+        raise IndexError('Unexpected end of data')
+    entries = {}
+    position = 4
+    while True:
+        position = skip_whitespace(data, position)
+        if data[position:position + 7] == b'trailer':
+            trailer, position = parse_value(data, position + 7)
+            return entries, trailer
+        first_token, position = read_token(data, position)
+        position = skip_whitespace(data, position)
+        count_token, position = read_token(data, position)
+        if position >= len(data):
+            raise IndexError('Unexpected end of data')
+        first_idnum = int(first_token)
+        for entry_position in range(int(count_token)):
+            position = skip_whitespace(data, position)
+            entry = data[position:position + 18].split()
+            if len(entry) < 3 or position + 18 > len(data):
+                raise IndexError('Unexpected end of data')
+            if entry[2] == b'n':
+                entries[first_idnum + entry_position] = (int(entry[1]), int(entry[0]))
+            else:
+                entries[first_idnum + entry_position] = (int(entry[1]), None)
+            position += 18
+
+# Open a PDF for scanning by reading its cross-reference table (following /Prev links to earlier sections of updated files).
+# Argument: file object opened in binary mode. Returns: dictionary with the file, the byte offset of each object, and the trailer
+def open_document(pdf_file):
+    pdf_file.seek(0, 2)
+    file_size = pdf_file.tell()
+    pdf_file.seek(max(0, file_size - TAIL_SIZE))
+    tail = pdf_file.read()
+    startxref_position = tail.rfind(b'startxref')
+    if startxref_position == -1:
+        raise ValueError("No 'startxref' keyword found")
+    xref_offset = int(read_token(tail, skip_whitespace(tail, startxref_position + 9))[0])
+
+    offsets = {}
+    trailer = None
+    visited_offsets = set()
+    while xref_offset is not None and xref_offset not in visited_offsets:
+        visited_offsets.add(xref_offset)
+        entries, section_trailer = read_and_parse(pdf_file, xref_offset, parse_cross_reference_section)
+        if '/XRefStm' in section_trailer:
+            raise ValueError('Cross-reference streams are not supported')
+        # Sections are read from newest to oldest, so entries already found take precedence
+        for idnum, entry in entries.items():
+            offsets.setdefault(idnum, entry)
+        if trailer is None:
+            trailer = section_trailer
+        xref_offset = section_trailer.get('/Prev')
+    if '/Encrypt' in trailer:
+        raise ValueError('Encrypted PDFs are not supported')
+    return {'File': pdf_file, 'Offsets': offsets, 'Trailer': trailer}
+
+# Read an indirect object by its object number.
+# Returns: the object's value and, for stream objects, a (data offset, data length) tuple (None for other objects)
+def read_object(document, idnum):
+    generation, offset = document['Offsets'].get(idnum, (None, None))
+    if offset is None:
+        raise ValueError('Object {} is not in the cross-reference table'.format(str(idnum)))
+
+    def parse_object(data):
+        header_match = re.match(rb'\s*(\d+)\s+(\d+)\s+obj', data)
+        if header_match is None or int(header_match.group(1)) != idnum:
+            raise ValueError('Object {} not found at offset {}'.format(str(idnum), str(offset)))
+        value, position = parse_value(data, header_match.end())
+        position = skip_whitespace(data, position)
+        if data[position:position + 6] != b'stream':
+            return value, None
+        # The 'stream' keyword is followed by CRLF or LF before the data begins
+        position += 6
+        if data[position:position + 2] == b'\r\n':
+            position += 2
+        elif data[position:position + 1] in [b'\n', b'\r']:
+            position += 1
+        return value, offset + position
+
+    value, data_offset = read_and_parse(document['File'], offset, parse_object)
+    if data_offset is None:
+        return value, None
+    data_length = resolve(document, value['/Length'])
+    return value, (data_offset, data_length)
+
+# Resolve a value that may be an indirect reference to the object it refers to
+def resolve(document, value):
+    if isinstance(value, PdfReference):
+        return read_object(document, value.idnum)[0]
+    return value
+
+# Find the first page of a PDF, filling in attributes inherited from the page tree.
+# Returns: page dictionary and the number of pages in the document
+def find_first_page(document):
+    root = resolve(document, document['Trailer']['/Root'])
+    page_tree = resolve(document, root['/Pages'])
+    page_count = resolve(document, page_tree.get('/Count', 0))
+    inherited_attributes = {}
+    node = page_tree
+    while '/Kids' in node:
+        for attribute in INHERITABLE_PAGE_ATTRIBUTES:
+            if attribute in node:
+                inherited_attributes[attribute] = node[attribute]
+        kids = resolve(document, node['/Kids'])
+        if len(kids) == 0:
+            raise ValueError('Page tree has no pages')
+        node = resolve(document, kids[0])
+    page = dict(inherited_attributes)
+    page.update(node)
+    return page, page_count
+
+# Check that a stream's length is right by looking for the 'endstream' keyword after its data
+def check_stream_location(document, stream_location):
+    pdf_file = document['File']
+    pdf_file.seek(stream_location[0] + stream_location[1])
+    if not pdf_file.read(32).lstrip().startswith(b'endstream'):
+        raise ValueError('Stream length does not match the endstream keyword')
+
+# Scan an image PDF for the image XObjects on its first page.
+# Argument: file object opened in binary mode.
+# Returns: dictionary with the page count ('Page Count') and a list of (image dictionary, data offset, data length) tuples ('Images')
+def scan_image_pdf(pdf_file):
+    document = open_document(pdf_file)
+    page, page_count = find_first_page(document)
+    resources = resolve(document, page['/Resources'])
+    xobjects = resolve(document, resources['/XObject'])
+    images = []
+    for xobject_reference in xobjects.values():
+        if not isinstance(xobject_reference, PdfReference):
+            raise ValueError('Image XObject is not an indirect object')
+        xobject, stream_location = read_object(document, xobject_reference.idnum)
+        if xobject.get('/Subtype') != '/Image':
+            continue
+        if stream_location is None:
+            raise ValueError('Image XObject has no stream')
+        check_stream_location(document, stream_location)
+        image_dictionary = {}
+        for key in ['/Width', '/Height', '/ColorSpace', '/BitsPerComponent', '/Filter']:
+            image_dictionary[key] = resolve(document, xobject[key])
+        if not isinstance(image_dictionary['/ColorSpace'], str) or not isinstance(image_dictionary['/Filter'], str):
+            raise ValueError('Unexpected color space or filter')
+        images.append((image_dictionary, stream_location[0], stream_location[1]))
+    if len(images) == 0:
+        raise ValueError('No image XObjects found')
+    return {'Page Count': page_count, 'Images': images}
+
+# Scan an index PDF for the link annotations on its first page.
+# Argument: file object opened in binary mode.
+# Returns: dictionary with the page count ('Page Count'), media box ('Media Box'), and link dictionaries in the format
+# produced by extract_using_pypdf.pull_links_from_index ('Links')
+def scan_index_pdf(pdf_file):
+    document = open_document(pdf_file)
+    page, page_count = find_first_page(document)
+    media_box = [resolve(document, value) for value in resolve(document, page['/MediaBox'])]
+    links = []
+    for annotation_reference in resolve(document, page['/Annots']):
+        if not isinstance(annotation_reference, PdfReference):
+            raise ValueError('Annotation is not an indirect object')
+        annotation = read_object(document, annotation_reference.idnum)[0]
+        # Annotations without launch actions are left to PyPDF2, which reports them
+        if '/A' not in annotation:
+            raise ValueError("Annotation does not have a '/A' key")
+        action = resolve(document, annotation['/A'])
+        if '/F' not in action:
+            raise ValueError("Action does not have a '/F' key")
+        file_specification = resolve(document, action['/F'])
+        if not isinstance(file_specification, dict):
+            raise ValueError('File specification is not a dictionary')
+        file_name = resolve(document, file_specification['/F'])
+        link_coords = []
+        for value in resolve(document, annotation['/Rect']):
+            link_coords.append(float(resolve(document, value)))
+        link_dictionary = {
+            'PDF Object ID Number': annotation_reference.idnum,
+            'Linked Image File Name': file_name,
+            'Link Coordinates': link_coords,
+            'File or URI?': 'File'}
+        links.append(link_dictionary)
+    return {'Page Count': page_count, 'Media Box': media_box, 'Links': links}
@@ -0,0 +1,223 @@
+# DTE Aerial Photo Collection curation project
+# Timers, counters, and histograms recording where time goes in the workflows, and run reports summarizing them
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# cProfile documentation: https://docs.python.org/3/library/profile.html
+# Prometheus text format documentation: https://prometheus.io/docs/instrumenting/exposition_formats/
+
+# Metrics are kept in module-level dictionaries, keyed by name:
+#   counters count events (e.g. geocoding cache hits) or amounts (e.g. bytes copied),
+#   timers add up the seconds spent in a step (e.g. parsing image PDFs) and count how many times it ran, and
+#   histograms count how many observed values (e.g. the seconds taken to extract each image PDF) fall into each bucket.
+# Worker processes (like the image extraction workers in extract_using_pypdf.py) start with empty metrics, and return them with
+# take_metrics() so the main process can add them to its own with merge_metrics(). A run report combines the metrics with details
+# of the run, and is written as JSON or in the Prometheus text format. Metrics can be recorded from several threads (e.g. the
+# geocoding threads in geocoding_client.py), since updates are made while holding METRICS_LOCK.
+
+# standard modules
+import os
+import re
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+
+# global variables
+# Upper bounds of the histogram buckets for latencies, in seconds (values above the last bound are only counted in the total)
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+REPORT_FORMATS = ['json', 'prometheus']
+PROMETHEUS_PREFIX = 'dte_aerial_'
+# Number of functions listed when printing profiling results
+PROFILE_STAT_COUNT = 25
+# Ratios added to run reports: name, counter in the numerator, and counters added together in the denominator
+REPORT_RATIOS = [
+    ('Geocoding Cache Hit Ratio', 'Geocoding Cache Hits', ['Geocoding Cache Hits', 'Geocoding Cache Misses']),
+    ('Scanner Fallback Ratio', 'Scanner Fallbacks', ['Image PDFs Extracted', 'Index PDFs Read'])
+]
+
+METRICS = {'Counters': {}, 'Timers': {}, 'Histograms': {}}
+METRICS_PROCESS_ID = os.getpid()
+METRICS_LOCK = threading.RLock()
+
+## Functions
+
+# Return the metrics for the current process. Metrics inherited from a parent process (e.g. by a forked pool worker) are discarded,
+# since the parent reports them itself.
+def get_metrics():
+    global METRICS, METRICS_PROCESS_ID
+    if METRICS_PROCESS_ID != os.getpid():
+        METRICS = {'Counters': {}, 'Timers': {}, 'Histograms': {}}
+        METRICS_PROCESS_ID = os.getpid()
+    return METRICS
+
+# Clear all metrics (e.g. before processing another batch in the same process)
+def reset_metrics():
+    global METRICS, METRICS_PROCESS_ID
+    METRICS = {'Counters': {}, 'Timers': {}, 'Histograms': {}}
+    METRICS_PROCESS_ID = os.getpid()
+
+# Return the metrics collected so far and clear them, so they can be sent from a worker process to the main process
+def take_metrics():
+    with METRICS_LOCK:
+        metrics = get_metrics()
+        reset_metrics()
+    return metrics
+
+# Add amount to a counter
+def increment_counter(name, amount=1):
+    with METRICS_LOCK:
+        counters = get_metrics()['Counters']
+        counters[name] = counters.get(name, 0) + amount
+
+# Create an empty histogram with the given bucket bounds
+def create_histogram(buckets=LATENCY_BUCKETS):
+    return {'Count': 0, 'Sum': 0.0, 'Min': None, 'Max': None, 'Bucket Bounds': list(buckets), 'Bucket Counts': [0] * len(buckets)}
+
+# Add a value to a histogram, counting it in the first bucket whose bound is at least the value
+def observe_value(name, value, buckets=LATENCY_BUCKETS):
+    with METRICS_LOCK:
+        histograms = get_metrics()['Histograms']
+        if name not in histograms:
+            histograms[name] = create_histogram(buckets)
+        histogram = histograms[name]
+        histogram['Count'] += 1
+        histogram['Sum'] += value
+        histogram['Min'] = value if histogram['Min'] is None else min(histogram['Min'], value)
+        histogram['Max'] = value if histogram['Max'] is None else max(histogram['Max'], value)
+        for bucket_position, bucket_bound in enumerate(histogram['Bucket Bounds']):
+            if value <= bucket_bound:
+                histogram['Bucket Counts'][bucket_position] += 1
+                break
+
+# Add seconds spent in a step to a timer, also adding them to a latency histogram if histogram_name is given
+def record_time(name, seconds, histogram_name=None):
+    with METRICS_LOCK:
+        timers = get_metrics()['Timers']
+        if name not in timers:
+            timers[name] = {'Count': 0, 'Total Seconds': 0.0, 'Max Seconds': 0.0}
+        timer = timers[name]
+        timer['Count'] += 1
+        timer['Total Seconds'] += seconds
+        timer['Max Seconds'] = max(timer['Max Seconds'], seconds)
+        if histogram_name is not None:
+            observe_value(histogram_name, seconds)
+
+# Time the statements in a with block, adding the seconds spent to a timer (and, if histogram_name is given, a latency histogram)
+@contextlib.contextmanager
+def time_block(name, histogram_name=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start, histogram_name)
+
+# Add metrics from another process (returned by take_metrics) to the metrics of this process
+def merge_metrics(other_metrics):
+    metrics = get_metrics()
+    for name, amount in other_metrics['Counters'].items():
+        metrics['Counters'][name] = metrics['Counters'].get(name, 0) + amount
+    for name, other_timer in other_metrics['Timers'].items():
+        if name not in metrics['Timers']:
+            metrics['Timers'][name] = {'Count': 0, 'Total Seconds': 0.0, 'Max Seconds': 0.0}
+        timer = metrics['Timers'][name]
+        timer['Count'] += other_timer['Count']
+        timer['Total Seconds'] += other_timer['Total Seconds']
+        timer['Max Seconds'] = max(timer['Max Seconds'], other_timer['Max Seconds'])
+    for name, other_histogram in other_metrics['Histograms'].items():
+        if name not in metrics['Histograms']:
+            metrics['Histograms'][name] = create_histogram(other_histogram['Bucket Bounds'])
+        histogram = metrics['Histograms'][name]
+        histogram['Count'] += other_histogram['Count']
+        histogram['Sum'] += other_histogram['Sum']
+        for value in [other_histogram['Min'], other_histogram['Max']]:
+            if value is not None:
+                histogram['Min'] = value if histogram['Min'] is None else min(histogram['Min'], value)
+                histogram['Max'] = value if histogram['Max'] is None else max(histogram['Max'], value)
+        for bucket_position, bucket_count in enumerate(other_histogram['Bucket Counts']):
+            histogram['Bucket Counts'][bucket_position] += bucket_count
+
+# Create a run report from the current metrics, with ratios calculated from the counters and any details of the run (e.g. the batch name)
+def create_run_report(run_details=None):
+    if run_details is None:
+        run_details = {}
+    metrics = get_metrics()
+    ratios = {}
+    for ratio_name, numerator_name, denominator_names in REPORT_RATIOS:
+        denominator = sum(metrics['Counters'].get(denominator_name, 0) for denominator_name in denominator_names)
+        if denominator > 0:
+            ratios[ratio_name] = metrics['Counters'].get(numerator_name, 0) / denominator
+    run_report = {
+        'Run Details': run_details,
+        'Counters': metrics['Counters'],
+        'Timers': metrics['Timers'],
+        'Histograms': metrics['Histograms'],
+        'Ratios': ratios
+    }
+    return run_report
+
+# Convert a metric name into a Prometheus metric name (e.g. 'Image PDF Latency' becomes 'dte_aerial_image_pdf_latency')
+def make_prometheus_name(name):
+    return PROMETHEUS_PREFIX + re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+# Format a run report in the Prometheus text format: counters as counters, timers as summaries of seconds,
+# histograms as histograms with cumulative buckets, and ratios as gauges
+def format_prometheus_report(run_report):
+    lines = []
+    for name, amount in run_report['Counters'].items():
+        metric_name = make_prometheus_name(name) + '_total'
+        lines.append('# TYPE {} counter'.format(metric_name))
+        lines.append('{} {}'.format(metric_name, amount))
+    for name, timer in run_report['Timers'].items():
+        metric_name = make_prometheus_name(name) + '_seconds'
+        lines.append('# TYPE {} summary'.format(metric_name))
+        lines.append('{}_sum {}'.format(metric_name, repr(timer['Total Seconds'])))
+        lines.append('{}_count {}'.format(metric_name, timer['Count']))
+    for name, histogram in run_report['Histograms'].items():
+        metric_name = make_prometheus_name(name) + '_seconds'
+        lines.append('# TYPE {} histogram'.format(metric_name))
+        cumulative_count = 0
+        for bucket_bound, bucket_count in zip(histogram['Bucket Bounds'], histogram['Bucket Counts']):
+            cumulative_count += bucket_count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(metric_name, bucket_bound, cumulative_count))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric_name, histogram['Count']))
+        lines.append('{}_sum {}'.format(metric_name, repr(histogram['Sum'])))
+        lines.append('{}_count {}'.format(metric_name, histogram['Count']))
+    for name, ratio in run_report['Ratios'].items():
+        metric_name = make_prometheus_name(name)
+        lines.append('# TYPE {} gauge'.format(metric_name))
+        lines.append('{} {}'.format(metric_name, repr(ratio)))
+    return '\n'.join(lines) + '\n'
+
+# Make the file name for a run report, with an extension for the report format (e.g. macomb_1961_run_report.prom)
+def make_report_file_name(report_name, report_format='json'):
+    if report_format == 'prometheus':
+        return report_name + '.prom'
+    return report_name + '.json'
+
+# Write a run report to a file as JSON or in the Prometheus text format
+def write_run_report(file_path, run_report, report_format='json'):
+    report_file = open(file_path, 'w', encoding='utf-8')
+    if report_format == 'prometheus':
+        report_file.write(format_prometheus_report(run_report))
+    else:
+        report_file.write(json.dumps(run_report, indent=4))
+    report_file.close()
+
+# Run a function with cProfile, writing the profiling data to profile_file_path (for use with pstats or a viewer like snakeviz)
+# and printing the functions with the most cumulative time. Returns: the function's result
+def run_with_profiling(profile_file_path, function, *args, **kwargs):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_file_path)
+    print('\n** Profiling Results (written to {}) **'.format(profile_file_path))
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_STAT_COUNT)
+    return result
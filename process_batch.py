@@ -10,32 +10,60 @@ import sys
 import json
 import csv
 import copy
+import time
 
 # local modules
 import extract_using_pypdf
+import extraction_backends
 import georeference_links
+import geocoding_cache
+import columnar_export
+import image_derivatives
+import json_streaming
 import misc_functions
+import pipeline_metrics
 
 # global variables
 PATH_DELIMITER = misc_functions.PATH_DELIMITER
 MANUAL_PAIRS_FILENAME = 'manual_pairs.csv'
 FILES_WITHOUT_LINKS_FILENAME = 'files_without_links.csv'
+# Number of worker processes used to extract images (None uses one per CPU; 1 extracts serially)
+EXTRACTION_WORKERS = None
+# Name of the extraction backend to use, from extraction_backends.py ('scanner', 'pypdf2', or 'poppler')
+EXTRACTION_BACKEND = 'scanner'
+# Only re-extract and re-georeference PDFs that are new or modified since the last 'process' run
+INCREMENTAL_PROCESSING = True
+# Format of output files: 'pretty' (indented JSON), 'compact' (JSON without whitespace), or 'lines' (JSON Lines records and GeoJSONSeq features)
+OUTPUT_FORMAT = 'pretty'
+# Format of the run report of timers, counters, and histograms written for each batch: 'json', 'prometheus', or None (no report)
+METRICS_REPORT_FORMAT = 'json'
+# Run the workflow under cProfile, writing profiling data to the output directory
+PROFILING = False
+# Format of the columnar tables written alongside the JSON output files and read back in 'load' mode: 'parquet', 'arrow', or None (JSON only)
+COLUMNAR_FORMAT = None
+# Create thumbnails and Deep Zoom tile pyramids for the extracted JPEGs (see image_derivatives.py)
+CREATE_DERIVATIVES = False
+# Georeference the full link boxes, adding footprint polygons to image records and GeoJSON output (see georeference_links.py)
+FOOTPRINTS = georeference_links.FOOTPRINTS
 
 ## Functions
 
 # Using functions from georeference_links.py, calculate geocoordinates and county for an image file based on the file identifier's coordinates in the index PDF
-# Arguments: PDF coordinate pair (pair or list) and dictionary of formula coefficients (dictionary). Returns: dictionary with real-world coordinates (dictionary) and name of county (string)
-def collect_arcgis_info_for_coordinate_pair(xy_pair, constants):
+# Arguments: PDF coordinate pair (pair or list) and 3x3 transform matrix (list of lists). Returns: dictionary with real-world coordinates (dictionary) and name of county (string)
+def collect_arcgis_info_for_coordinate_pair(xy_pair, transform_matrix):
     geocoordinates = {}
-    longitude = georeference_links.convert_between_systems(float(xy_pair[0]), constants['X Slope'], constants['X Intercept'])
-    latitude = georeference_links.convert_between_systems(float(xy_pair[1]), constants['Y Slope'], constants['Y Intercept'])
+    longitude, latitude = georeference_links.convert_pdf_coordinates(float(xy_pair[0]), float(xy_pair[1]), transform_matrix)
+    longitude = float(longitude)
+    latitude = float(latitude)
     geocoordinates['Longitude'] = longitude
     geocoordinates['Latitude'] = latitude
     current_county = georeference_links.check_county_using_geocoordinates([longitude, latitude])
     return geocoordinates, current_county
 
 # Use image, index, and link metadata to create full records for each image file
-def create_full_record(base_record, image_record, location_input, match_mode='identifier'):
+# derivative_record, if given, describes the thumbnail and tile pyramid created from the image file.
+def create_full_record(base_record, image_record, location_input, match_mode='identifier', derivative_record=None):
+    record_start = time.perf_counter()
     full_image_record = copy.deepcopy(base_record)
     full_image_record['File Name'] = image_record['Created Image File Name']
     full_image_record['Descriptive']['File Identifier'] = image_record['Image File Name'].replace('.pdf', '')
@@ -48,6 +76,8 @@ def create_full_record(base_record, image_record, location_input, match_mode='id
             'Longitude': georeferenced_link_record['Longitude'],
             'Latitude': georeferenced_link_record['Latitude']
         }
+        if 'Footprint' in georeferenced_link_record:
+            full_image_record['Descriptive']['ArcGIS Footprint'] = georeferenced_link_record['Footprint']
     elif match_mode == 'visual':
         geocoordinates, current_county = location_input
         full_image_record['Descriptive']['ArcGIS Current County'] = current_county
@@ -82,6 +112,12 @@ def create_full_record(base_record, image_record, location_input, match_mode='id
     full_image_record['Preservation']['Match Details'] = match_details
     full_image_record['Preservation']['PDF Source Relative Path'] = image_record['Source Relative Path']
     full_image_record['Preservation']['Date and Time Created'] = misc_functions.make_timestamp()
+    # Records extracted before checksums were recorded have no fixity values
+    full_image_record['Preservation']['Fixity'] = image_record.get('Fixity')
+    full_image_record['Preservation']['JPEG Check'] = image_record.get('JPEG Check')
+    if derivative_record is not None:
+        full_image_record['Derivatives'] = dict(derivative_record)
+    pipeline_metrics.record_time('Record Matching', time.perf_counter() - record_start)
     return full_image_record
 
 # Create a base record with metadata common to all images associated with an index file
@@ -103,39 +139,70 @@ def create_base_record(batch_metadata):
     }
     return base_record
 
+# Crosswalk one full record to a GeoJSON feature
+# Argument: record dictionary. Returns: GeoJSON-formatted dictionary describing a GIS point feature for the image.
+def crosswalk_record_to_geojson_feature(record):
+    descriptive_metadata = record['Descriptive']
+    geocoordinates = descriptive_metadata['ArcGIS Geocoordinates']
+    geojson_dict = {}
+    geojson_dict['type'] = 'Feature'
+    geojson_dict['geometry'] = {}
+    geojson_dict['geometry']['type'] = 'Point'
+    geojson_dict['geometry']['coordinates'] = [geocoordinates['Longitude'], geocoordinates['Latitude']]
+    geojson_dict['properties'] = {
+        'file_identifier': descriptive_metadata['File Identifier'],
+        'county': descriptive_metadata['ArcGIS Current County'],
+        'year': descriptive_metadata['Year']
+    }
+    return geojson_dict
+
+# Crosswalk the footprint of one full record to a GeoJSON feature, with the same properties as its point feature
+# Argument: record dictionary with an 'ArcGIS Footprint'. Returns: GeoJSON-formatted dictionary describing a GIS polygon feature for the image.
+def crosswalk_record_to_footprint_feature(record):
+    geojson_dict = crosswalk_record_to_geojson_feature(record)
+    geojson_dict['geometry'] = {
+        'type': 'Polygon',
+        'coordinates': [record['Descriptive']['ArcGIS Footprint']]
+    }
+    return geojson_dict
+
+# Crosswalk full records to GeoJSON features one at a time: a point feature for each record, followed by a polygon feature for its footprint if it has one
+def generate_geojson_features(records):
+    for record in records:
+        yield crosswalk_record_to_geojson_feature(record)
+        if record['Descriptive'].get('ArcGIS Footprint') is not None:
+            yield crosswalk_record_to_footprint_feature(record)
+
 # Use full records to create a GeoJSON file for output
-# Argument: list of record dictionaries. Returns: GeoJSON-formatted dictionary describing a GIS point feature for each image.
+# Argument: list of record dictionaries. Returns: GeoJSON-formatted dictionary describing a GIS point feature (and any footprint polygon) for each image.
 def crosswalk_to_geojson(records):
-    geojson_dicts = []
-    for record in records:
-        descriptive_metadata = record['Descriptive']
-        geocoordinates = descriptive_metadata['ArcGIS Geocoordinates']
-        geojson_dict = {}
-        geojson_dict['type'] = 'Feature'
-        geojson_dict['geometry'] = {}
-        geojson_dict['geometry']['type'] = 'Point'
-        geojson_dict['geometry']['coordinates'] = [geocoordinates['Longitude'], geocoordinates['Latitude']]
-        geojson_dict['properties'] = {
-            'file_identifier': descriptive_metadata['File Identifier'],
-            'county': descriptive_metadata['ArcGIS Current County'],
-            'year': descriptive_metadata['Year']
-        }
-        geojson_dicts.append(geojson_dict)
+    geojson_dicts = list(generate_geojson_features(records))
     geojson_wrapper = {}
     geojson_wrapper['type'] = 'FeatureCollection'
     geojson_wrapper['features'] = geojson_dicts
     return geojson_wrapper
 
-# Fetch a link record from all the link records based on its PDF Object ID Number
-def find_link_record_with_id(id_num, link_records):
+# Index link records by linked image identifier (with a list of link records for each identifier, since several links can point to the same image)
+# and by PDF Object ID Number. Returns: the two index dictionaries
+def index_link_records(link_records):
+    link_records_by_identifier = {}
+    link_records_by_id = {}
     for link_record in link_records:
-        if link_record['PDF Object ID Number'] == int(id_num):
-            return link_record
-    return None
-
-# Take previous records, combine them, and accumulate a list of full records
-def match_and_combine_records(batch_metadata, georeferenced_link_data, manual_pairs, files_without_links):
+        link_records_by_identifier.setdefault(link_record['Linked Image PDF Identifier'], []).append(link_record)
+        link_records_by_id[link_record['PDF Object ID Number']] = link_record
+    return link_records_by_identifier, link_records_by_id
+
+# Fetch a link record based on its PDF Object ID Number, using link records indexed by index_link_records
+def find_link_record_with_id(id_num, link_records_by_id):
+    return link_records_by_id.get(int(id_num))
+
+# Take previous records and combine them, yielding each full record as soon as it is created.
+# Whether any match issues occurred and the number of full records created are added to match_report as records are generated.
+# derivative_records maps created image file names to the derivative records from image_derivatives.py, if derivatives were created.
+def generate_full_records(batch_metadata, georeferenced_link_data, manual_pairs, files_without_links, match_report, derivative_records=None):
     print('\n** Image and Link Matching **')
+    if derivative_records is None:
+        derivative_records = {}
 
     # Pull image records out of batch_metadata
     image_records = batch_metadata['Image Records']
@@ -144,42 +211,48 @@ def match_and_combine_records(batch_metadata, georeferenced_link_data, manual_pa
     base_record = create_base_record(batch_metadata)
 
     link_records = georeferenced_link_data['Georeferenced Link Records']
-    constants = georeferenced_link_data['Georeferencing Metadata']['Constants']
+    transform_matrix = georeference_links.find_transform_matrix(georeferenced_link_data['Georeferencing Metadata'])
 
-    full_image_records = []
-    matched_link_record_ids = []
-    match_issues = False
+    link_records_by_identifier, link_records_by_id = index_link_records(link_records)
+
+    matched_link_record_ids = set()
+    match_report['Match Issues'] = False
+    match_report['Number of Complete Image Records'] = 0
 
     for image_record in image_records:
         file_identifier = image_record['Image File Name'].replace('.pdf', '')
+        derivative_record = derivative_records.get(image_record['Created Image File Name'])
         # If an image and link match has been made manually in manual_pairs.csv, make the match
         if file_identifier in manual_pairs.keys():
-            link_record_found = find_link_record_with_id(manual_pairs[file_identifier], link_records)
-            full_image_record = create_full_record(base_record, image_record, link_record_found, 'manual')
-            full_image_records.append(full_image_record)
-            matched_link_record_ids.append(link_record_found['PDF Object ID Number'])
+            link_record_found = find_link_record_with_id(manual_pairs[file_identifier], link_records_by_id)
+            full_image_record = create_full_record(base_record, image_record, link_record_found, 'manual', derivative_record)
+            match_report['Number of Complete Image Records'] += 1
+            pipeline_metrics.increment_counter('Records Matched Manually')
+            yield full_image_record
+            matched_link_record_ids.add(link_record_found['PDF Object ID Number'])
         # If an image had no accompanying link but coordinates were visually collected, create location metadata
         elif file_identifier in files_without_links.keys():
             visual_coordinate_pair = files_without_links[file_identifier]
-            arcgis_location_dict = collect_arcgis_info_for_coordinate_pair(visual_coordinate_pair, constants)
-            full_image_record = create_full_record(base_record, image_record, arcgis_location_dict, 'visual')
-            full_image_records.append(full_image_record)
+            arcgis_location_dict = collect_arcgis_info_for_coordinate_pair(visual_coordinate_pair, transform_matrix)
+            full_image_record = create_full_record(base_record, image_record, arcgis_location_dict, 'visual', derivative_record)
+            match_report['Number of Complete Image Records'] += 1
+            pipeline_metrics.increment_counter('Records Located Visually')
+            yield full_image_record
         else:
             # Otherwise find all links pointing to the same image file
-            matching_link_records = []
-            for link_record in link_records:
-                if link_record['Linked Image PDF Identifier'] == file_identifier:
-                    matching_link_records.append(link_record)
+            matching_link_records = link_records_by_identifier.get(file_identifier, [])
             # If there is exactly one link, make the match
             if len(matching_link_records) == 1:
                 matching_link_record = matching_link_records[0]
-                full_image_record = create_full_record(base_record, image_record, matching_link_record)
-                full_image_records.append(full_image_record)
-                matched_link_record_ids.append(matching_link_record['PDF Object ID Number'])
+                full_image_record = create_full_record(base_record, image_record, matching_link_record, 'identifier', derivative_record)
+                match_report['Number of Complete Image Records'] += 1
+                pipeline_metrics.increment_counter('Records Matched by Identifier')
+                yield full_image_record
+                matched_link_record_ids.add(matching_link_record['PDF Object ID Number'])
             else:
                 # Otherwise, report the match issue
-                if not match_issues:
-                    match_issues = True
+                match_report['Match Issues'] = True
+                pipeline_metrics.increment_counter('Match Failures')
                 if len(matching_link_records) == 0:
                     print('-- No link records found for file identifier: {} --'.format(file_identifier))
                 else:
@@ -187,40 +260,159 @@ def match_and_combine_records(batch_metadata, georeferenced_link_data, manual_pa
                     for matching_link_record in matching_link_records:
                         print('     -- PDF Object ID Number: {} --'.format(matching_link_record['PDF Object ID Number']))
     # Checking if any link records were not matched
-    link_record_object_ids = []
-    for link_record in link_records:
-        link_record_object_ids.append(link_record['PDF Object ID Number'])
     unmatched_link_record_ids = []
-    for link_record_object_id in link_record_object_ids:
-        if link_record_object_id not in matched_link_record_ids:
-            unmatched_link_record_ids.append(link_record_object_id)
+    for link_record in link_records:
+        if link_record['PDF Object ID Number'] not in matched_link_record_ids:
+            unmatched_link_record_ids.append(link_record['PDF Object ID Number'])
     if len(unmatched_link_record_ids) > 0:
         print('?? {} link records were not matched ??'.format(len(unmatched_link_record_ids)))
         for unmatched_link_record_id in unmatched_link_record_ids:
             print('     ?? PDF Object ID Number: {} ??'.format(unmatched_link_record_id))
-    return (full_image_records, match_issues)
 
-# Prepare data by running extraction and georeferencing workflows or by loading previous output files
-def process_or_load(mode, batch_directory_path, output_directory_path, county_year_combo):
+# Take previous records, combine them, and accumulate a list of full records
+def match_and_combine_records(batch_metadata, georeferenced_link_data, manual_pairs, files_without_links):
+    match_report = {}
+    full_image_records = list(generate_full_records(batch_metadata, georeferenced_link_data, manual_pairs, files_without_links, match_report))
+    return (full_image_records, match_report['Match Issues'])
+
+# Prepare data by running extraction and georeferencing workflows or by loading previous output files.
+# When columnar_format is set, the results are also written as columnar tables in 'process' mode, and are loaded from those tables in 'load' mode.
+# When footprints is True, link boxes are georeferenced as footprint polygons in 'process' mode.
+def process_or_load(mode, batch_directory_path, output_directory_path, county_year_combo, extraction_workers=EXTRACTION_WORKERS, output_format=OUTPUT_FORMAT, extraction_backend=EXTRACTION_BACKEND, columnar_format=COLUMNAR_FORMAT, footprints=FOOTPRINTS):
     batch_metadata_file_name = county_year_combo + '_batch_metadata.json'
     georeferenced_links_file_name = county_year_combo + '_georeferenced_links.json'
     if mode == 'process':
         print('~~ Executing extraction and georeferencing workflows ~~')
         pdf_file_paths = misc_functions.collect_relative_paths_for_files(batch_directory_path)
-        batch_metadata = extract_using_pypdf.run_pypdf2_workflow(pdf_file_paths, output_directory_path + 'pypdf2/', batch_metadata_file_name)
-        georeferenced_link_data = georeference_links.run_georeferencing_workflow(output_directory_path + 'pypdf2/' + batch_metadata_file_name, georeferenced_links_file_name)
+        backend = extraction_backends.get_backend(extraction_backend)
+        with pipeline_metrics.time_block('Extraction'):
+            batch_metadata = extract_using_pypdf.run_pypdf2_workflow(pdf_file_paths, output_directory_path + 'pypdf2/', batch_metadata_file_name, extraction_workers, INCREMENTAL_PROCESSING, output_format, backend)
+        with pipeline_metrics.time_block('Georeferencing'):
+            georeferenced_link_data = georeference_links.run_georeferencing_workflow(output_directory_path + 'pypdf2/' + batch_metadata_file_name, georeferenced_links_file_name, output_directory_path, INCREMENTAL_PROCESSING, output_format, footprints)
+        if columnar_format is not None:
+            with pipeline_metrics.time_block('Columnar Export'):
+                columnar_export.write_batch_metadata(batch_metadata, output_directory_path, batch_directory_path, columnar_format)
+                columnar_export.write_georeferenced_link_data(georeferenced_link_data, output_directory_path, batch_directory_path, columnar_format)
+    elif mode == 'load' and columnar_format is not None:
+        print('~~ Loading data from previous workflow executions ({} tables) ~~'.format(columnar_format))
+        with pipeline_metrics.time_block('Loading'):
+            batch_metadata = columnar_export.read_batch_metadata(output_directory_path, batch_directory_path, columnar_format)
+            georeferenced_link_data = columnar_export.read_georeferenced_link_data(output_directory_path, batch_directory_path, columnar_format)
     elif mode == 'load':
         print('~~ Loading data from previous workflow executions ~~')
-        batch_metadata_file = open(output_directory_path + 'pypdf2/' + batch_metadata_file_name, 'r', encoding='utf-8')
-        batch_metadata = json.loads(batch_metadata_file.read())
-        batch_metadata_file.close()
-        georeferenced_links_file = open(output_directory_path + georeferenced_links_file_name, 'r', encoding='utf-8')
-        georeferenced_link_data = json.loads(georeferenced_links_file.read())
-        georeferenced_links_file.close()
+        with pipeline_metrics.time_block('Loading'):
+            batch_metadata_file = open(output_directory_path + 'pypdf2/' + batch_metadata_file_name, 'r', encoding='utf-8')
+            batch_metadata = json.loads(batch_metadata_file.read())
+            batch_metadata_file.close()
+            georeferenced_links_file = open(output_directory_path + georeferenced_links_file_name, 'r', encoding='utf-8')
+            georeferenced_link_data = json.loads(georeferenced_links_file.read())
+            georeferenced_links_file.close()
     else:
         print("-- Invalid mode input --")
     return (batch_metadata, georeferenced_link_data)
 
+# Create a string combining the county and year from the last two directories of a batch directory path (e.g. macomb_1961)
+def make_county_year_combo(batch_directory_path):
+    return '_'.join(misc_functions.normalize_dir_path(batch_directory_path).split('/')[-3:-1])
+
+# Set up manual pairs dictionary, with image identifiers as keys and PDF Object ID numbers as their associated values
+def create_manual_pairs_dict(manual_pairs_csv_data, index_file_name):
+    manual_pairs = {}
+    for manual_pair_dict in manual_pairs_csv_data:
+        if manual_pair_dict['Index File Name'] == index_file_name:
+            manual_pairs[manual_pair_dict['Image Identifier']] = manual_pair_dict['PDF Object ID Number']
+    return manual_pairs
+
+# Set up files without links dictionary, with image identifiers as keys and x and y coordinate tuples as values
+def create_files_without_links_dict(files_without_links_csv_data, index_file_name):
+    files_without_links = {}
+    for file_without_link_dict in files_without_links_csv_data:
+        if file_without_link_dict['Index File Name'] == index_file_name:
+            files_without_links[file_without_link_dict['File Identifier']] = (file_without_link_dict['GIMP X Coordinate'], file_without_link_dict['GIMP Y Coordinate'])
+    return files_without_links
+
+# Make the file names for the image records and GeoJSON output files of a batch, with extensions for the output format
+def make_output_file_names(county_year_combo, output_format=OUTPUT_FORMAT):
+    full_image_records_file_name = json_streaming.add_file_extension('dte_aerial_{}_image_records'.format(county_year_combo), output_format)
+    geojson_file_name = json_streaming.add_file_extension(county_year_combo + '_image_locations', output_format, geojson=True)
+    return full_image_records_file_name, geojson_file_name
+
+# Run the full workflow for one county/year batch directory and write its image records and GeoJSON files.
+# Full records are written to both files as they are created, so they are never all held in memory.
+# The manual_pairs.csv and files_without_links.csv data are passed in so that callers processing many batches only load them once.
+# Returns: dictionary summarizing the batch
+def run_batch_workflow(mode, batch_directory_path, output_directory_path, manual_pairs_csv_data, files_without_links_csv_data, extraction_workers=EXTRACTION_WORKERS, output_format=OUTPUT_FORMAT, extraction_backend=EXTRACTION_BACKEND, metrics_report_format=METRICS_REPORT_FORMAT, columnar_format=COLUMNAR_FORMAT, create_derivatives=CREATE_DERIVATIVES, footprints=FOOTPRINTS):
+    # Starting with empty metrics, so the run report only covers this batch
+    pipeline_metrics.reset_metrics()
+    batch_start = time.perf_counter()
+
+    # Creating or loading image records and georeferenced link records
+    county_year_combo = make_county_year_combo(batch_directory_path)
+    batch_metadata, georeferenced_link_data = process_or_load(mode, batch_directory_path, output_directory_path, county_year_combo, extraction_workers, output_format, extraction_backend, columnar_format, footprints)
+
+    index_file_name = batch_metadata['Index Records'][0]['Index File Name']
+    manual_pairs = create_manual_pairs_dict(manual_pairs_csv_data, index_file_name)
+    files_without_links = create_files_without_links_dict(files_without_links_csv_data, index_file_name)
+
+    # Creating thumbnails and tile pyramids for new or changed JPEGs, or loading the records of those created by the last 'process' run
+    derivative_records = {}
+    if create_derivatives and mode == 'process':
+        with pipeline_metrics.time_block('Derivatives'):
+            derivative_records = image_derivatives.run_derivative_workflow(batch_metadata['Image Records'], output_directory_path + 'pypdf2/', county_year_combo, extraction_workers)
+    elif create_derivatives:
+        derivative_records = image_derivatives.load_derivative_records(output_directory_path + 'pypdf2/', county_year_combo)
+
+    # Running matching algorithm, writing each full record to the records file and its crosswalked GeoJSON feature to the GeoJSON file
+    full_image_records_file_name, geojson_file_name = make_output_file_names(county_year_combo, output_format)
+    match_report = {}
+    with pipeline_metrics.time_block('Matching and Output'):
+        full_image_records = generate_full_records(batch_metadata, georeferenced_link_data, manual_pairs, files_without_links, match_report, derivative_records)
+        full_image_records_file = open(output_directory_path + full_image_records_file_name, 'w', encoding='utf-8')
+        full_image_records = json_streaming.pass_through_json_array(full_image_records_file, full_image_records, output_format)
+        if columnar_format is not None:
+            full_image_records = columnar_export.pass_through_image_records(full_image_records, output_directory_path, batch_directory_path, columnar_format)
+        geojson_features = generate_geojson_features(full_image_records)
+        json_streaming.write_geojson_features(output_directory_path + geojson_file_name, geojson_features, output_format)
+        full_image_records_file.close()
+
+    # Write any geocoding results fetched during matching to the cache file
+    geocoding_cache.flush_cache()
+
+    batch_summary = {
+        'County Year Combo': county_year_combo,
+        'Batch Directory Path': batch_directory_path,
+        'Index File Name': index_file_name,
+        'Match Issues': match_report['Match Issues'],
+        'Number of Image Records': len(batch_metadata['Image Records']),
+        'Number of Link Records': len(batch_metadata['Index Records'][0]['Links']),
+        'Number of Complete Image Records': match_report['Number of Complete Image Records'],
+        'GeoJSON File Name': geojson_file_name
+    }
+
+    # Writing the run report of timers, counters, and histograms for the batch
+    pipeline_metrics.record_time('Batch Workflow', time.perf_counter() - batch_start)
+    if metrics_report_format is not None:
+        run_report_file_name = pipeline_metrics.make_report_file_name(county_year_combo + '_run_report', metrics_report_format)
+        run_details = {'Mode': mode, 'Extraction Backend': extraction_backend, 'Output Format': output_format, 'Columnar Format': columnar_format, 'Footprints': footprints}
+        run_details.update(batch_summary)
+        pipeline_metrics.write_run_report(output_directory_path + run_report_file_name, pipeline_metrics.create_run_report(run_details), metrics_report_format)
+        batch_summary['Run Report File Name'] = run_report_file_name
+    return batch_summary
+
+# Output a report on a batch summary to command prompt
+def print_batch_summary(batch_summary):
+    print('\n** Script Results Summary **')
+    if batch_summary['Match Issues']:
+        print('-- One or more matches failed, or one or more image records had multiple matches --')
+        print('-- Investigate and add data to manual_pairs.csv and files_without_links.csv --')
+    else:
+        print('++ No match issues occurred ++')
+    print('Number of image records after extraction: ' + str(batch_summary['Number of Image Records']))
+    print('Number of link records after extraction: ' + str(batch_summary['Number of Link Records']))
+    print('Number of complete image records created: ' + str(batch_summary['Number of Complete Image Records']))
+    if 'Run Report File Name' in batch_summary:
+        print('Run report: ' + batch_summary['Run Report File Name'])
+
 ## Main Program
 
 if __name__=="__main__":
@@ -244,50 +436,73 @@ if __name__=="__main__":
         # proof of concept directory
         output_directory_path = 'output/'
 
-    # Create subdirectory of output directory named "pypdf2" if it does not already exist
-    misc_functions.set_up_output_subdirectory(output_directory_path, "pypdf2")
-
-    # Creating or loading image records and georeferenced link records
-    county_year_combo = '_'.join(misc_functions.normalize_dir_path(batch_directory_path).split('/')[-3:-1])
-    batch_metadata, georeferenced_link_data = process_or_load(data_gathering_mode, batch_directory_path, output_directory_path, county_year_combo)
+    # Setting output file format ('pretty', 'compact', or 'lines')
+    try:
+        output_format = sys.argv[4]
+    except:
+        output_format = OUTPUT_FORMAT
+    if output_format not in json_streaming.OUTPUT_FORMATS:
+        print('-- Invalid output format input; using {} --'.format(OUTPUT_FORMAT))
+        output_format = OUTPUT_FORMAT
 
-    index_file_name = batch_metadata['Index Records'][0]['Index File Name']
+    # Setting extraction backend
+    try:
+        extraction_backend = sys.argv[5]
+    except:
+        extraction_backend = EXTRACTION_BACKEND
 
-    # Setting up manual pairs dictionary, with image identifiers as keys and PDF Object ID numbers as their associated values
-    manual_pairs_csv_data = misc_functions.load_csv_data('input/' + MANUAL_PAIRS_FILENAME)
-    manual_pairs = {}
-    for manual_pair_dict in manual_pairs_csv_data:
-        if manual_pair_dict['Index File Name'] == index_file_name:
-            manual_pairs[manual_pair_dict['Image Identifier']] = manual_pair_dict['PDF Object ID Number']
+    # Setting run report format ('json', 'prometheus', or 'none')
+    try:
+        metrics_report_format = sys.argv[6]
+    except:
+        metrics_report_format = METRICS_REPORT_FORMAT
+    if metrics_report_format == 'none':
+        metrics_report_format = None
+    elif metrics_report_format not in pipeline_metrics.REPORT_FORMATS:
+        print('-- Invalid run report format input; using {} --'.format(METRICS_REPORT_FORMAT))
+        metrics_report_format = METRICS_REPORT_FORMAT
+
+    # Turning on profiling if 'profile' is entered
+    try:
+        profiling = sys.argv[7] == 'profile'
+    except:
+        profiling = PROFILING
 
-    # Setting up files without links dictionary, with image identifiers as keys and x and y coordinate tuples as values
-    files_without_links_csv_data = misc_functions.load_csv_data('input/' + FILES_WITHOUT_LINKS_FILENAME)
-    files_without_links = {}
-    for file_without_link_dict in files_without_links_csv_data:
-        if file_without_link_dict['Index File Name'] == index_file_name:
-            files_without_links[file_without_link_dict['File Identifier']] = (file_without_link_dict['GIMP X Coordinate'], file_without_link_dict['GIMP Y Coordinate'])
+    # Setting columnar table format ('parquet', 'arrow', or 'none')
+    try:
+        columnar_format = sys.argv[8]
+    except:
+        columnar_format = COLUMNAR_FORMAT
+    if columnar_format == 'none':
+        columnar_format = None
+    elif columnar_format is not None and columnar_format not in columnar_export.COLUMNAR_FORMATS:
+        print('-- Invalid columnar format input; writing JSON only --')
+        columnar_format = None
+
+    # Turning on derivative creation if 'derivatives' is entered
+    try:
+        create_derivatives = sys.argv[9] == 'derivatives'
+    except:
+        create_derivatives = CREATE_DERIVATIVES
 
-    # Running matching algorithm
-    full_image_records, match_issues = match_and_combine_records(batch_metadata, georeferenced_link_data, manual_pairs, files_without_links)
+    # Turning on footprint polygons if 'footprints' is entered
+    try:
+        footprints = sys.argv[10] == 'footprints'
+    except:
+        footprints = FOOTPRINTS
 
-    # Writing full records to output file
-    full_image_records_file = open(output_directory_path + 'dte_aerial_{}_image_records.json'.format(county_year_combo), 'w', encoding='utf-8')
-    full_image_records_file.write(json.dumps(full_image_records, indent=4))
-    full_image_records_file.close()
+    # Create subdirectory of output directory named "pypdf2" if it does not already exist
+    misc_functions.set_up_output_subdirectory(output_directory_path, "pypdf2")
 
-    # Crosswalking records to GeoJSON and writing to output file
-    geojson_feature_collection = crosswalk_to_geojson(full_image_records)
-    geojson_file = open(output_directory_path + county_year_combo + '_image_locations.geojson', 'w', encoding='utf-8')
-    geojson_file.write(json.dumps(geojson_feature_collection, indent=4))
-    geojson_file.close()
+    # Loading manual matching data and running the workflow for the batch
+    manual_pairs_csv_data = misc_functions.load_csv_data('input/' + MANUAL_PAIRS_FILENAME)
+    files_without_links_csv_data = misc_functions.load_csv_data('input/' + FILES_WITHOUT_LINKS_FILENAME)
+    workflow_arguments = (data_gathering_mode, batch_directory_path, output_directory_path, manual_pairs_csv_data, files_without_links_csv_data, EXTRACTION_WORKERS, output_format, extraction_backend, metrics_report_format, columnar_format, create_derivatives, footprints)
+    if profiling:
+        profile_file_path = output_directory_path + make_county_year_combo(batch_directory_path) + '_profile.prof'
+        batch_summary = pipeline_metrics.run_with_profiling(profile_file_path, run_batch_workflow, *workflow_arguments)
+    else:
+        batch_summary = run_batch_workflow(*workflow_arguments)
 
     # Outputting report to command prompt
-    print('\n** Script Results Summary **')
-    if match_issues:
-        print('-- One or more matches failed, or one or more image records had multiple matches --')
-        print('-- Investigate and add data to manual_pairs.csv and files_without_links.csv --')
-    else:
-        print('++ No match issues occurred ++')
-    print('Number of image records after extraction: ' + str(len(batch_metadata['Image Records'])))
-    print('Number of link records after extraction: ' + str(len(batch_metadata['Index Records'][0]['Links'])))
-    print('Number of complete image records created: ' + str(len(full_image_records)))
+    print_batch_summary(batch_summary)
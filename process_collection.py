@@ -0,0 +1,194 @@
+# DTE Aerial Photo Collection curation project
+# Workflow running process_batch.py across every county/year batch in the collection
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# concurrent.futures documentation: https://docs.python.org/3/library/concurrent.futures.html
+
+# standard modules
+import os
+import sys
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# local modules
+import process_batch
+import json_streaming
+import misc_functions
+import pdf_catalog
+import geocoding_client
+import fixity
+import spatial_index
+import collection_tiles
+
+# global variables
+COLLECTION_SUMMARY_FILENAME = 'dte_aerial_collection_batch_summary.json'
+COLLECTION_GEOJSON_FILENAME = 'dte_aerial_collection_image_locations'
+# Number of batches processed at the same time (None uses one per CPU)
+BATCH_WORKERS = None
+# Format of the collection vector tiles ('mbtiles' or 'directory'; None skips the tile export)
+TILE_FORMAT = None
+
+## Functions
+
+# Refresh the PDF catalog for the collection directory (only directories changed since the last run are listed again),
+# and collect relative paths for all <county>/<year> directories containing PDF files from it
+def find_batch_directories(collection_directory_path, catalog_file_path=pdf_catalog.CATALOG_FILE_PATH):
+    pdf_catalog.refresh_catalog(collection_directory_path, catalog_file_path)
+    return pdf_catalog.find_batch_directories(collection_directory_path, catalog_file_path)
+
+# Run one batch inside a pool worker. Failures are caught and reported in the batch summary so one bad batch does not stop the whole run.
+def run_batch_in_worker(mode, batch_directory_path, output_directory_path, manual_pairs_csv_data, files_without_links_csv_data, output_format=process_batch.OUTPUT_FORMAT, columnar_format=process_batch.COLUMNAR_FORMAT, create_derivatives=process_batch.CREATE_DERIVATIVES, footprints=process_batch.FOOTPRINTS):
+    start = time.time()
+    try:
+        # Images are extracted (and derivatives created) serially within a batch, since the batches themselves are already spread across processes
+        batch_summary = process_batch.run_batch_workflow(mode, batch_directory_path, output_directory_path, manual_pairs_csv_data, files_without_links_csv_data, extraction_workers=1, output_format=output_format, columnar_format=columnar_format, create_derivatives=create_derivatives, footprints=footprints)
+        batch_summary['Status'] = 'Completed'
+    except Exception as error:
+        batch_summary = {
+            'County Year Combo': process_batch.make_county_year_combo(batch_directory_path),
+            'Batch Directory Path': batch_directory_path,
+            'Status': 'Failed',
+            'Error': repr(error)
+        }
+    batch_summary['Time to Run'] = time.time() - start
+    return batch_summary
+
+# Read the GeoJSON features of each completed batch from its output file, one batch at a time
+def read_collection_features(batch_summaries, output_directory_path):
+    for batch_summary in batch_summaries:
+        if batch_summary['Status'] == 'Completed':
+            for feature in json_streaming.read_geojson_features(output_directory_path + batch_summary['GeoJSON File Name']):
+                yield feature
+
+# Run the batch workflow for every batch directory on a pool of worker processes and write the consolidated outputs.
+# Returns: list of batch summary dictionaries, in the same order as batch_directory_paths
+def run_collection_workflow(mode, batch_directory_paths, output_directory_path, workers=BATCH_WORKERS, output_format=process_batch.OUTPUT_FORMAT, columnar_format=process_batch.COLUMNAR_FORMAT, create_derivatives=process_batch.CREATE_DERIVATIVES, footprints=process_batch.FOOTPRINTS, tile_format=TILE_FORMAT):
+    print('** Collection Processing: {} batches **'.format(str(len(batch_directory_paths))))
+    collection_start = time.time()
+
+    # Loading the shared CSV data once for all batches
+    manual_pairs_csv_data = misc_functions.load_csv_data('input/' + process_batch.MANUAL_PAIRS_FILENAME)
+    files_without_links_csv_data = misc_functions.load_csv_data('input/' + process_batch.FILES_WITHOUT_LINKS_FILENAME)
+
+    # Each worker process geocodes on its own, so the geocoding rate limit is divided among the batches processed at the same time
+    worker_count = max(1, min(workers or os.cpu_count() or 1, len(batch_directory_paths)))
+    batch_results = {}
+    with ProcessPoolExecutor(max_workers=worker_count, initializer=geocoding_client.share_rate_limit, initargs=(worker_count,)) as executor:
+        futures = {}
+        for batch_directory_path in batch_directory_paths:
+            future = executor.submit(run_batch_in_worker, mode, batch_directory_path, output_directory_path, manual_pairs_csv_data, files_without_links_csv_data, output_format, columnar_format, create_derivatives, footprints)
+            futures[future] = batch_directory_path
+        for future in as_completed(futures):
+            batch_summary = future.result()
+            print('~~ {}: {} ~~'.format(batch_summary['County Year Combo'], batch_summary['Status']))
+            batch_results[futures[future]] = batch_summary
+
+    # Consolidating results in batch order so output files are deterministic.
+    # Features are streamed from the batch GeoJSON files into the collection file, so only one batch is held in memory at a time.
+    batch_summaries = []
+    for batch_directory_path in batch_directory_paths:
+        batch_summaries.append(batch_results[batch_directory_path])
+    collection_geojson_file_name = json_streaming.add_file_extension(COLLECTION_GEOJSON_FILENAME, output_format, geojson=True)
+    json_streaming.write_geojson_features(output_directory_path + collection_geojson_file_name, read_collection_features(batch_summaries, output_directory_path), output_format)
+
+    # Sorting the collection's point features along a Hilbert curve and writing them as a sorted GeoJSON file and vector tiles
+    if tile_format is not None:
+        collection_tiles.export_collection_tiles(output_directory_path, json_streaming.read_geojson_features(output_directory_path + collection_geojson_file_name), tile_format)
+
+    summary_file = open(output_directory_path + COLLECTION_SUMMARY_FILENAME, 'w', encoding='utf-8')
+    summary_file.write(json.dumps(batch_summaries, indent=4))
+    summary_file.close()
+
+    print('** Time to Run: {} **'.format(str(time.time() - collection_start)))
+    return batch_summaries
+
+# Output a report on all batch summaries to command prompt
+def print_collection_summary(batch_summaries):
+    print('\n** Collection Results Summary **')
+    failed_batches = [summary for summary in batch_summaries if summary['Status'] == 'Failed']
+    issue_batches = [summary for summary in batch_summaries if summary.get('Match Issues')]
+    print('Number of batches processed: ' + str(len(batch_summaries)))
+    print('Number of complete image records created: ' + str(sum(summary.get('Number of Complete Image Records', 0) for summary in batch_summaries)))
+    for summary in issue_batches:
+        print('-- Match issues in {} --'.format(summary['County Year Combo']))
+    for summary in failed_batches:
+        print('-- Batch failed: {} ({}) --'.format(summary['County Year Combo'], summary['Error']))
+    if not failed_batches and not issue_batches:
+        print('++ No match issues occurred ++')
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Collection Processing Script **")
+
+    data_gathering_mode = sys.argv[1]
+
+    # Setting top-level collection directory
+    try:
+        collection_directory_path = sys.argv[2]
+    except:
+        collection_directory_path = 'input/pdf_files'
+
+    # Setting output directory for new files
+    try:
+        output_directory_path = misc_functions.normalize_dir_path(sys.argv[3])
+    except:
+        output_directory_path = 'output/'
+
+    # Setting number of batches to process at the same time
+    try:
+        batch_workers = int(sys.argv[4])
+    except:
+        batch_workers = BATCH_WORKERS
+
+    # In 'verify' mode, the JPEGs already in the output directory are checked against their recorded checksums instead
+    if data_gathering_mode == 'verify':
+        fixity_report = fixity.verify_output_tree(output_directory_path, batch_workers)
+        sys.exit(0 if fixity_report['Passed'] else 1)
+
+    # Setting output file format ('pretty', 'compact', or 'lines')
+    try:
+        output_format = sys.argv[5]
+    except:
+        output_format = process_batch.OUTPUT_FORMAT
+
+    # Setting columnar table format ('parquet', 'arrow', or 'none')
+    try:
+        columnar_format = sys.argv[6]
+    except:
+        columnar_format = process_batch.COLUMNAR_FORMAT
+    if columnar_format == 'none':
+        columnar_format = None
+
+    # Turning on derivative creation if 'derivatives' is entered
+    try:
+        create_derivatives = sys.argv[7] == 'derivatives'
+    except:
+        create_derivatives = process_batch.CREATE_DERIVATIVES
+
+    # Turning on footprint polygons if 'footprints' is entered
+    try:
+        footprints = sys.argv[8] == 'footprints'
+    except:
+        footprints = process_batch.FOOTPRINTS
+
+    # Setting collection vector tile format ('mbtiles', 'directory', or 'none')
+    try:
+        tile_format = sys.argv[9]
+    except:
+        tile_format = TILE_FORMAT
+    if tile_format == 'none':
+        tile_format = None
+
+    misc_functions.set_up_output_subdirectory(output_directory_path, "pypdf2")
+
+    batch_directory_paths = find_batch_directories(collection_directory_path, output_directory_path + pdf_catalog.CATALOG_FILE_NAME)
+    batch_summaries = run_collection_workflow(data_gathering_mode, batch_directory_paths, output_directory_path, batch_workers, output_format, columnar_format, create_derivatives, footprints, tile_format)
+    print_collection_summary(batch_summaries)
+
+    # Loading new or changed image records files into the spatial index
+    spatial_index.refresh_spatial_index(output_directory_path)
@@ -2,24 +2,30 @@
 # Sam Sciolla, Garrett Morton
 # SI 699
 
-#work in progress
+# The PDF version report for the whole collection is also available from the PDF catalog (see pdf_catalog.py), which only
+# reads the headers of files that are new or changed since the last scan.
 
 import json
+from collections import Counter
 
-## extract PDF version number from one PDF file
+## extract PDF version number from one PDF file (the header starts with %PDF-, followed by the version)
 def extract_pdf_version_number(target_pdf_path):
-	with open(target_pdf_path, 'r') as pdf_file:
-		version number = pdf_file.readline()[5:8]
+	with open(target_pdf_path, 'rb') as pdf_file:
+		version_number = pdf_file.readline()[5:8].decode('latin-1')
 
 	return version_number
 
-## report on PDF versions present in a list of PDF files
+## report on PDF versions present in a list of PDF files (the master list written by collect_pdf_absolute_paths.py)
 def pdf_version_number_report(pdf_path_cache_file):
 	with open(pdf_path_cache_file, 'r') as pdf_file:
-		pdf_path_list = json.loads(pdf_file.read())
+		pdf_path_list = json.loads(pdf_file.read())["master_list"]
 
-	return report
+	report = Counter()
+	for pdf_path in pdf_path_list:
+		report[extract_pdf_version_number(pdf_path)] += 1
+
+	return dict(report)
 
 
 if __name__=="__main__":
-	pdf_version_number_report("pdf_path_cache.json")
\ No newline at end of file
+	print(pdf_version_number_report("pdf_path_cache.json"))
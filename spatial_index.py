@@ -0,0 +1,450 @@
+# DTE Aerial Photo Collection curation project
+# SQLite R*Tree spatial index over the georeferenced image records, with point, bounding box, polygon, and nearest neighbor queries
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# sqlite3 documentation: https://docs.python.org/3/library/sqlite3.html
+# SQLite R*Tree module documentation: https://www.sqlite.org/rtree.html
+# http.server documentation: https://docs.python.org/3/library/http.server.html
+
+# The image records files written by process_batch.py (dte_aerial_[county]_[year]_image_records.json or .jsonl) are bulk loaded into
+# a SQLite file, spatial_index.sqlite in the output directory. Each image's bounding box (the bounds of its ArcGIS Footprint polygon, if
+# it has one, or else the point given by its ArcGIS Geocoordinates) goes in an R*Tree virtual table, and its county, year, coordinates,
+# footprint, and full record go in an ordinary table with the same row ID. Queries look up the R*Tree first, so only the records near
+# the query are read, and then check the candidates against their exact footprints or points. An image is found by a query if its
+# footprint overlaps the query's area (so a point query with a radius of 0 finds the photos covering that point). Like pdf_catalog.py,
+# the index is refreshed incrementally: the size and modification time of each records file are stored, and only new or changed files
+# are loaded again.
+# Queries can be made with the functions below or through a small HTTP server, e.g.
+#   /images/bbox?bbox=-83.1,42.3,-82.9,42.5&year=1961
+#   /images/point?lon=-83.0&lat=42.4&radius=250&county=macomb
+#   /images/nearest?lon=-83.0&lat=42.4&k=5&records=true
+#   /images/polygon?polygon=-83.01,42.40,-83.00,42.40,-83.00,42.41,-83.01,42.41
+
+# standard modules
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local modules
+import json_streaming
+import geocoding_cache
+
+# global variables
+SPATIAL_INDEX_FILE_NAME = 'spatial_index.sqlite'
+SPATIAL_INDEX_PORT = 8124
+# Version of the tables in the index file; files with another version are rebuilt
+SPATIAL_INDEX_VERSION = 2
+RECORDS_FILE_PREFIX = 'dte_aerial_'
+RECORDS_FILE_SUFFIXES = ['_image_records.json', '_image_records.jsonl']
+# Distance from a point within which images are found by point queries, in meters
+POINT_QUERY_RADIUS_METERS = 100
+# Radius of the first search window for nearest neighbor queries, in meters (doubled until enough images are found)
+NEAREST_START_RADIUS_METERS = 500
+# Most times the search window is doubled (500 meters doubled 30 times is far wider than the Earth)
+NEAREST_MAX_DOUBLINGS = 30
+NEAREST_DEFAULT_COUNT = 5
+METERS_PER_DEGREE = geocoding_cache.METERS_PER_DEGREE
+
+THREAD_CONNECTIONS = threading.local()
+
+## Functions
+
+# Open (and, if needed, create) the spatial index file. Index files written with an older version of the tables are emptied,
+# so every records file is loaded again on the next refresh.
+def open_spatial_index(index_file_path):
+    connection = sqlite3.connect(index_file_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    if connection.execute('PRAGMA user_version').fetchone()[0] != SPATIAL_INDEX_VERSION:
+        with connection:
+            for table_name in ['records_files', 'image_records', 'image_boxes', 'index_extent']:
+                connection.execute('DROP TABLE IF EXISTS {}'.format(table_name))
+            connection.execute('PRAGMA user_version = {}'.format(str(SPATIAL_INDEX_VERSION)))
+    with connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS records_files (file_name TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL)')
+        connection.execute('''CREATE TABLE IF NOT EXISTS image_records (image_id INTEGER PRIMARY KEY, records_file_name TEXT NOT NULL, file_name TEXT NOT NULL,
+            index_county TEXT, year TEXT, current_county TEXT, longitude REAL, latitude REAL, footprint TEXT, record TEXT NOT NULL)''')
+        connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS image_boxes USING rtree(image_id, min_longitude, max_longitude, min_latitude, max_latitude)')
+        connection.execute('CREATE TABLE IF NOT EXISTS index_extent (min_longitude REAL, max_longitude REAL, min_latitude REAL, max_latitude REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS image_records_files ON image_records (records_file_name)')
+    return connection
+
+# List the image records files in an output directory, with their sizes and modification times
+def list_records_files(output_directory_path):
+    records_files = {}
+    with os.scandir(output_directory_path) as dir_objects:
+        for dir_object in dir_objects:
+            if dir_object.is_file() and dir_object.name.startswith(RECORDS_FILE_PREFIX) and dir_object.name.endswith(tuple(RECORDS_FILE_SUFFIXES)):
+                file_stats = dir_object.stat()
+                records_files[dir_object.name] = (file_stats.st_size, file_stats.st_mtime_ns)
+    return records_files
+
+# Find the bounding box of a ring of [longitude, latitude] pairs, as (min longitude, max longitude, min latitude, max latitude)
+def find_ring_box(ring):
+    longitudes = [point[0] for point in ring]
+    latitudes = [point[1] for point in ring]
+    return (min(longitudes), max(longitudes), min(latitudes), max(latitudes))
+
+# Find the point and footprint of an image record. Returns: the longitude and latitude (None if it has no location) and the footprint ring (or None)
+def find_record_geometry(record):
+    descriptive_metadata = record['Descriptive']
+    geocoordinates = descriptive_metadata.get('ArcGIS Geocoordinates')
+    if not geocoordinates or geocoordinates.get('Longitude') is None or geocoordinates.get('Latitude') is None:
+        return None, None, None
+    footprint = descriptive_metadata.get('ArcGIS Footprint')
+    if footprint is not None:
+        footprint = [[float(point[0]), float(point[1])] for point in footprint]
+    return float(geocoordinates['Longitude']), float(geocoordinates['Latitude']), footprint
+
+# Find the bounding box of an image's point and footprint, as (min longitude, max longitude, min latitude, max latitude)
+def find_record_box(longitude, latitude, footprint=None):
+    if footprint is None:
+        return (longitude, longitude, latitude, latitude)
+    return find_ring_box(footprint + [[longitude, latitude]])
+
+# Create the image_records and image_boxes rows for the records of one file, numbering them from first_image_id
+def make_record_rows(records_file_name, records, first_image_id):
+    record_rows = []
+    box_rows = []
+    image_id = first_image_id
+    for record in records:
+        descriptive_metadata = record['Descriptive']
+        longitude, latitude, footprint = find_record_geometry(record)
+        record_rows.append((image_id, records_file_name, record['File Name'], descriptive_metadata.get('Index County'), descriptive_metadata.get('Year'),
+            descriptive_metadata.get('ArcGIS Current County'), longitude, latitude, json.dumps(footprint) if footprint is not None else None, json.dumps(record)))
+        if longitude is not None:
+            box_rows.append((image_id,) + find_record_box(longitude, latitude, footprint))
+        image_id += 1
+    return record_rows, box_rows
+
+# Remove the records loaded from a records file from the index
+def remove_records_file(connection, records_file_name):
+    connection.execute('DELETE FROM image_boxes WHERE image_id IN (SELECT image_id FROM image_records WHERE records_file_name = ?)', (records_file_name,))
+    connection.execute('DELETE FROM image_records WHERE records_file_name = ?', (records_file_name,))
+    connection.execute('DELETE FROM records_files WHERE file_name = ?', (records_file_name,))
+
+# Load the image records files in an output directory into the spatial index, skipping files that have not changed since they were loaded.
+# Records of files that were changed or removed are replaced or removed. Returns: dictionary of counts
+def refresh_spatial_index(output_directory_path, index_file_path=None):
+    if index_file_path is None:
+        index_file_path = os.path.join(output_directory_path, SPATIAL_INDEX_FILE_NAME)
+    refresh_start = time.time()
+    connection = open_spatial_index(index_file_path)
+    records_files = list_records_files(output_directory_path)
+    indexed_files = {}
+    for file_name, size, mtime_ns in connection.execute('SELECT file_name, size, mtime_ns FROM records_files'):
+        indexed_files[file_name] = (size, mtime_ns)
+
+    refresh_counts = {'Records Files Loaded': 0, 'Records Files Unchanged': 0, 'Records Files Removed': 0, 'Image Records Loaded': 0}
+    with connection:
+        for file_name in indexed_files:
+            if file_name not in records_files:
+                remove_records_file(connection, file_name)
+                refresh_counts['Records Files Removed'] += 1
+        next_image_id = connection.execute('SELECT COALESCE(MAX(image_id), 0) + 1 FROM image_records').fetchone()[0]
+        for file_name in sorted(records_files):
+            if indexed_files.get(file_name) == records_files[file_name]:
+                refresh_counts['Records Files Unchanged'] += 1
+                continue
+            remove_records_file(connection, file_name)
+            records = json_streaming.read_json_records(os.path.join(output_directory_path, file_name))
+            record_rows, box_rows = make_record_rows(file_name, records, next_image_id)
+            connection.executemany('INSERT INTO image_records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', record_rows)
+            connection.executemany('INSERT INTO image_boxes VALUES (?, ?, ?, ?, ?)', box_rows)
+            connection.execute('INSERT INTO records_files VALUES (?, ?, ?)', (file_name,) + records_files[file_name])
+            next_image_id += len(record_rows)
+            refresh_counts['Records Files Loaded'] += 1
+            refresh_counts['Image Records Loaded'] += len(record_rows)
+        # Storing the extent of all boxes, so nearest neighbor queries know when they have searched everywhere
+        connection.execute('DELETE FROM index_extent')
+        connection.execute('INSERT INTO index_extent SELECT MIN(min_longitude), MAX(max_longitude), MIN(min_latitude), MAX(max_latitude) FROM image_boxes')
+    refresh_counts['Image Records Indexed'] = connection.execute('SELECT COUNT(*) FROM image_records').fetchone()[0]
+    connection.close()
+    print('** Spatial index: loaded {} of {} records files ({} records) in {:.2f} seconds; {} records indexed **'.format(
+        str(refresh_counts['Records Files Loaded']), str(len(records_files)), str(refresh_counts['Image Records Loaded']),
+        time.time() - refresh_start, str(refresh_counts['Image Records Indexed'])))
+    return refresh_counts
+
+# Convert a row from a query to a result dictionary, with the full record if it was selected
+def make_query_result(row):
+    query_result = {
+        'File Name': row[0],
+        'Index County': row[1],
+        'Year': row[2],
+        'ArcGIS Current County': row[3],
+        'Longitude': row[4],
+        'Latitude': row[5],
+        'Footprint': json.loads(row[6]) if row[6] is not None else None
+    }
+    if len(row) > 7:
+        query_result['Record'] = json.loads(row[7])
+    return query_result
+
+# Find the images whose boxes in the R*Tree overlap a bounding box, optionally only those from one year or index county.
+# The R*Tree stores coordinates as 32-bit floats (rounded outward), so the candidates still need to be checked against their exact geometries.
+# Returns: list of result dictionaries (see make_query_result), with the full records if include_records is True
+def find_candidate_images(connection, min_longitude, min_latitude, max_longitude, max_latitude, year=None, county=None, include_records=False):
+    query = 'SELECT r.file_name, r.index_county, r.year, r.current_county, r.longitude, r.latitude, r.footprint{} FROM image_boxes b JOIN image_records r ON r.image_id = b.image_id'.format(', r.record' if include_records else '')
+    query += ' WHERE b.min_longitude <= ? AND b.max_longitude >= ? AND b.min_latitude <= ? AND b.max_latitude >= ?'
+    parameters = [max_longitude, min_longitude, max_latitude, min_latitude]
+    if year is not None:
+        query += ' AND r.year = ?'
+        parameters.append(str(year))
+    if county is not None:
+        query += ' AND r.index_county = ? COLLATE NOCASE'
+        parameters.append(county)
+    query_results = []
+    for row in connection.execute(query, parameters):
+        query_results.append(make_query_result(row))
+    return query_results
+
+# Check whether a point is inside a ring of [longitude, latitude] pairs (points on the edge may go either way), by counting edge crossings
+def check_point_in_ring(longitude, latitude, ring):
+    inside = False
+    for point_one, point_two in zip(ring, ring[1:] + ring[:1]):
+        if (point_one[1] > latitude) != (point_two[1] > latitude):
+            crossing_longitude = point_one[0] + (latitude - point_one[1]) * (point_two[0] - point_one[0]) / (point_two[1] - point_one[1])
+            if longitude < crossing_longitude:
+                inside = not inside
+    return inside
+
+# Find which side of the line through point_one and point_two point_three is on: positive for the left, negative for the right, 0 if on it
+def find_orientation(point_one, point_two, point_three):
+    return (point_two[0] - point_one[0]) * (point_three[1] - point_one[1]) - (point_two[1] - point_one[1]) * (point_three[0] - point_one[0])
+
+# Check whether two line segments intersect (including touching)
+def check_segments_intersect(point_one, point_two, point_three, point_four):
+    orientations = [find_orientation(point_one, point_two, point_three), find_orientation(point_one, point_two, point_four),
+        find_orientation(point_three, point_four, point_one), find_orientation(point_three, point_four, point_two)]
+    if ((orientations[0] > 0) != (orientations[1] > 0) and orientations[0] != 0 and orientations[1] != 0
+            and (orientations[2] > 0) != (orientations[3] > 0) and orientations[2] != 0 and orientations[3] != 0):
+        return True
+    # Collinear cases: a point on the other segment
+    for orientation, segment_start, segment_end, point in [(orientations[0], point_one, point_two, point_three), (orientations[1], point_one, point_two, point_four),
+            (orientations[2], point_three, point_four, point_one), (orientations[3], point_three, point_four, point_two)]:
+        if orientation == 0 and min(segment_start[0], segment_end[0]) <= point[0] <= max(segment_start[0], segment_end[0]) \
+                and min(segment_start[1], segment_end[1]) <= point[1] <= max(segment_start[1], segment_end[1]):
+            return True
+    return False
+
+# Check whether two rings of [longitude, latitude] pairs overlap: one contains a point of the other, or their edges cross
+def check_rings_intersect(ring_one, ring_two):
+    if check_point_in_ring(ring_one[0][0], ring_one[0][1], ring_two) or check_point_in_ring(ring_two[0][0], ring_two[0][1], ring_one):
+        return True
+    for point_one, point_two in zip(ring_one, ring_one[1:] + ring_one[:1]):
+        for point_three, point_four in zip(ring_two, ring_two[1:] + ring_two[:1]):
+            if check_segments_intersect(point_one, point_two, point_three, point_four):
+                return True
+    return False
+
+# Check whether an image (its footprint, or else its point) overlaps a ring of [longitude, latitude] pairs
+def check_image_intersects_ring(query_result, ring):
+    if query_result['Footprint'] is not None:
+        return check_rings_intersect(query_result['Footprint'], ring)
+    return check_point_in_ring(query_result['Longitude'], query_result['Latitude'], ring)
+
+# Create a ring from a bounding box
+def make_bbox_ring(min_longitude, min_latitude, max_longitude, max_latitude):
+    return [[min_longitude, min_latitude], [max_longitude, min_latitude], [max_longitude, max_latitude], [min_longitude, max_latitude]]
+
+# Find the images whose footprints (or points) overlap a bounding box, optionally only those from one year or index county.
+# Returns: list of result dictionaries (see make_query_result), with the full records if include_records is True
+def find_images_in_bbox(connection, min_longitude, min_latitude, max_longitude, max_latitude, year=None, county=None, include_records=False):
+    query_results = []
+    for query_result in find_candidate_images(connection, min_longitude, min_latitude, max_longitude, max_latitude, year, county, include_records):
+        if query_result['Footprint'] is not None:
+            if check_rings_intersect(query_result['Footprint'], make_bbox_ring(min_longitude, min_latitude, max_longitude, max_latitude)):
+                query_results.append(query_result)
+        elif min_longitude <= query_result['Longitude'] <= max_longitude and min_latitude <= query_result['Latitude'] <= max_latitude:
+            query_results.append(query_result)
+    return query_results
+
+# Find the images whose footprints (or points) overlap a polygon (e.g. a parcel), given as a ring of [longitude, latitude] pairs
+def find_images_in_polygon(connection, ring, year=None, county=None, include_records=False):
+    min_longitude, max_longitude, min_latitude, max_latitude = find_ring_box(ring)
+    query_results = []
+    for query_result in find_candidate_images(connection, min_longitude, min_latitude, max_longitude, max_latitude, year, county, include_records):
+        if check_image_intersects_ring(query_result, ring):
+            query_results.append(query_result)
+    return query_results
+
+# Find the bounding box reaching radius_meters around a point, as (min longitude, min latitude, max longitude, max latitude)
+def find_radius_bbox(longitude, latitude, radius_meters):
+    latitude_radius = radius_meters / METERS_PER_DEGREE
+    longitude_radius = latitude_radius / max(math.cos(math.radians(latitude)), 0.01)
+    return (longitude - longitude_radius, latitude - latitude_radius, longitude + longitude_radius, latitude + latitude_radius)
+
+# Find the distance in meters from a point to a footprint ring: 0 if the point is inside, or else the distance to the nearest edge
+# (measured on a plane tangent at the point, which is accurate over the size of a photo)
+def find_distance_to_ring(longitude, latitude, ring):
+    if check_point_in_ring(longitude, latitude, ring):
+        return 0.0
+    longitude_scale = METERS_PER_DEGREE * math.cos(math.radians(latitude))
+    plane_points = [((point[0] - longitude) * longitude_scale, (point[1] - latitude) * METERS_PER_DEGREE) for point in ring]
+    distances = []
+    for point_one, point_two in zip(plane_points, plane_points[1:] + plane_points[:1]):
+        edge_x, edge_y = point_two[0] - point_one[0], point_two[1] - point_one[1]
+        edge_length_squared = edge_x ** 2 + edge_y ** 2
+        share = 0.0 if edge_length_squared == 0 else max(0.0, min(1.0, -(point_one[0] * edge_x + point_one[1] * edge_y) / edge_length_squared))
+        distances.append(math.hypot(point_one[0] + share * edge_x, point_one[1] + share * edge_y))
+    return min(distances)
+
+# Find the distance in meters from a point to an image: to its footprint, if it has one, or else to its point
+def find_distance_to_image(longitude, latitude, query_result):
+    if query_result['Footprint'] is not None:
+        return find_distance_to_ring(longitude, latitude, query_result['Footprint'])
+    return geocoding_cache.find_distance_in_meters(longitude, latitude, query_result['Longitude'], query_result['Latitude'])
+
+# Find the images within radius_meters of a point, nearest first; with a radius of 0, only the images whose footprints cover the point.
+# Results have a 'Distance' in meters.
+def find_images_near_point(connection, longitude, latitude, radius_meters=POINT_QUERY_RADIUS_METERS, year=None, county=None, include_records=False):
+    min_longitude, min_latitude, max_longitude, max_latitude = find_radius_bbox(longitude, latitude, radius_meters)
+    query_results = []
+    for query_result in find_candidate_images(connection, min_longitude, min_latitude, max_longitude, max_latitude, year, county, include_records):
+        query_result['Distance'] = find_distance_to_image(longitude, latitude, query_result)
+        if query_result['Distance'] <= radius_meters:
+            query_results.append(query_result)
+    return sorted(query_results, key=lambda query_result: query_result['Distance'])
+
+# Check whether a bounding box (as returned by find_radius_bbox) covers the extent of every box in the index
+def check_bbox_covers_index(connection, bbox):
+    extent = connection.execute('SELECT min_longitude, max_longitude, min_latitude, max_latitude FROM index_extent').fetchone()
+    if extent is None or extent[0] is None:
+        return True
+    return bbox[0] <= extent[0] and bbox[2] >= extent[1] and bbox[1] <= extent[2] and bbox[3] >= extent[3]
+
+# Find the count images nearest to a point, nearest first. The search window starts at NEAREST_START_RADIUS_METERS and is doubled
+# until it holds count images within its radius (any image outside the window is farther away than that), covers the whole index,
+# or has been doubled NEAREST_MAX_DOUBLINGS times.
+def find_nearest_images(connection, longitude, latitude, count=NEAREST_DEFAULT_COUNT, year=None, county=None, include_records=False):
+    radius_meters = NEAREST_START_RADIUS_METERS
+    for doubling_number in range(NEAREST_MAX_DOUBLINGS + 1):
+        query_results = find_images_near_point(connection, longitude, latitude, radius_meters, year, county, include_records)
+        if len(query_results) >= count or check_bbox_covers_index(connection, find_radius_bbox(longitude, latitude, radius_meters)):
+            break
+        radius_meters *= 2
+    return query_results[:count]
+
+# Parse a comma-separated list of finite numbers from a URL parameter, raising ValueError for other values (e.g. 'nan' or 'inf')
+def parse_number_parameter(parameter_name, parameter_value):
+    values = [float(value) for value in parameter_value.split(',')]
+    if not all(math.isfinite(value) for value in values):
+        raise ValueError('{} must only have finite numbers'.format(parameter_name))
+    return values
+
+# Parse a polygon from a URL parameter: a comma-separated list of longitudes and latitudes (e.g. '-83.01,42.40,-83.00,42.40,-83.00,42.41')
+def parse_polygon_parameter(polygon_parameter):
+    values = parse_number_parameter('polygon', polygon_parameter)
+    if len(values) < 6 or len(values) % 2 != 0:
+        raise ValueError('polygon must have at least three longitude and latitude pairs')
+    return [[values[position], values[position + 1]] for position in range(0, len(values), 2)]
+
+# Return the spatial index connection for the current server thread (SQLite connections cannot be shared between threads)
+def get_thread_connection(index_file_path):
+    if getattr(THREAD_CONNECTIONS, 'connection', None) is None:
+        THREAD_CONNECTIONS.connection = open_spatial_index(index_file_path)
+    return THREAD_CONNECTIONS.connection
+
+# Answer a query from the HTTP server. Arguments: the query name ('bbox', 'point', 'nearest', or 'polygon') and the URL parameters.
+# Returns: dictionary with the query results. Raises ValueError (or KeyError) for invalid queries.
+def answer_query(connection, query_name, parameters):
+    year = parameters.get('year', [None])[0]
+    county = parameters.get('county', [None])[0]
+    include_records = parameters.get('records', ['false'])[0].lower() == 'true'
+    query_start = time.perf_counter()
+    if query_name == 'bbox':
+        bbox = parse_number_parameter('bbox', parameters['bbox'][0])
+        if len(bbox) != 4:
+            raise ValueError('bbox must have four values: min longitude, min latitude, max longitude, max latitude')
+        query_results = find_images_in_bbox(connection, bbox[0], bbox[1], bbox[2], bbox[3], year, county, include_records)
+    elif query_name == 'point':
+        longitude, latitude = parse_number_parameter('lon', parameters['lon'][0])[0], parse_number_parameter('lat', parameters['lat'][0])[0]
+        radius_meters = parse_number_parameter('radius', str(parameters.get('radius', [POINT_QUERY_RADIUS_METERS])[0]))[0]
+        if radius_meters < 0:
+            raise ValueError('radius must not be negative')
+        query_results = find_images_near_point(connection, longitude, latitude, radius_meters, year, county, include_records)
+    elif query_name == 'nearest':
+        longitude, latitude = parse_number_parameter('lon', parameters['lon'][0])[0], parse_number_parameter('lat', parameters['lat'][0])[0]
+        count = int(parameters.get('k', [NEAREST_DEFAULT_COUNT])[0])
+        if count < 1:
+            raise ValueError('k must be at least 1')
+        query_results = find_nearest_images(connection, longitude, latitude, count, year, county, include_records)
+    elif query_name == 'polygon':
+        query_results = find_images_in_polygon(connection, parse_polygon_parameter(parameters['polygon'][0]), year, county, include_records)
+    else:
+        raise ValueError('Unknown query: {}'.format(query_name))
+    return {
+        'Query': query_name,
+        'Number of Images': len(query_results),
+        'Query Milliseconds': (time.perf_counter() - query_start) * 1000,
+        'Images': query_results
+    }
+
+# Request handler answering spatial index queries (http.server handles requests with a handler class).
+# The index file path is set on the server as index_file_path.
+class SpatialIndexHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        path_parts = parsed_url.path.strip('/').split('/')
+        if len(path_parts) != 2 or path_parts[0] != 'images':
+            self.send_json(404, {'error': 'Unknown path: {}'.format(parsed_url.path)})
+            return
+        connection = get_thread_connection(self.server.index_file_path)
+        try:
+            self.send_json(200, answer_query(connection, path_parts[1], parse_qs(parsed_url.query)))
+        except (KeyError, ValueError) as error:
+            self.send_json(400, {'error': 'Invalid query: {}'.format(error)})
+
+    def send_json(self, status_code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Create the HTTP server for a spatial index file (port 0 picks a free port); start it with its serve_forever method
+def create_spatial_index_server(index_file_path, port=SPATIAL_INDEX_PORT):
+    spatial_index_server = ThreadingHTTPServer(('127.0.0.1', port), SpatialIndexHandler)
+    spatial_index_server.daemon_threads = True
+    spatial_index_server.index_file_path = index_file_path
+    return spatial_index_server
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Spatial Index **")
+
+    # Setting output directory holding the image records files
+    try:
+        output_directory_path = sys.argv[1]
+    except:
+        output_directory_path = 'output/'
+
+    # Setting port for the HTTP server
+    try:
+        port = int(sys.argv[2])
+    except:
+        port = SPATIAL_INDEX_PORT
+
+    index_file_path = os.path.join(output_directory_path, SPATIAL_INDEX_FILE_NAME)
+    refresh_spatial_index(output_directory_path, index_file_path)
+    spatial_index_server = create_spatial_index_server(index_file_path, port)
+    print('** Serving at http://127.0.0.1:{}/images/ **'.format(str(port)))
+    try:
+        spatial_index_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
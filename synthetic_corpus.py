@@ -0,0 +1,192 @@
+# DTE Aerial Photo Collection curation project
+# Generator for synthetic image and index PDFs with the same structure as the collection's PDFs
+# Garrett Morton, Sam Sciolla
+# SI 699
+
+# Written and tested using Python 3.7.0
+
+# JPEG specification (ITU T.81): https://www.w3.org/Graphics/JPEG/itu-t81.pdf
+# PDF 1.7 specification (ISO 32000-1): https://www.adobe.com/content/dam/acom/en/devnet/pdf/pdfs/PDF32000_2008.pdf
+# csv documentation: https://docs.python.org/3/library/csv.html
+
+# The synthetic PDFs are used to benchmark the extraction backends without the collection's PDFs. Each image PDF holds one
+# page with one DCTDecode image XObject; each index PDF holds one page with a launch link annotation for every image PDF.
+# The JPEGs are valid, decodable grayscale images (a uniform gray), padded with comment segments to reach realistic file sizes.
+# The index page grows to fit its link grid, so one index can hold thousands of links. Synthetic batches also come with
+# address pair and control point rows whose addresses name their own PDF coordinates (e.g. "Synthetic Road 100 and
+# Synthetic Avenue 120, Synthetic Township, MI"), so geocode_synthetic_address() can stand in for a geocoding service offline.
+
+# standard modules
+import os
+import re
+import sys
+import csv
+import math
+import struct
+
+# global variables
+IMAGE_WIDTH = 5354
+IMAGE_HEIGHT = 5100
+# Approximate size of each image PDF, in bytes (the collection's scans are several megabytes each)
+IMAGE_FILE_SIZE = 4 * 1024 * 1024
+INDEX_PAGE_SIZE = 3000
+# Number of link annotations in each row of the index page
+LINKS_PER_ROW = 40
+MAX_COMMENT_SIZE = 65000
+# Geocoordinates of the PDF origin of synthetic index pages, and the degrees of longitude or latitude covered by one PDF unit
+SYNTHETIC_ORIGIN = (-83.4, 42.2)
+DEGREES_PER_PDF_UNIT = 0.00002
+SYNTHETIC_ADDRESS_PATTERN = re.compile(r'Synthetic Road ([0-9.]+) and Synthetic Avenue ([0-9.]+)')
+ADDRESS_PAIR_HEADERS = ['Index File Name', 'Address 1', 'Address 1 GIMP X Coordinate', 'Address 1 GIMP Y Coordinate', 'Address 2', 'Address 2 GIMP X Coordinate', 'Address 2 GIMP Y Coordinate']
+CONTROL_POINT_HEADERS = ['Index File Name', 'Address', 'GIMP X Coordinate', 'GIMP Y Coordinate']
+
+## Functions
+
+# Create the bytes of a baseline grayscale JPEG, padded with comment segments until it is at least padding_size bytes long.
+# Its Huffman tables have a single one-bit code, so all-zero scan data decodes as a uniform gray image.
+def create_jpeg_data(width, height, padding_size=0):
+    jpeg_data = bytearray(b'\xff\xd8')
+    jpeg_data += b'\xff\xdb' + struct.pack('>H', 67) + b'\x00' + bytes([1] * 64)
+    jpeg_data += b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    jpeg_data += b'\xff\xc4' + struct.pack('>H', 20) + b'\x00' + bytes([1] + [0] * 15) + b'\x00'
+    jpeg_data += b'\xff\xc4' + struct.pack('>H', 20) + b'\x10' + bytes([1] + [0] * 15) + b'\x00'
+    block_count = ((width + 7) // 8) * ((height + 7) // 8)
+    scan_data_size = (block_count * 2 + 7) // 8
+    remaining_padding = padding_size - len(jpeg_data) - scan_data_size - 16
+    while remaining_padding > 0:
+        comment_size = min(remaining_padding, MAX_COMMENT_SIZE)
+        jpeg_data += b'\xff\xfe' + struct.pack('>H', comment_size + 2) + b' ' * comment_size
+        remaining_padding -= comment_size + 4
+    jpeg_data += b'\xff\xda' + struct.pack('>HB', 8, 1) + b'\x01\x00\x00\x3f\x00'
+    jpeg_data += bytes(scan_data_size)
+    jpeg_data += b'\xff\xd9'
+    return bytes(jpeg_data)
+
+# Create the bytes of a PDF from a list of object bodies (object numbers start at 1, and the first object is the catalog)
+def create_pdf_data(object_bodies):
+    pdf_data = bytearray(b'%PDF-1.3\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for object_number, object_body in enumerate(object_bodies, 1):
+        offsets.append(len(pdf_data))
+        pdf_data += '{} 0 obj\n'.format(object_number).encode('ascii') + object_body + b'\nendobj\n'
+    xref_offset = len(pdf_data)
+    pdf_data += 'xref\n0 {}\n0000000000 65535 f \n'.format(len(object_bodies) + 1).encode('ascii')
+    for offset in offsets:
+        pdf_data += '{:010d} 00000 n \n'.format(offset).encode('ascii')
+    pdf_data += 'trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(len(object_bodies) + 1, xref_offset).encode('ascii')
+    return bytes(pdf_data)
+
+# Write an image PDF containing one JPEG of the given dimensions, about file_size bytes long
+def create_image_pdf(file_path, width=IMAGE_WIDTH, height=IMAGE_HEIGHT, file_size=IMAGE_FILE_SIZE):
+    jpeg_data = create_jpeg_data(width, height, file_size - 1024)
+    image_dictionary = '<< /Type /XObject /Subtype /Image /Width {} /Height {} /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode /Length {} >>'.format(width, height, len(jpeg_data))
+    contents = 'q {} 0 0 {} 0 0 cm /Im0 Do Q'.format(width, height).encode('ascii')
+    object_bodies = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] /Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>'.format(width, height).encode('ascii'),
+        image_dictionary.encode('ascii') + b'\nstream\n' + jpeg_data + b'\nendstream',
+        '<< /Length {} >>\nstream\n'.format(len(contents)).encode('ascii') + contents + b'\nendstream'
+    ]
+    pdf_file = open(file_path, 'wb')
+    pdf_file.write(create_pdf_data(object_bodies))
+    pdf_file.close()
+
+# Find the number of links in each row of an index grid holding link_count links (rows get longer for large grids, so the page stays roughly square)
+def find_links_per_row(link_count):
+    return max(LINKS_PER_ROW, math.ceil(math.sqrt(link_count * 1.5)))
+
+# Find the PDF rectangle of the link for the image at a position in the index grid
+def find_link_rectangle(link_position, links_per_row=LINKS_PER_ROW):
+    x = 100 + (link_position % links_per_row) * 60
+    y = 100 + (link_position // links_per_row) * 40
+    return [x, y, x + 50, y + 20]
+
+# Find the width and height of an index page large enough for a grid of link_count links
+def find_index_page_size(link_count):
+    links_per_row = find_links_per_row(link_count)
+    row_count = math.ceil(link_count / links_per_row)
+    return [max(INDEX_PAGE_SIZE, 200 + links_per_row * 60), max(INDEX_PAGE_SIZE, 200 + row_count * 40)]
+
+# Write an index PDF with a launch link annotation for each linked image PDF file name, laid out in a grid
+def create_index_pdf(file_path, linked_file_names):
+    object_bodies = [b'<< /Type /Catalog /Pages 2 0 R >>', b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>', None]
+    annotation_references = []
+    links_per_row = find_links_per_row(len(linked_file_names))
+    page_width, page_height = find_index_page_size(len(linked_file_names))
+    for link_position, linked_file_name in enumerate(linked_file_names):
+        rectangle = ' '.join(str(value) for value in find_link_rectangle(link_position, links_per_row))
+        annotation = '<< /Type /Annot /Subtype /Link /Rect [{}] /Border [0 0 0] /A << /S /Launch /F << /Type /Filespec /F ({}) >> >> >>'.format(rectangle, linked_file_name)
+        object_bodies.append(annotation.encode('latin-1'))
+        annotation_references.append('{} 0 R'.format(len(object_bodies)))
+    object_bodies[2] = '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] /Annots [{}] >>'.format(page_width, page_height, ' '.join(annotation_references)).encode('ascii')
+    pdf_file = open(file_path, 'wb')
+    pdf_file.write(create_pdf_data(object_bodies))
+    pdf_file.close()
+
+# Convert PDF coordinates on a synthetic index page to the longitude and latitude of that point
+def find_synthetic_geocoordinates(x_value, y_value):
+    return (SYNTHETIC_ORIGIN[0] + x_value * DEGREES_PER_PDF_UNIT, SYNTHETIC_ORIGIN[1] + y_value * DEGREES_PER_PDF_UNIT)
+
+# Make a synthetic street intersection address naming a point's PDF coordinates
+def make_synthetic_address(x_value, y_value):
+    return 'Synthetic Road {} and Synthetic Avenue {}, Synthetic Township, MI'.format(x_value, y_value)
+
+# Find the longitude and latitude of a synthetic address. Returns: longitude latitude pair, or None if the address is not synthetic
+def geocode_synthetic_address(address):
+    address_match = SYNTHETIC_ADDRESS_PATTERN.search(address)
+    if address_match is None:
+        return None
+    return find_synthetic_geocoordinates(float(address_match.group(1)), float(address_match.group(2)))
+
+# Append rows for a synthetic index to an address pairs CSV and a control points CSV (in the formats of input/address_pairs.csv and
+# input/control_points.csv), writing the headers when the files are new. The control points are near three corners of the link grid.
+def write_georeferencing_csv_rows(address_pairs_file_path, control_points_file_path, index_file_name, link_count):
+    page_width, page_height = find_index_page_size(link_count)
+    corner_points = [(100, 100), (page_width - 100, page_height - 100), (page_width - 100, 100)]
+    csv_rows = [
+        (address_pairs_file_path, ADDRESS_PAIR_HEADERS, [index_file_name, make_synthetic_address(*corner_points[0]), corner_points[0][0], corner_points[0][1], make_synthetic_address(*corner_points[1]), corner_points[1][0], corner_points[1][1]]),
+        (control_points_file_path, CONTROL_POINT_HEADERS, [index_file_name, make_synthetic_address(*corner_points[2]), corner_points[2][0], corner_points[2][1]])
+    ]
+    for file_path, headers, row in csv_rows:
+        new_file = not os.path.exists(file_path)
+        csv_file = open(file_path, 'a', newline='', encoding='utf-8')
+        csv_writer = csv.writer(csv_file)
+        if new_file:
+            csv_writer.writerow(headers)
+        csv_writer.writerow(row)
+        csv_file.close()
+
+# Make the index PDF file name for a county and year, like the collection's (e.g. macomb61Index.pdf)
+def make_index_file_name(county, year):
+    return county + year[-2:] + 'Index.pdf'
+
+# Create a [county]/[year] batch directory with an index PDF and image_count image PDFs named like the collection's files (e.g. fm-1-10.pdf)
+# Returns: relative path to the batch directory
+def create_synthetic_batch(collection_directory_path, county='synthetic', year='1961', image_count=100, file_size=IMAGE_FILE_SIZE, width=IMAGE_WIDTH, height=IMAGE_HEIGHT):
+    batch_directory_path = os.path.join(collection_directory_path, county, year)
+    os.makedirs(batch_directory_path, exist_ok=True)
+    image_file_names = []
+    for image_position in range(image_count):
+        image_file_name = 'fm-{}-{}.pdf'.format(str(image_position // 100), str(image_position % 100))
+        create_image_pdf(os.path.join(batch_directory_path, image_file_name), width, height, file_size)
+        image_file_names.append(image_file_name)
+    create_index_pdf(os.path.join(batch_directory_path, make_index_file_name(county, year)), image_file_names)
+    print('** Created {} image PDFs and an index PDF in {} **'.format(str(image_count), batch_directory_path))
+    return batch_directory_path.replace(os.sep, '/')
+
+## Main Program
+
+if __name__=="__main__":
+    print("\n** DTE Aerial Synthetic Corpus Generator **")
+    try:
+        collection_directory_path = sys.argv[1]
+    except:
+        collection_directory_path = 'input/synthetic_pdf_files'
+    try:
+        image_count = int(sys.argv[2])
+    except:
+        image_count = 100
+    create_synthetic_batch(collection_directory_path, image_count=image_count)
+    # Address pair and control point rows for the synthetic index are written next to the batch directories
+    write_georeferencing_csv_rows(os.path.join(collection_directory_path, 'address_pairs.csv'), os.path.join(collection_directory_path, 'control_points.csv'), make_index_file_name('synthetic', '1961'), image_count)